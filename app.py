@@ -1,82 +1,21 @@
 import streamlit as st
-import requests
-import json
-import random
-from typing import List, Dict, Optional, TypedDict, Literal
-from dataclasses import dataclass, field
+import logging
+import os
+import uuid
+from typing import List, Dict, Optional
 import time
-import json
-from enum import Enum
-
-class RelationshipLevel(Enum):
-    HOSTILE = -2
-    UNFRIENDLY = -1
-    NEUTRAL = 0
-    FRIENDLY = 1
-    TRUSTED = 2
-    ALLY = 3
-
-@dataclass
-class Character:
-    name: str
-    description: str
-    relationship: RelationshipLevel = RelationshipLevel.NEUTRAL
-    relationship_points: int = 0
-    last_interaction: str = ""
-    traits: List[str] = field(default_factory=list)
-    
-    def update_relationship(self, change: int):
-        """Update relationship level based on points"""
-        self.relationship_points = max(-10, min(10, self.relationship_points + change))
-        
-        # Update relationship level based on points
-        if self.relationship_points <= -7:
-            self.relationship = RelationshipLevel.HOSTILE
-        elif self.relationship_points <= -3:
-            self.relationship = RelationshipLevel.UNFRIENDLY
-        elif self.relationship_points <= 2:
-            self.relationship = RelationshipLevel.NEUTRAL
-        elif self.relationship_points <= 6:
-            self.relationship = RelationshipLevel.FRIENDLY
-        elif self.relationship_points <= 9:
-            self.relationship = RelationshipLevel.TRUSTED
-        else:
-            self.relationship = RelationshipLevel.ALLY
-
-class WorldState:
-    def __init__(self):
-        self.characters: Dict[str, Character] = {}
-        self.locations = ["Village Square", "Dark Forest", "Mystic Caverns", "Abandoned Tower"]
-        self.current_location = "Village Square"
-        self.time_of_day = "morning"
-        self.quests = {}
-        
-    def add_character(self, name: str, description: str, traits: List[str] = None):
-        if name not in self.characters:
-            self.characters[name] = Character(
-                name=name,
-                description=description,
-                traits=traits or []
-            )
-    
-    def get_character(self, name: str) -> Optional[Character]:
-        return self.characters.get(name)
-    
-    def update_character_relationship(self, name: str, change: int):
-        if name in self.characters:
-            self.characters[name].update_relationship(change)
-    
-    def to_dict(self):
-        return {
-            "characters": {name: {
-                "relationship": char.relationship.name,
-                "relationship_points": char.relationship_points,
-                "last_interaction": char.last_interaction,
-                "traits": char.traits
-            } for name, char in self.characters.items()},
-            "current_location": self.current_location,
-            "time_of_day": self.time_of_day
-        }
+from world import RelationshipLevel
+from session_store import SessionStore
+from narrative_engine import EngineThread, NarrativeEngine, TurnJob
+from scheduler import PRIORITY_NAMES, BatchScheduler
+from tracing import Tracer, serve_metrics
+from llm_client import LLMClient, LLMProvider, create_provider
+from procedural import TwistPolicy
+from router import HedgedRouter
+from response_cache import ResponseCache
+from session_recorder import SessionRecorder
+
+logger = logging.getLogger(__name__)
 
 # Custom CSS for better styling
 st.markdown("""
@@ -113,103 +52,214 @@ st.markdown("""
 # Configuration for local Llama 3.1 model
 LOCAL_MODEL_URL = "http://127.0.0.1:1234/v1/chat/completions"
 
-def query_local_model(prompt: str, system_prompt: str = None) -> str:
-    """Query the local LLM with the given prompt and optional system message."""
-    headers = {
-        "Content-Type": "application/json"
-    }
-    
-    messages = []
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    
-    messages.append({"role": "user", "content": prompt})
-    
-    data = {
-        "model": "local-model",
-        "messages": messages,
-        "temperature": 0.7,
-        "max_tokens": 500
-    }
-    
-    try:
-        response = requests.post(LOCAL_MODEL_URL, headers=headers, json=data)
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
-    except Exception as e:
-        return f"Error querying local model: {str(e)}"
-
-
-def generate_suggested_actions(story_context: str) -> List[str]:
-    """Generate suggested actions based on the current story context."""
-    system_prompt = """You are an AI that suggests 3-4 possible actions a player could take next in a text-based adventure game. 
-    Keep each suggestion short (2-5 words) and action-oriented. Return them as a JSON array of strings."""
-    
-    prompt = f"""Based on this story context, suggest 3-4 possible actions the player could take next. 
-    Return ONLY a JSON array of strings, nothing else.
-    
-    Story context: {story_context}
-    
-    Example response: ["Look around the room", "Talk to the stranger", "Open the chest", "Leave the area"]
-    """
-    
-    try:
-        response = query_local_model(prompt, system_prompt)
-        # Extract JSON array from the response
-        start = response.find('[')
-        end = response.rfind(']') + 1
-        if start != -1 and end != -1:
-            json_str = response[start:end]
-            return json.loads(json_str)
-    except Exception as e:
-        print(f"Error generating suggestions: {e}")
-    
-    # Default suggestions if generation fails
-    return ["Look around", "Search the area", "Continue forward"]
-
-def get_arc_hint(arc_progress: int) -> str:
-    """Get narrative arc hint based on progress."""
-    if arc_progress < 3:
-        return "The world feels calm, but something bigger is stirring."
-    elif arc_progress < 6:
-        return "You sense unseen forces nudging you toward a hidden truth."
-    else:
-        return "The climax draws near, every choice feels heavy with consequence."
-
-# Initialize session state
-if "story" not in st.session_state:
-    st.session_state.story = "You awaken in a quiet village at dawn..."
-    st.session_state.choices = []
-    st.session_state.arc_progress = 0
-    st.session_state.suggested_actions = []
-    st.session_state.last_choice = ""
-    st.session_state.last_twist = ""
-    st.session_state.is_loading = False
-    
-    # Initialize world state
-    st.session_state.world = WorldState()
-    
-    # Add some initial characters
-    st.session_state.world.add_character(
-        "Old Man Jenkins",
-        "An elderly villager with a long white beard and kind eyes.",
-        ["wise", "friendly", "knowledgeable"]
-    )
-    st.session_state.world.add_character(
-        "Captain Rourke",
-        "The grizzled captain of the village guard, always on the lookout for trouble.",
-        ["brave", "suspicious", "dutiful"]
+# Parallel slots of a llama.cpp server (llama-server -np); when set, each session is pinned
+# to one slot so its story prefix stays in that slot's KV cache. 0 leaves the choice to the server.
+LOCAL_MODEL_SLOTS = int(os.environ.get("LIVING_PAGES_LOCAL_SLOTS", "0"))
+
+# Show the story continuation as it is generated
+STREAM_CONTINUATION = True
+
+# Seconds between refreshes of a turn in progress
+TURN_POLL_INTERVAL = 0.25
+
+# A turn nobody has polled for this many seconds (the tab was closed) is cancelled
+TURN_ABANDON_AFTER = 30.0
+
+# Pre-generate the turn for each displayed action while the player is reading
+SPECULATIVE_TURNS = os.environ.get("LIVING_PAGES_SPECULATE", "") == "1"
+
+# How many speculative turns may run against the model at once
+SPECULATION_CONCURRENCY = 2
+
+# Which backend serves the LLM calls: "local", "gemini", or "mock" for offline development.
+# A comma-separated list ("local,gemini") routes each call to the fastest healthy backend
+# and hedges slow calls to the next one.
+LLM_PROVIDER = os.environ.get("LIVING_PAGES_PROVIDER", "local")
+
+GEMINI_MODEL = "gemini-2.5-flash"
+
+# On-disk cache of responses for prompt types that may be reused (empty path disables it)
+RESPONSE_CACHE_PATH = os.environ.get("LIVING_PAGES_CACHE", "llm_cache.sqlite3")
+
+# Append every turn played (action, seed, think time) to this JSONL trace for benchmarks/load_replay.py;
+# with LIVING_PAGES_RECORD_RESPONSES=1 the model's replies too. Empty disables recording
+RECORD_PATH = os.environ.get("LIVING_PAGES_RECORD", "")
+RECORD_RESPONSES = os.environ.get("LIVING_PAGES_RECORD_RESPONSES", "0") == "1"
+
+@st.cache_resource
+def get_recorder() -> Optional[SessionRecorder]:
+    return SessionRecorder(RECORD_PATH, responses=RECORD_RESPONSES) if RECORD_PATH else None
+
+def create_backend(name: str) -> LLMProvider:
+    if name == "local":
+        return create_provider("local", url=LOCAL_MODEL_URL, slots=LOCAL_MODEL_SLOTS)
+    if name == "gemini":
+        try:
+            api_key = st.secrets.get("API_KEY")
+        except FileNotFoundError:
+            api_key = None
+        return create_provider("gemini", api_key=api_key, model=GEMINI_MODEL)
+    return create_provider(name)
+
+@st.cache_resource
+def get_llm_client() -> LLMClient:
+    """Shared LLM client; its keep-alive connection pool is reused across reruns and sessions."""
+    cache = ResponseCache(RESPONSE_CACHE_PATH) if RESPONSE_CACHE_PATH else None
+    backends = [create_backend(name.strip()) for name in LLM_PROVIDER.split(",")]
+    provider = backends[0] if len(backends) == 1 else HedgedRouter(backends)
+    return LLMClient(provider, cache=cache, recorder=get_recorder())
+
+# Requests from all sessions are collected for this many seconds and sent to the model together
+SCHEDULER_WINDOW = 0.005
+
+# Most requests in flight to the model server at once (match its parallel slots)
+SCHEDULER_CONCURRENCY = int(os.environ.get("LIVING_PAGES_MAX_CONCURRENCY", "4"))
+
+# Most requests started per second on average (e.g. a hosted API's quota); 0 for no limit
+SCHEDULER_RATE = float(os.environ.get("LIVING_PAGES_RATE_LIMIT", "0"))
+
+# Saved games live on disk, keyed by the session id in the page URL
+SESSION_DIR = os.environ.get("LIVING_PAGES_SESSIONS", "sessions")
+
+# Games unused for this many seconds are dropped from memory and resumed from disk when reopened
+SESSION_IDLE_TIMEOUT = float(os.environ.get("LIVING_PAGES_SESSION_IDLE", "1800"))
+
+# Most games kept in memory; the least recently used beyond it are dropped (0 for no limit)
+MAX_SESSIONS = int(os.environ.get("LIVING_PAGES_MAX_SESSIONS", "0"))
+
+# Generate each turn with one JSON-schema-constrained call (the server must support response_format)
+STRUCTURED_TURNS = os.environ.get("LIVING_PAGES_STRUCTURED_TURNS", "0") == "1"
+
+# Who writes twists, interactions and new names: "llm", "procedural" (template tables, no model call)
+# or "mixed" (the model for a share of them, none while the LLM queue is backed up)
+TWIST_POLICY = TwistPolicy(
+    mode=os.environ.get("LIVING_PAGES_TWISTS", "mixed"),
+    llm_share=float(os.environ.get("LIVING_PAGES_TWIST_LLM_SHARE", "0.3")),
+)
+
+# Turns per page of the story view; the newest two pages are shown, earlier ones on request
+STORY_PAGE_TURNS = 8
+
+# Choices listed in the story log panel
+RECENT_CHOICES = 20
+
+# Local port serving /metrics (Prometheus text) and /traces.jsonl; 0 disables it
+METRICS_PORT = int(os.environ.get("LIVING_PAGES_METRICS_PORT", "0"))
+
+@st.cache_resource
+def get_engine() -> EngineThread:
+    """Shared narrative engine; every browser session is one of its game sessions."""
+    client = get_llm_client()
+    tracer = Tracer()
+    if METRICS_PORT:
+        try:
+            serve_metrics(tracer, METRICS_PORT)
+        except OSError as e:
+            logger.warning("Could not serve metrics on port %s: %s", METRICS_PORT, e)
+    engine = NarrativeEngine(
+        client,
+        # Keep at least the live story view (two pages) in memory when a game is resumed
+        SessionStore(SESSION_DIR, tail_turns=2 * STORY_PAGE_TURNS),
+        speculation_concurrency=SPECULATION_CONCURRENCY,
+        scheduler=BatchScheduler(client, SCHEDULER_CONCURRENCY, SCHEDULER_WINDOW, rate=SCHEDULER_RATE or None),
+        tracer=tracer,
+        structured_turns=STRUCTURED_TURNS,
+        twist_policy=TWIST_POLICY,
+        recorder=get_recorder(),
+        idle_timeout=SESSION_IDLE_TIMEOUT,
+        max_sessions=MAX_SESSIONS or None
     )
-    st.session_state.world.add_character(
-        "Mysterious Stranger",
-        "A hooded figure who watches from the shadows.",
-        ["mysterious", "elusive", "dangerous"]
+    return EngineThread(engine)
+
+engine_thread = get_engine()
+engine = engine_thread.engine
+
+def render_story(view, story: str):
+    """Render the story text into the story container placeholder."""
+    view.markdown(f'<div class="story-container">{story}</div>', unsafe_allow_html=True)
+
+def story_live_page(turns: int) -> int:
+    """First page of the live story view: the newest page plus the one before it."""
+    return max(0, (turns - 1) // STORY_PAGE_TURNS - 1)
+
+@st.fragment
+def earlier_pages(live_page: int):
+    """Pages before the live view, loaded a page per click; loading reruns only this fragment."""
+    shown = min(st.session_state.get("earlier_pages", 0), live_page)
+    if shown < live_page:
+        st.button(
+            f"⬆ Show earlier turns ({live_page - shown} pages hidden)",
+            on_click=lambda: st.session_state.update(earlier_pages=shown + 1)
+        )
+    # Full pages never change, so each one is rendered from the same text on every rerun
+    for page in range(live_page - shown, live_page):
+        render_story(st.empty(), engine_thread.call(
+            engine.story_text(session_id, page * STORY_PAGE_TURNS, (page + 1) * STORY_PAGE_TURNS)
+        ))
+
+STEP_LABELS = {
+    "event": "Twist",
+    "character_name": "New character",
+    "continuation": "Story",
+    "suggestions": "Next actions",
+    "turn": "Story and next actions",
+}
+
+@st.fragment(run_every=TURN_POLL_INTERVAL)
+def turn_progress(job: TurnJob):
+    """Show a turn running in the background; reruns the whole page once it is over."""
+    job.poll()
+    if job.finished:
+        st.rerun()
+    if STREAM_CONTINUATION and job.text:
+        render_story(st.empty(), job.text)
+    icons = {"started": "⏳", "finished": "✅", "failed": "⚠️"}
+    steps = " · ".join(f"{icons.get(state, '')} {STEP_LABELS.get(name, name)}" for name, state in job.steps.items())
+    phase = {"queued": "Waiting for the storyteller", "generating": "Continuing the story", "saving": "Saving"}
+    label = phase.get(job.phase, job.phase)
+    if job.phase in ("queued", "generating"):
+        # While the model is busy with other players, say where the turn is in line
+        ahead = engine_thread.call(engine.queue_position(job.session_id))
+        if ahead is not None:
+            label = f"Waiting for the storyteller, {ahead} request{'s' if ahead != 1 else ''} ahead of yours"
+    st.caption(f"{label}... {time.monotonic() - job.started_at:.0f}s" + (f" — {steps}" if steps else ""))
+    if st.button("Cancel", disabled=job.phase == "saving"):
+        job.cancel()
+
+# Keeping the session id in the URL lets a refresh or a server restart resume the game
+if not SessionStore.valid_id(st.query_params.get("session", "")):
+    st.query_params["session"] = uuid.uuid4().hex
+session_id = st.query_params["session"]
+
+# The game state lives in the engine; the script only keeps UI state and reads copies of the game's
+if "turn_error" not in st.session_state:
+    st.session_state.turn_job = None
+    st.session_state.turn_error = ""
+
+view = engine_thread.call(engine.view(session_id, RECENT_CHOICES))
+
+# A refreshed page picks up the turn still running for its session
+if st.session_state.turn_job is None and view.turn_job is not None:
+    st.session_state.turn_job = view.turn_job
+
+# Report on a turn that just ended; its story and world changes are already in the session
+turn_job: Optional[TurnJob] = st.session_state.turn_job
+if turn_job is not None and turn_job.finished:
+    if turn_job.phase == "failed":
+        # The story is untouched so the player can retry the action
+        st.session_state.turn_error = f"The storyteller is unavailable right now ({turn_job.error}). Please try again."
+    else:
+        st.session_state.turn_error = ""
+    if turn_job.phase == "cancelled":
+        st.toast("Turn cancelled")
+    st.session_state.turn_job = turn_job = None
+turn_running = turn_job is not None
+
+def start_turn(action: str):
+    st.session_state.turn_job = engine_thread.call(
+        engine.start_turn(session_id, action, abandon_after=TURN_ABANDON_AFTER)
     )
-    
-    # Initialize character relationships
-    st.session_state.world.update_character_relationship("Old Man Jenkins", 2)  # Starts friendly
-    st.session_state.world.update_character_relationship("Captain Rourke", -1)  # Slightly unfriendly
-    st.session_state.world.update_character_relationship("Mysterious Stranger", -3)  # Unfriendly
+    st.rerun()
 
 # Page setup
 st.set_page_config(
@@ -218,245 +268,203 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Relationship colour and icon of the character rows in the sidebar
+REL_STYLES = {
+    RelationshipLevel.HOSTILE: ("#ff4b4b", "👿"),
+    RelationshipLevel.UNFRIENDLY: ("#ff8c8c", "😠"),
+    RelationshipLevel.NEUTRAL: ("#f0f0f0", "😐"),
+    RelationshipLevel.FRIENDLY: ("#90EE90", "🙂"),
+    RelationshipLevel.TRUSTED: ("#4CAF50", "😊"),
+    RelationshipLevel.ALLY: ("#2E7D32", "🤝"),
+}
+
+def character_rows() -> List[Dict]:
+    """What the sidebar shows for each character, rebuilt only when the world or the story changed.
+
+    The characters are copied on the engine's loop; the engine's state is never read from this thread.
+    """
+    key = (session_id, view.world_version, view.turns)
+    cached = st.session_state.get("character_rows")
+    if cached is None or cached[0] != key:
+        rows = []
+        for char in engine_thread.call(engine.character_view(session_id)):
+            # seen_in is None if the character has not been mentioned in the story
+            seen_in = char["seen_in"]
+            relationship = char["relationship"]
+            _, rel_icon = REL_STYLES.get(relationship, ("#f0f0f0", "❓"))
+            rows.append({
+                "label": f"{rel_icon} {char['name']} - {relationship.name}" + ("" if seen_in else " (Not yet met)"),
+                "description": char["description"],
+                "progress": (char["relationship_points"] + 10) / 20,
+                "progress_text": f"Relationship: {relationship.name} ({char['relationship_points']})",
+                "seen_in": seen_in,
+                "traits": char["traits"],
+            })
+        cached = st.session_state.character_rows = (key, rows)
+    return cached[1]
+
+@st.fragment
+def debug_panel():
+    """Engine internals; nothing is rendered (or sent) unless it is switched on, and toggling reruns only this panel."""
+    if not st.toggle("🔧 Debug Info", key="show_debug"):
+        return
+    debug = engine_thread.call(engine.debug_view(session_id))
+    st.json(debug["world"])
+
+    # Response cache effectiveness
+    if debug["cache"] is not None:
+        cache_stats = debug["cache"]
+        st.caption(
+            f"LLM cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} entries"
+        )
+
+    # Latency and health of each backend behind the router
+    if debug["backends"] is not None:
+        st.caption(f"LLM backends: {debug['hedges']} hedged calls")
+        st.dataframe(debug["backends"], hide_index=True)
+
+    # Shared request queue in front of the model server
+    if debug["scheduler"] is not None:
+        scheduler_stats = debug["scheduler"]
+        st.caption(
+            f"LLM queue: {scheduler_stats['queued']} waiting, {scheduler_stats['in_flight']} in flight, "
+            f"{scheduler_stats['mean_wait_ms']:.1f} ms mean wait; shed: "
+            + ", ".join(f"{scheduler_stats['shed_' + name]} {name}" for name in PRIORITY_NAMES)
+        )
+
+    # Where the time of the last turn went
+    if debug["last_turn"]:
+        st.write("### Last Turn")
+        st.dataframe(debug["last_turn"], hide_index=True)
+    st.download_button(
+        "Download traces (JSONL)",
+        lambda: engine_thread.call(engine.traces_jsonl(session_id)),
+        file_name=f"traces-{session_id}.jsonl",
+        mime="application/x-ndjson"
+    )
+    if METRICS_PORT:
+        st.caption(f"Metrics: http://127.0.0.1:{METRICS_PORT}/metrics")
+
 # Sidebar with character and world info
 with st.sidebar:
     st.header("📊 Story Stats")
     col1, col2 = st.columns(2)
     with col1:
-        st.metric("Choices Made", len(st.session_state.choices))
+        st.metric("Choices Made", view.choice_count)
     with col2:
-        st.metric("Arc Progress", f"{min(100, st.session_state.arc_progress * 10)}%")
+        st.metric("Arc Progress", f"{min(100, view.arc_progress * 10)}%")
     
     # Character relationships
     st.markdown("---")
     st.header("👥 Characters")
     
     # Show all characters, but indicate if they haven't been met yet
-    all_chars = list(st.session_state.world.characters.values())
+    rows = character_rows()
     
-    if not all_chars:
+    if not rows:
         st.info("No characters have been added to the story yet.")
     else:
-        for char in all_chars:
-            # Get relationship color
-            rel_color = {
-                RelationshipLevel.HOSTILE: "#ff4b4b",
-                RelationshipLevel.UNFRIENDLY: "#ff8c8c",
-                RelationshipLevel.NEUTRAL: "#f0f0f0",
-                RelationshipLevel.FRIENDLY: "#90EE90",
-                RelationshipLevel.TRUSTED: "#4CAF50",
-                RelationshipLevel.ALLY: "#2E7D32"
-            }.get(char.relationship, "#f0f0f0")
-            
-            # Check if character has been mentioned in the story
-            has_been_mentioned = char.name.lower() in st.session_state.story.lower()
-            
-            # Show a different icon based on relationship status
-            rel_icon = {
-                RelationshipLevel.HOSTILE: "👿",
-                RelationshipLevel.UNFRIENDLY: "😠",
-                RelationshipLevel.NEUTRAL: "😐",
-                RelationshipLevel.FRIENDLY: "🙂",
-                RelationshipLevel.TRUSTED: "😊",
-                RelationshipLevel.ALLY: "🤝"
-            }.get(char.relationship, "❓")
-            
-            with st.expander(f"{rel_icon} {char.name} - {char.relationship.name}" + ("" if has_been_mentioned else " (Not yet met)")):
-                st.write(char.description)
-                st.progress((char.relationship_points + 10) / 20, 
-                          f"Relationship: {char.relationship.name} ({char.relationship_points})")
+        for row in rows:
+            with st.expander(row["label"]):
+                st.write(row["description"])
+                st.progress(row["progress"], row["progress_text"])
+                if row["seen_in"]:
+                    st.caption(f"First seen in turn {row['seen_in'][0]}, last seen in turn {row['seen_in'][1]}")
                 
                 # Show traits as tags
-                if char.traits:
+                if row["traits"]:
                     cols = st.columns(3)
-                    for i, trait in enumerate(char.traits):
+                    for i, trait in enumerate(row["traits"]):
                         cols[i % 3].markdown(f"`{trait}`")
     
     # World state
     st.markdown("---")
     st.header("🌍 World")
-    st.markdown(f"**Location:** {st.session_state.world.current_location}")
-    st.markdown(f"**Time of Day:** {st.session_state.world.time_of_day.title()}")
+    st.markdown(f"**Location:** {view.current_location}")
+    st.markdown(f"**Time of Day:** {view.time_of_day.title()}")
     
-    # Debug info (collapsed by default)
-    with st.expander("🔧 Debug Info", expanded=False):
-        st.json(st.session_state.world.to_dict())
-        
-        # Add a text area for the full story with a proper label
-        st.write("### Full Story")
-        st.text_area("story_debug", value=st.session_state.story, height=200, label_visibility="collapsed")
+    # Debug info (off by default)
+    debug_panel()
 
 # Main content
 st.title("📖 Living Pages: A Dynamic Narrative System")
 
-# Story display
+# Story display: only the newest pages are sent on each rerun, earlier ones on request
+live_page = story_live_page(view.turns)
+earlier_pages(live_page)
 with st.container():
-    st.markdown(f'<div class="story-container">{st.session_state.story}</div>', unsafe_allow_html=True)
+    story_view = st.empty()
+    render_story(story_view, engine_thread.call(engine.story_text(session_id, live_page * STORY_PAGE_TURNS)))
+
+# The turn in progress refreshes on its own; the rest of the page stays put
+if turn_running:
+    turn_progress(turn_job)
+
+# Report a failed turn instead of splicing the error into the story
+if st.session_state.get("turn_error"):
+    st.error(st.session_state.turn_error)
 
 # Generate suggested actions if none exist
-if not st.session_state.suggested_actions:
+if not view.suggested_actions:
     with st.spinner("Generating possible actions..."):
-        st.session_state.suggested_actions = generate_suggested_actions(st.session_state.story)
+        suggested_actions = engine_thread.call(engine.suggest_actions(session_id))
+else:
+    suggested_actions = list(view.suggested_actions)
 
 # Display suggested actions as buttons
 st.subheader("What will you do next?")
 
+# Only show up to 4 buttons
+displayed_actions = (list(view.recent_choices[-4:]) + suggested_actions)[:4]
+
 # Create columns for the action buttons
 cols = st.columns(2)
-for i, action in enumerate(st.session_state.choices[-4:] + st.session_state.suggested_actions):
-    if i < 4:  # Only show up to 4 buttons
-        with cols[i % 2]:
-            if st.button(action, key=f"action_{i}", use_container_width=True):
-                st.session_state.last_choice = action
-                st.session_state.is_loading = True
-                st.rerun()
+for i, action in enumerate(displayed_actions):
+    with cols[i % 2]:
+        if st.button(action, key=f"action_{i}", use_container_width=True, disabled=turn_running):
+            start_turn(action)
+
+# Generate the likely next turns while the player reads
+if SPECULATIVE_TURNS and not turn_running:
+    engine_thread.submit(engine.speculate(session_id, displayed_actions))
 
 # Custom action input
 with st.expander("Or type your own action"):
     custom_action = st.text_input("Your action:", key="custom_action")
-    if st.button("Submit Custom Action"):
+    if st.button("Submit Custom Action", disabled=turn_running):
         if custom_action.strip():
-            st.session_state.last_choice = custom_action
-            st.session_state.is_loading = True
-            st.rerun()
-
-# Process the selected action
-if st.session_state.is_loading and st.session_state.last_choice:
-    with st.spinner("Continuing the story..."):
-        # Update story state
-        user_choice = st.session_state.last_choice
-        st.session_state.choices.append(user_choice)
-        st.session_state.arc_progress += 1
-
-        # Generate a twist or character interaction based on the story context
-        twist = ""
-        if random.random() < 0.4:  # 40% chance of a narrative event
-            if random.random() < 0.6:  # 60% chance of a character interaction
-                # Get mentioned characters in the story
-                mentioned_chars = [char for char in st.session_state.world.characters.values() 
-                                 if char.name.lower() in st.session_state.story.lower()]
-                
-                if mentioned_chars:
-                    # Choose a random character to interact with
-                    char = random.choice(mentioned_chars)
-                    
-                    # Determine interaction type based on relationship
-                    if char.relationship in [RelationshipLevel.HOSTILE, RelationshipLevel.UNFRIENDLY]:
-                        interaction_type = random.choice(["challenge", "threat", "warning"])
-                    elif char.relationship == RelationshipLevel.NEUTRAL:
-                        interaction_type = random.choice(["observe", "question", "comment"])
-                    else:
-                        interaction_type = random.choice(["help", "advice", "gift"])
-                    
-                    # Generate the interaction
-                    twist_prompt = f"""
-                    Current story: {st.session_state.story}
-                    
-                    Character: {char.name}
-                    Character traits: {', '.join(char.traits)}
-                    Relationship: {char.relationship.name}
-                    
-                    Generate a short interaction where {char.name} {interaction_type}s the player in 1-2 sentences.
-                    Example: "Old Man Jenkins warns you about the dangers of the forest at night."
-                    """
-                    twist = query_local_model(twist_prompt, "You are a creative writer who creates engaging character interactions.")
-                    
-                    # Update relationship based on interaction
-                    if interaction_type in ["help", "advice", "gift"]:
-                        st.session_state.world.update_character_relationship(char.name, 1)
-                    elif interaction_type in ["threat", "challenge"]:
-                        st.session_state.world.update_character_relationship(char.name, -1)
-                    
-                    # Update last interaction time
-                    char.last_interaction = "Just now"
-            else:  # 40% chance of a regular twist
-                twist_prompt = f"""The current story: {st.session_state.story}
-                
-                The player chose to: {user_choice}
-                
-                Generate a short, surprising narrative twist (1-2 sentences). Keep it engaging and relevant.
-                Example: 'As you reach for the door, you hear a loud crash from the room above.'
-                """
-                twist = query_local_model(twist_prompt, "You are a creative writing assistant that adds exciting twists to stories.")
-                
-                # Small chance to discover a new character
-                if random.random() < 0.2:  # 20% chance when a twist occurs
-                    new_char_name = query_local_model(
-                        "Generate a fantasy character name (just the name, no quotes or punctuation)",
-                        "You are a creative writer who invents interesting character names."
-                    ).strip('"\'')
-                    
-                    if new_char_name and new_char_name not in st.session_state.world.characters:
-                        char_traits = random.sample(
-                            ["mysterious", "friendly", "suspicious", "wise", "playful", "serious", "eccentric"],
-                            k=random.randint(2, 4)
-                        )
-                        st.session_state.world.add_character(
-                            new_char_name,
-                            f"A {char_traits[0]} figure you've just encountered.",
-                            char_traits
-                        )
-                        twist += f"\n\nYou notice {new_char_name} watching you from a distance..."
-            
-            st.session_state.last_twist = twist
-
-        # Get arc guidance
-        arc_hint = get_arc_hint(st.session_state.arc_progress)
-
-        # Generate story continuation
-
-        # Generate story continuation
-        system_prompt = """You are a master storyteller. Continue the narrative in an engaging way that:
-        1. Acknowledges the player's last action
-        2. Incorporates any narrative twists naturally
-        3. Advances the story in a coherent way
-        4. Leaves room for interesting future developments
-        Keep it concise (2-4 paragraphs)."""
-        
-        # Create the prompt with proper string escaping
-        twist_section = f'NARRATIVE TWIST (if any):\n{twist}\n\n' if twist else ''
-        prompt = f"""Continue the story based on this context:
-        
-CURRENT STORY:
-{st.session_state.story}
-
-PLAYER'S ACTION:
-{user_choice}
-
-{twist_section}NARRATIVE ARC HINT:
-{arc_hint}
-
-Continue the story in a way that's engaging and maintains player agency. Don't describe the player's actions for them - just describe what happens as a result."""
-        
-        continuation = query_local_model(prompt, system_prompt)
-        
-        # Format the update
-        update_text = f"\n\n> **{user_choice}**"
-        if twist:
-            update_text += f"\n\n*{twist}*\n"
-        update_text += f"\n{continuation}"
-        
-        # Update the story
-        st.session_state.story += update_text
-        
-        # Reset for next interaction
-        st.session_state.suggested_actions = []
-        st.session_state.is_loading = False
-        st.session_state.last_choice = ""
-        st.rerun()
+            start_turn(custom_action)
 
 # Add some spacing at the bottom
 st.markdown("<br><br>", unsafe_allow_html=True)
 
-# Debug info (collapsed by default)
-with st.expander("📝 Story Log", expanded=False):
+@st.fragment
+def story_log_panel():
     st.write("### Story So Far")
-    st.text_area("", st.session_state.story, height=200)
+    # Built only when the download is clicked; a long story is never sent with the page
+    st.download_button(
+        "Download the story (Markdown)",
+        lambda: engine_thread.call(engine.story_text(session_id)),
+        file_name=f"story-{session_id}.md",
+        mime="text/markdown"
+    )
     
     st.write("### Your Choices")
-    for i, choice in enumerate(st.session_state.choices, 1):
+    recent_choices = view.recent_choices
+    first = view.choice_count - len(recent_choices) + 1
+    if first > 1:
+        st.caption(f"{first - 1} earlier choices not shown")
+    for i, choice in enumerate(recent_choices, first):
         st.write(f"{i}. {choice}")
     
     if st.button("Start New Game"):
+        engine_thread.loop.call_soon_threadsafe(engine.end_session, session_id)
         st.session_state.clear()
-        st.rerun()
+        # The finished game stays on disk under its old session id
+        st.query_params["session"] = uuid.uuid4().hex
+        st.rerun(scope="app")
+
+# Story log (collapsed by default)
+with st.expander("📝 Story Log", expanded=False):
+    story_log_panel()
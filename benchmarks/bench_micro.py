@@ -0,0 +1,133 @@
+"""Micro-benchmarks for the parts of a turn whose cost depends on story length.
+
+Builds synthetic stories of 10, 100 and 1000 turns and times mention
+scanning, prompt construction, retrieval, WorldState updates, the
+procedural generators and the story render.
+
+    python -m benchmarks.bench_micro --sizes 10 100 1000
+"""
+import argparse
+import json
+import random
+import timeit
+from typing import Callable, List, Tuple
+
+from mention_index import MentionIndex
+from procedural import NameGenerator, TwistGenerator
+from speculation import story_state_hash
+from story_context import StoryContext
+from story_log import StoryLog, TurnRecord
+from story_memory import StoryMemory
+from turn_pipeline import STORY_BUDGET, continuation_request, get_arc_hint
+from world import WorldState
+
+from benchmarks.mock_server import WORDS
+
+NAMES = ["Old Man Jenkins", "Captain Rourke", "Mysterious Stranger"]
+
+
+def build_story(turns: int, seed: int = 0) -> Tuple[StoryLog, WorldState, StoryContext]:
+    """A story of the given length with a character discovered every tenth turn."""
+    rng = random.Random(seed)
+    world = WorldState()
+    for name in NAMES:
+        world.add_character(name, f"{name} of the village.", ["wise"])
+    story_log = StoryLog("You awaken in a quiet village at dawn...")
+    # The summarizer is not under test; fold instantly
+    context = StoryContext(lambda summary, events: (summary + " " + events)[-800:])
+    context.add_turn(story_log[0].text)
+    for turn in range(1, turns):
+        if turn % 10 == 0:
+            world.add_character(f"Wanderer {turn}", "A traveller on the old road.", ["eccentric"])
+        names = list(world.characters)
+        words = [rng.choice(WORDS) for _ in range(100)]
+        words.insert(rng.randrange(len(words)), rng.choice(names))
+        record = TurnRecord(action=f"Action {turn}", continuation=" ".join(words))
+        story_log.append(record)
+        context.add_turn(record.text.strip())
+    context.wait()
+    return story_log, world, context
+
+
+def time_per_call(func: Callable[[], object], min_time: float = 0.2) -> float:
+    """Best-of-three seconds per call."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def run(sizes: List[int]):
+    print(f"{'turns':>6} {'benchmark':<28} {'time':>12} {'size':>10}")
+    for size in sizes:
+        story_log, world, context = build_story(size)
+
+        def scan_all():
+            mentions = MentionIndex(story_log)
+            for name in world.characters:
+                mentions.add_name(name)
+            mentions.update()
+
+        mentions = MentionIndex(story_log)
+        for name in world.characters:
+            mentions.add_name(name)
+        mentions.update()
+
+        def scan_new_turn():
+            # What a turn costs: one appended turn is scanned
+            mentions._scanned -= 1
+            mentions.update()
+
+        def build_prompt():
+            return continuation_request("Look around", "", get_arc_hint(size), context.build(STORY_BUDGET))
+
+        wanderers = world.characters_with_trait("eccentric")
+        memory = StoryMemory(story_log)
+        memory.update()
+
+        twists = TwistGenerator(random.Random(size))
+        names = NameGenerator(rng=random.Random(size))
+        jenkins = world.get_character(NAMES[0])
+
+        # What one turn usually changes, for the journal's delta of it
+        turn_start = world.version
+        jenkins.update_relationship(1)
+        jenkins.last_interaction = "Just now"
+
+        def update_and_to_dict():
+            jenkins.update_relationship(1)
+            return world.to_dict()
+
+        def render_payload():
+            return f'<div class="story-container">{story_log.text}</div>'
+
+        rows = [
+            ("mention scan (full story)", time_per_call(scan_all), ""),
+            ("mention scan (new turn)", time_per_call(scan_new_turn), ""),
+            ("continuation prompt", time_per_call(build_prompt), f"{len(build_prompt().prompt)} ch"),
+            ("WorldState.to_dict", time_per_call(world.to_dict), f"{len(world.characters)} chars"),
+            ("update + to_dict", time_per_call(update_and_to_dict), ""),
+            ("world delta of a turn", time_per_call(lambda: world.delta(turn_start)),
+             f"{len(json.dumps(world.delta(turn_start)))} B"),
+            ("world snapshot", time_per_call(world.to_snapshot), f"{len(json.dumps(world.to_snapshot()))} B"),
+            ("group relationship update", time_per_call(lambda: world.update_relationships(wanderers, -1)),
+             f"{len(wanderers)} chars"),
+            ("memory recall", time_per_call(lambda: memory.recall(f"Ask {NAMES[0]} about the old road")), ""),
+            ("procedural twist", time_per_call(lambda: twists.twist("Dark Forest", "night")), ""),
+            ("procedural interaction", time_per_call(lambda: twists.interaction(jenkins, "advice")), ""),
+            ("procedural name", time_per_call(lambda: names.name(taken=world.characters)), ""),
+            ("story_state_hash", time_per_call(lambda: story_state_hash(story_log, size, world)), ""),
+            ("render payload", time_per_call(render_payload), f"{len(render_payload())} ch"),
+        ]
+        for name, seconds, extra in rows:
+            print(f"{size:>6} {name:<28} {seconds * 1e6:>9.1f} us {extra:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    run(parser.parse_args().sizes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""End-to-end turn benchmark against the mock model server.
+
+Plays --turns turns in each of --sessions concurrent sessions through the
+NarrativeEngine, then reports throughput, per-turn latency percentiles and
+how the prompt size grows with the turn number.
+
+    python -m benchmarks.bench_turns --sessions 20 --turns 30 --latency 0.05 --tps 200
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import Dict, List
+
+from benchmarks.mock_server import MockModelServer
+from llm_client import LLMClient, LocalProvider
+from narrative_engine import NarrativeEngine
+from procedural import TwistPolicy
+from scheduler import BatchScheduler
+from session_recorder import SessionRecorder
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+async def play_session(engine: NarrativeEngine, session_id: str, turns: int,
+                       latencies: List[float], prompt_tokens: Dict[int, List[int]]):
+    rng = random.Random(session_id)
+    for turn in range(1, turns + 1):
+        actions = await engine.suggest_actions(session_id)
+        started = time.perf_counter()
+        result = await engine.take_turn(session_id, rng.choice(actions), on_token=lambda token: None)
+        latencies.append(time.perf_counter() - started)
+        prompt_tokens.setdefault(turn, []).append(result.prompt_tokens)
+
+
+async def run(args) -> Dict[str, float]:
+    server = MockModelServer(("127.0.0.1", 0), args.latency, args.tps, args.reply_tokens,
+                             args.prefill_tps, args.slots).start()
+    recorder = SessionRecorder(args.record, responses=True) if args.record else None
+    client = LLMClient(LocalProvider(server.url, slots=args.slots if args.pin_slots else 0), recorder=recorder)
+    scheduler = BatchScheduler(client, args.concurrency) if args.concurrency else None
+    twist_policy = TwistPolicy(args.twists) if args.twists else None
+    engine = NarrativeEngine(client, scheduler=scheduler, rng=random.Random(args.seed),
+                             structured_turns=args.structured, twist_policy=twist_policy, recorder=recorder)
+
+    latencies: List[float] = []
+    prompt_tokens: Dict[int, List[int]] = {}
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        play_session(engine, f"bench-{i}", args.turns, latencies, prompt_tokens)
+        for i in range(args.sessions)
+    ])
+    elapsed = time.perf_counter() - started
+    await engine.close()
+    server.shutdown()
+    if recorder is not None:
+        recorder.close()
+
+    print(f"{len(latencies)} turns in {elapsed:.2f}s: {len(latencies) / elapsed:.1f} turns/s, "
+          f"{server.requests_served} model requests")
+    print(f"prompt cache: {server.cached_tokens / max(1, server.prompt_tokens):.0%} of "
+          f"{server.prompt_tokens} prompt tokens reused")
+    print(f"turn latency p50 {percentile(latencies, 50) * 1000:.0f} ms, "
+          f"p95 {percentile(latencies, 95) * 1000:.0f} ms, p99 {percentile(latencies, 99) * 1000:.0f} ms")
+    if scheduler is not None:
+        print(f"scheduler: {scheduler.stats()}")
+    print("turn  mean prompt tokens per turn")
+    for turn in sorted(prompt_tokens):
+        if turn in (1, 2, 5) or turn % 10 == 0 or turn == args.turns:
+            print(f"{turn:>4}  {statistics.mean(prompt_tokens[turn]):.0f}")
+    return {
+        "turns_per_second": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock seconds to first token")
+    parser.add_argument("--tps", type=float, default=200.0, help="mock tokens per second per request")
+    parser.add_argument("--reply-tokens", type=int, default=120)
+    parser.add_argument("--concurrency", type=int, default=8, help="scheduler slots (0 disables the scheduler)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--prefill-tps", type=float, default=0.0, help="mock uncached prompt tokens per second")
+    parser.add_argument("--slots", type=int, default=8, help="mock server slots")
+    parser.add_argument("--pin-slots", action="store_true", help="pin each session to one server slot")
+    parser.add_argument("--structured", action="store_true", help="one structured call per turn")
+    parser.add_argument("--twists", choices=["llm", "procedural", "mixed"],
+                        help="twist policy (default: every event is an LLM call)")
+    parser.add_argument("--record", help="write the turns and replies to a trace for load_replay")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Replay recorded sessions against the NarrativeEngine at a given concurrency.
+
+Reads a trace written by SessionRecorder (the app with LIVING_PAGES_RECORD,
+or bench_turns --record) and has --players players replay its sessions
+headlessly: player i plays recorded session i modulo the number of sessions,
+with the recorded actions and seeds. Players arrive at --arrival-rate per
+second (Poisson; 0 starts them all at once). Reports throughput, turn
+latency and queueing delay percentiles, and memory per session.
+
+The model is the mock server unless --url points at a real OpenAI-compatible
+one. With --responses, recorded replies are served from the trace and only
+the rest go to that backend (none with --strict).
+
+Recording waits for each session's pending summary before every prompt, and
+so does the replay with --responses or --deterministic, so the prompts match
+the recorded ones. A rerun with the same trace, seed and recorded replies
+then plays exactly the same stories; the printed story digest shows it. Use
+--twists llm or procedural for that: mixed decides by how busy the model is.
+
+    python -m benchmarks.load_replay trace.jsonl --players 50 --arrival-rate 5 --responses
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import resource
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List
+
+from benchmarks.bench_turns import percentile
+from benchmarks.mock_server import MockModelServer
+from llm_client import LLMClient, LocalProvider
+from narrative_engine import NarrativeEngine
+from procedural import TwistPolicy
+from scheduler import PRIORITY_NAMES, BatchScheduler
+from session_recorder import RecordedTurn, Recording, ReplayProvider, SessionRecorder
+from tracing import Tracer
+
+
+async def play_recorded(engine: NarrativeEngine, session_id: str, turns: List[RecordedTurn], args,
+                        latencies: List[float]):
+    session = await engine.open_session(session_id)
+    for turn in turns:
+        if args.think_scale and turn.think:
+            await asyncio.sleep(turn.think * args.think_scale)
+        if args.deterministic or args.responses:
+            # As when it was recorded; otherwise whether the last summary has landed depends on timing, and so does the prompt
+            await asyncio.to_thread(session.context.wait)
+        await engine.suggest_actions(session_id)
+        started = time.perf_counter()
+        await engine.take_turn(session_id, turn.action, on_token=lambda token: None, seed=turn.seed)
+        latencies.append(time.perf_counter() - started)
+
+
+def turn_queue_times(tracer: Tracer) -> List[float]:
+    """Total time each turn's model requests waited for a scheduler slot."""
+    spans = tracer.recent(limit=len(tracer.spans))
+    turn_traces = {span.trace_id for span in spans if span.name == "turn" and span.parent_id is None}
+    waits: Dict[str, float] = defaultdict(float)
+    for span in spans:
+        if span.trace_id in turn_traces:
+            waits[span.trace_id] += span.queue_time
+    return [waits[trace_id] for trace_id in turn_traces]
+
+
+async def run(args) -> Dict[str, float]:
+    recording = Recording.load(args.trace)
+    if not recording.sessions:
+        raise SystemExit(f"No recorded turns in {args.trace}")
+    recorded = list(recording.sessions.values())
+    players = args.players
+
+    server = None
+    if args.url:
+        backend = LocalProvider(args.url, slots=args.slots if args.pin_slots else 0)
+    else:
+        server = MockModelServer(("127.0.0.1", 0), args.latency, args.tps, args.reply_tokens,
+                                 args.prefill_tps, args.slots).start()
+        backend = LocalProvider(server.url, slots=args.slots if args.pin_slots else 0)
+    provider = ReplayProvider(recording.responses, None if args.strict else backend) if args.responses else backend
+    recorder = SessionRecorder(args.record, responses=True) if args.record else None
+    client = LLMClient(provider, recorder=recorder)
+    scheduler = BatchScheduler(client, args.concurrency, rate=args.rate) if args.concurrency else None
+    total_turns = sum(len(recorded[i % len(recorded)]) for i in range(players))
+    tracer = Tracer(max_spans=20 * total_turns)
+    twist_policy = TwistPolicy(args.twists) if args.twists else None
+    engine = NarrativeEngine(client, scheduler=scheduler, rng=random.Random(args.seed), tracer=tracer,
+                             structured_turns=args.structured, twist_policy=twist_policy, recorder=recorder)
+
+    if args.memory:
+        tracemalloc.start()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    arrivals = random.Random(args.seed)
+    latencies: List[float] = []
+    failed = 0
+
+    async def player(i: int):
+        nonlocal failed
+        try:
+            await play_recorded(engine, f"replay-{i}", recorded[i % len(recorded)], args, latencies)
+        except Exception as e:
+            failed += 1
+            print(f"player {i} failed: {type(e).__name__}: {e}")
+
+    started = time.perf_counter()
+    tasks = []
+    for i in range(players):
+        tasks.append(asyncio.ensure_future(player(i)))
+        if args.arrival_rate:
+            await asyncio.sleep(arrivals.expovariate(args.arrival_rate))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    # Wait for pending summaries, so the digest covers everything the players did
+    for session in engine.sessions.values():
+        await asyncio.to_thread(session.context.wait)
+    digest = hashlib.sha256()
+    for i in range(players):
+        session = engine.sessions.get(f"replay-{i}")
+        if session is not None:
+            digest.update(session.story_log.text.encode("utf-8"))
+            digest.update((session.context.state()[0] or "").encode("utf-8"))
+    sessions = max(1, len(engine.sessions))
+    if args.memory:
+        traced, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        memory = f"{traced / sessions / 1024:.0f} KiB traced per session"
+    else:
+        rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+        memory = f"{rss_growth / sessions:.0f} KiB peak RSS growth per session"
+    queue_times = turn_queue_times(tracer)
+    await engine.close()
+    if server is not None:
+        server.shutdown()
+    if recorder is not None:
+        recorder.close()
+
+    print(f"{players} players, {len(recorded)} recorded sessions, {failed} failed")
+    print(f"{len(latencies)} turns in {elapsed:.2f}s: {len(latencies) / elapsed:.1f} turns/s")
+    if latencies:
+        print(f"turn latency p50 {percentile(latencies, 50) * 1000:.0f} ms, "
+              f"p95 {percentile(latencies, 95) * 1000:.0f} ms, p99 {percentile(latencies, 99) * 1000:.0f} ms")
+    if scheduler is not None and queue_times:
+        print(f"queueing delay per turn p50 {percentile(queue_times, 50) * 1000:.0f} ms, "
+              f"p95 {percentile(queue_times, 95) * 1000:.0f} ms; "
+              f"mean wait per request {scheduler.stats()['mean_wait_ms']:.1f} ms")
+    if scheduler is not None:
+        stats = scheduler.stats()
+        print("shed requests: " + ", ".join(f"{stats['shed_' + name]} {name}" for name in PRIORITY_NAMES))
+    if isinstance(provider, ReplayProvider):
+        print(f"recorded replies: {provider.hits} used, {provider.misses} requests not recorded")
+    print(f"memory: {memory}")
+    print(f"story digest: {digest.hexdigest()[:16]}")
+    return {
+        "turns_per_second": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50) if latencies else 0.0,
+        "p95": percentile(latencies, 95) if latencies else 0.0,
+        "p99": percentile(latencies, 99) if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="JSONL trace written by SessionRecorder")
+    parser.add_argument("--players", type=int, default=20, help="players replaying the recorded sessions")
+    parser.add_argument("--arrival-rate", type=float, default=0.0, help="players arriving per second (0: all at once)")
+    parser.add_argument("--think-scale", type=float, default=0.0, help="multiplier on the recorded think times")
+    parser.add_argument("--responses", action="store_true", help="serve recorded replies from the trace")
+    parser.add_argument("--strict", action="store_true", help="with --responses, fail requests that were not recorded")
+    parser.add_argument("--deterministic", action="store_true", help="wait for summaries so reruns are identical (implied by --responses)")
+    parser.add_argument("--record", help="write this run's turns and replies to a new trace")
+    parser.add_argument("--memory", action="store_true", help="measure memory with tracemalloc (slower)")
+    parser.add_argument("--url", help="OpenAI-compatible chat completions URL instead of the mock server")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock seconds to first token")
+    parser.add_argument("--tps", type=float, default=200.0, help="mock tokens per second per request")
+    parser.add_argument("--reply-tokens", type=int, default=120)
+    parser.add_argument("--prefill-tps", type=float, default=0.0, help="mock uncached prompt tokens per second")
+    parser.add_argument("--slots", type=int, default=8, help="server slots")
+    parser.add_argument("--pin-slots", action="store_true", help="pin each session to one server slot")
+    parser.add_argument("--concurrency", type=int, default=8, help="scheduler slots (0 disables the scheduler)")
+    parser.add_argument("--rate", type=float, help="scheduler requests started per second")
+    parser.add_argument("--seed", type=int, default=0, help="seeds player arrivals")
+    parser.add_argument("--structured", action="store_true", help="one structured call per turn")
+    parser.add_argument("--twists", choices=["llm", "procedural", "mixed"],
+                        help="twist policy (default: every event from the model)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
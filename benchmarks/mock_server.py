@@ -0,0 +1,166 @@
+"""OpenAI-compatible mock model server for benchmarks.
+
+Answers /v1/chat/completions (plain and streamed) after a configurable
+time to first token, then at a configurable number of tokens per second.
+Requests with a response_format get a structured turn reply.
+
+With --prefill-tps, prompts also cost prefill time, except for the prefix
+they share with the last prompt served on the same slot, like a
+llama.cpp server's per-slot prompt cache. Requests go to their id_slot,
+or round robin over the slots without one.
+
+    python -m benchmarks.mock_server --port 1234 --latency 0.2 --tps 40
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from story_context import estimate_tokens
+
+WORDS = (
+    "the lantern light flickers as distant bells ring across the valley and "
+    "a cold wind carries whispers of the old road through the sleeping village"
+).split()
+
+
+def reply_for(prompt: str, max_tokens: int, reply_tokens: int, structured: bool = False) -> List[str]:
+    """Canned reply to a prompt, as a list of tokens (one word each)."""
+    if structured:
+        words = [WORDS[i % len(WORDS)] for i in range(min(max_tokens, reply_tokens))]
+        return ['{"twist": "", "continuation": "'] + [word + " " for word in words] + [
+            '", "suggestions": ["Look around", ', '"Talk to the guard", ', '"Follow the road"], ',
+            '"new_character": null, "relationship_changes": []}',
+        ]
+    if "JSON array" in prompt:
+        return ['["Look around", ', '"Talk to the guard", ', '"Follow the road"]']
+    if "character name" in prompt:
+        return ["Elowen ", "Marsh"]
+    count = min(max_tokens, reply_tokens)
+    return [WORDS[i % len(WORDS)] + " " for i in range(count)]
+
+
+class MockModelServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], latency: float = 0.2, tokens_per_second: float = 50.0,
+                 reply_tokens: int = 120, prefill_tps: float = 0.0, slots: int = 4):
+        super().__init__(address, MockModelHandler)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.prefill_tps = prefill_tps
+        self.requests_served = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0  # Prompt tokens served from a slot's prompt cache
+        self._slot_prompts = [""] * slots
+        self._next_slot = 0
+        self._lock = threading.Lock()
+
+    def prefill(self, prompt: str, slot: Optional[int]) -> int:
+        """Prompt tokens to prefill on the serving slot, which then caches this prompt."""
+        with self._lock:
+            if slot is None or not 0 <= slot < len(self._slot_prompts):
+                slot = self._next_slot
+                self._next_slot = (self._next_slot + 1) % len(self._slot_prompts)
+            shared = estimate_tokens(os.path.commonprefix([self._slot_prompts[slot], prompt]))
+            self._slot_prompts[slot] = prompt
+            total = estimate_tokens(prompt)
+            self.prompt_tokens += total
+            self.cached_tokens += shared
+        return total - shared
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self) -> "MockModelServer":
+        """Serve on a daemon thread and return self."""
+        threading.Thread(target=self.serve_forever, name="mock-model-server", daemon=True).start()
+        return self
+
+
+class MockModelHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: MockModelServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, data: Dict):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self):
+        try:
+            self._complete()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client cancelled the request
+
+    def _complete(self):
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            prompt = "\n".join(message["content"] for message in payload["messages"])
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        with self.server._lock:
+            self.server.requests_served += 1
+
+        tokens = reply_for(prompt, payload.get("max_tokens", 500), self.server.reply_tokens,
+                           structured="response_format" in payload)
+        per_token = 1.0 / self.server.tokens_per_second if self.server.tokens_per_second > 0 else 0.0
+        prefill = self.server.prefill(prompt, payload.get("id_slot"))
+        time.sleep(self.server.latency + (prefill / self.server.prefill_tps if self.server.prefill_tps > 0 else 0.0))
+
+        if not payload.get("stream"):
+            time.sleep(per_token * len(tokens))
+            text = "".join(tokens)
+            self._send_json(200, {
+                "choices": [{"message": {"role": "assistant", "content": text}}],
+                "usage": {"prompt_tokens": estimate_tokens(prompt), "completion_tokens": len(tokens)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in tokens:
+            time.sleep(per_token)
+            event = {"choices": [{"delta": {"content": token}}]}
+            self._send_chunk(f"data: {json.dumps(event)}\n\n".encode())
+        self._send_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds to first token")
+    parser.add_argument("--tps", type=float, default=50.0, help="tokens per second per request")
+    parser.add_argument("--reply-tokens", type=int, default=120, help="length of narrative replies")
+    parser.add_argument("--prefill-tps", type=float, default=0.0, help="uncached prompt tokens per second (0: free)")
+    parser.add_argument("--slots", type=int, default=4, help="parallel slots, each caching its last prompt")
+    args = parser.parse_args()
+    server = MockModelServer((args.host, args.port), args.latency, args.tps, args.reply_tokens,
+                             args.prefill_tps, args.slots)
+    print(f"Mock model server on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,80 +5,20 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-import requests
+import os
 import json
 import random
-from typing import List, Dict, Optional
-from dataclasses import dataclass, field
-from enum import Enum
+from typing import List, Dict, Optional, Iterator
 import time
-
-class RelationshipLevel(Enum):
-    HOSTILE = -2
-    UNFRIENDLY = -1
-    NEUTRAL = 0
-    FRIENDLY = 1
-    TRUSTED = 2
-    ALLY = 3
-
-@dataclass
-class Character:
-    name: str
-    description: str
-    relationship: RelationshipLevel = RelationshipLevel.NEUTRAL
-    relationship_points: int = 0
-    last_interaction: str = ""
-    traits: List[str] = field(default_factory=list)
-    
-    def update_relationship(self, change: int):
-        self.relationship_points = max(-10, min(10, self.relationship_points + change))
-        if self.relationship_points <= -7:
-            self.relationship = RelationshipLevel.HOSTILE
-        elif self.relationship_points <= -3:
-            self.relationship = RelationshipLevel.UNFRIENDLY
-        elif self.relationship_points <= 2:
-            self.relationship = RelationshipLevel.NEUTRAL
-        elif self.relationship_points <= 6:
-            self.relationship = RelationshipLevel.FRIENDLY
-        elif self.relationship_points <= 9:
-            self.relationship = RelationshipLevel.TRUSTED
-        else:
-            self.relationship = RelationshipLevel.ALLY
-
-class WorldState:
-    def __init__(self):
-        self.characters: Dict[str, Character] = {}
-        self.locations = ["Village Square", "Dark Forest", "Mystic Caverns", "Abandoned Tower"]
-        self.current_location = "Village Square"
-        self.time_of_day = "morning"
-        self.quests = {}
-        
-    def add_character(self, name: str, description: str, traits: List[str] = None):
-        if name not in self.characters:
-            self.characters[name] = Character(
-                name=name,
-                description=description,
-                traits=traits or []
-            )
-    
-    def get_character(self, name: str) -> Optional[Character]:
-        return self.characters.get(name)
-    
-    def update_character_relationship(self, name: str, change: int):
-        if name in self.characters:
-            self.characters[name].update_relationship(change)
-    
-    def to_dict(self):
-        return {
-            "characters": {name: {
-                "relationship": char.relationship.name,
-                "relationship_points": char.relationship_points,
-                "last_interaction": char.last_interaction,
-                "traits": char.traits
-            } for name, char in self.characters.items()},
-            "current_location": self.current_location,
-            "time_of_day": self.time_of_day
-        }
+from world import RelationshipLevel, WorldState
+from story_context import StoryContext
+from story_log import StoryLog, TurnRecord, format_turn_header
+from llm_client import LLMClient, LLMError, LLMResponseError, create_provider
+from prompt_builder import limits_for
+from response_cache import ResponseCache
+from router import HedgedRouter
+from tracing import Tracer
+from turn_pipeline import STORY_BUDGET, STORY_PREFIX, STORY_SYSTEM_PROMPT
 
 st.markdown("""
     <style>
@@ -92,44 +32,88 @@ st.markdown("""
 
 # Gemini API
 GEMINI_MODEL = "gemini-2.5-flash"
-GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta2/models/{GEMINI_MODEL}:generateMessage"
 
-def query_gemini(prompt: str, system_prompt: str = None) -> str:
-    payload = {
-        "prompt": {
-            "messages": [
-                {"author": "system", "content": system_prompt} if system_prompt else {},
-                {"author": "user", "content": prompt}
-            ]
-        },
-        "temperature": 0.7,
-        "maxOutputTokens": 500
-    }
+# Set to e.g. "gemini,local" to route calls over several backends and hedge slow ones
+LLM_PROVIDER = os.environ.get("LIVING_PAGES_PROVIDER", "gemini")
+LOCAL_MODEL_URL = "http://127.0.0.1:1234/v1/chat/completions"
+STREAM_CONTINUATION = True
+STORY_PAGE_TURNS = 8  # The story view shows the newest two pages of turns
+STREAM_RENDER_INTERVAL = 0.05
+RESPONSE_CACHE_PATH = os.environ.get("LIVING_PAGES_CACHE", "llm_cache.sqlite3")
+
+@st.cache_resource
+def get_llm_client() -> LLMClient:
     try:
-        response = requests.post(
-            GEMINI_URL,
-            headers={"Content-Type": "application/json"},
-            params={"key": st.secrets.get("API_KEY")},
-            json=payload
-        )
-        response.raise_for_status()
-        return response.json()["candidates"][0]["content"][0]["text"]
-    except Exception as e:
-        print(f"Error querying Gemini: {e}")
-        # Fallback: return a default message
-        return None
+        api_key = st.secrets.get("API_KEY")
+    except FileNotFoundError:
+        # No secrets.toml: calls will fail with LLMHTTPError and fall back
+        api_key = None
+    cache = ResponseCache(RESPONSE_CACHE_PATH) if RESPONSE_CACHE_PATH else None
+    backends = []
+    for name in LLM_PROVIDER.split(","):
+        if name.strip() == "gemini":
+            backends.append(create_provider("gemini", api_key=api_key, model=GEMINI_MODEL))
+        elif name.strip() == "local":
+            backends.append(create_provider("local", url=LOCAL_MODEL_URL))
+        else:
+            backends.append(create_provider(name.strip()))
+    provider = backends[0] if len(backends) == 1 else HedgedRouter(backends)
+    return LLMClient(provider, cache=cache)
+
+llm = get_llm_client()
+
+@st.cache_resource
+def get_tracer() -> Tracer:
+    return Tracer()
+
+tracer = get_tracer()
+
+def query_gemini(prompt: str, system_prompt: str = None, prompt_type: str = "default") -> str:
+    """Raises LLMError if Gemini cannot be reached or returns an error."""
+    with tracer.span(prompt_type):
+        return llm.complete(prompt, system_prompt, prompt_type, max_tokens=limits_for(prompt_type).max_tokens)
+
+def stream_gemini(prompt: str, system_prompt: str = None, prompt_type: str = "default") -> Iterator[str]:
+    with tracer.span(prompt_type):
+        yield from llm.stream(prompt, system_prompt, prompt_type, max_tokens=limits_for(prompt_type).max_tokens)
+
+def summarize_story(previous_summary: str, new_events: str) -> str:
+    system_prompt = "You keep a concise running summary of a text adventure. Preserve names, promises, items and unresolved threads."
+    prompt = f"Summary so far:\n{previous_summary or '(nothing yet)'}\n\nNew events:\n{new_events}\n\nReturn only the updated summary, under 200 words."
+    return query_gemini(prompt, system_prompt, "summary").strip()
+
+def render_story(view, story: str):
+    view.markdown(f'<div class="story-container">{story}</div>', unsafe_allow_html=True)
+
+def live_story_text() -> str:
+    """The newest page of turns and the one before it; the whole story is in the Story Log download."""
+    story_log = st.session_state.story_log
+    first_page = max(0, (len(story_log) - 1) // STORY_PAGE_TURNS - 1)
+    return story_log.text_range(first_page * STORY_PAGE_TURNS, len(story_log))
+
+def stream_into_view(view, tokens: Iterator[str], prefix: str) -> str:
+    parts = []
+    last_render = 0.0
+    for token in tokens:
+        parts.append(token)
+        now = time.monotonic()
+        if now - last_render >= STREAM_RENDER_INTERVAL:
+            render_story(view, prefix + "".join(parts))
+            last_render = now
+    text = "".join(parts)
+    render_story(view, prefix + text)
+    return text
 
 def generate_suggested_actions(story_context: str) -> List[str]:
-    system_prompt = "You are an AI that suggests 3-4 short, action-oriented choices in a JSON array."
-    prompt = f"Story context: {story_context}\nReturn 3-4 possible actions in a JSON array."
-    result = query_gemini(prompt, system_prompt)
-    if result:
-        try:
-            start = result.find('[')
-            end = result.rfind(']') + 1
-            return json.loads(result[start:end])
-        except:
-            pass
+    # Same system prompt and story prefix as the continuation, so the server can reuse its prompt cache
+    prompt = STORY_PREFIX.format(story=story_context) + "TASK: Suggest 3-4 short, action-oriented things the player could do next. Return them as a JSON array of strings."
+    try:
+        result = query_gemini(prompt, STORY_SYSTEM_PROMPT, "suggestions")
+        start = result.find('[')
+        end = result.rfind(']') + 1
+        return json.loads(result[start:end])
+    except (LLMError, ValueError) as e:
+        print(f"Error generating suggestions: {e}")
     return ["Look around", "Search the area", "Continue forward"]  # fallback
 
 def get_arc_hint(arc_progress: int) -> str:
@@ -141,14 +125,16 @@ def get_arc_hint(arc_progress: int) -> str:
         return "The climax draws near, every choice feels heavy with consequence."
 
 # Initialize session state
-if "story" not in st.session_state:
-    st.session_state.story = "You awaken in a quiet village at dawn..."
+if "story_log" not in st.session_state:
+    st.session_state.story_log = StoryLog("You awaken in a quiet village at dawn...")
     st.session_state.choices = []
     st.session_state.arc_progress = 0
     st.session_state.suggested_actions = []
     st.session_state.last_choice = ""
     st.session_state.last_twist = ""
     st.session_state.is_loading = False
+    st.session_state.context = StoryContext(summarize_story)
+    st.session_state.context.add_turn(st.session_state.story_log[0].text)
     st.session_state.world = WorldState()
     st.session_state.world.add_character("Old Man Jenkins", "An elderly villager with a long white beard and kind eyes.", ["wise", "friendly", "knowledgeable"])
     st.session_state.world.add_character("Captain Rourke", "The grizzled captain of the village guard, always on the lookout for trouble.", ["brave", "suspicious", "dutiful"])
@@ -187,15 +173,29 @@ with st.sidebar:
     st.markdown(f"**Time of Day:** {st.session_state.world.time_of_day.title()}")
     with st.expander("🔧 Debug Info", expanded=False):
         st.json(st.session_state.world.to_dict())
-        st.text_area("story_debug", value=st.session_state.story, height=200, label_visibility="collapsed")
+        st.dataframe(
+            [
+                {"span": span.name, "ms": round(span.duration * 1000), "prompt tok": span.prompt_tokens,
+                 "completion tok": span.completion_tokens, "cached": span.cached, "retries": span.retries,
+                 "error": span.error or ""}
+                for span in tracer.recent(limit=10)
+            ],
+            hide_index=True
+        )
+        if isinstance(llm.provider, HedgedRouter):
+            st.dataframe(llm.provider.snapshot(), hide_index=True)
+        st.download_button("Download traces (JSONL)", tracer.to_jsonl, file_name="traces.jsonl", mime="application/x-ndjson")
 
 # Main content
 st.title("📖 Living Pages: A Dynamic Narrative System")
-st.markdown(f'<div class="story-container">{st.session_state.story}</div>', unsafe_allow_html=True)
+story_view = st.empty()
+render_story(story_view, live_story_text())
+if st.session_state.get("turn_error"):
+    st.error(st.session_state.turn_error)
 
 if not st.session_state.suggested_actions:
     with st.spinner("Generating possible actions..."):
-        st.session_state.suggested_actions = generate_suggested_actions(st.session_state.story)
+        st.session_state.suggested_actions = generate_suggested_actions(st.session_state.context.build(STORY_BUDGET))
 
 st.subheader("What will you do next?")
 cols = st.columns(2)
@@ -218,28 +218,47 @@ with st.expander("Or type your own action"):
 if st.session_state.is_loading and st.session_state.last_choice:
     with st.spinner("Continuing the story..."):
         user_choice = st.session_state.last_choice
+        started_at = time.time()
         st.session_state.choices.append(user_choice)
         st.session_state.arc_progress += 1
-        twist = "Nothing unusual happens."  # default fallback
+        twist = ""  # This page has no twist step; no placeholder is written into the story
         arc_hint = get_arc_hint(st.session_state.arc_progress)
         twist_section = f'NARRATIVE TWIST (if any):\n{twist}\n\n' if twist else ''
-        prompt = f"""Continue the story:
-CURRENT STORY:
-{st.session_state.story}
-
-PLAYER'S ACTION:
+        prompt = STORY_PREFIX.format(story=st.session_state.context.build(STORY_BUDGET)) + f"""PLAYER'S ACTION:
 {user_choice}
 
 {twist_section}NARRATIVE ARC HINT:
 {arc_hint}
 
-Continue the story in an engaging way, acknowledging the player's action and twists."""
-        continuation = query_gemini(prompt, "You are a master storyteller.") or "The story continues smoothly..."
-        update_text = f"\n\n> **{user_choice}**"
-        if twist:
-            update_text += f"\n\n*{twist}*\n"
-        update_text += f"\n{continuation}"
-        st.session_state.story += update_text
+TASK: Continue the story in an engaging way, acknowledging the player's action and twists."""
+        try:
+            if STREAM_CONTINUATION:
+                continuation = stream_into_view(
+                    story_view,
+                    stream_gemini(prompt, STORY_SYSTEM_PROMPT, "continuation"),
+                    live_story_text() + format_turn_header(user_choice, twist)
+                )
+            else:
+                continuation = query_gemini(prompt, STORY_SYSTEM_PROMPT, "continuation")
+            if not continuation or not continuation.strip():
+                # Report it like any failed turn instead of writing a placeholder into the story
+                raise LLMResponseError("The model returned no continuation")
+        except LLMError as e:
+            st.session_state.choices.pop()
+            st.session_state.arc_progress -= 1
+            st.session_state.turn_error = f"The storyteller is unavailable right now ({e}). Please try again."
+            st.session_state.is_loading = False
+            st.session_state.last_choice = ""
+            st.rerun()
+        record = TurnRecord(
+            action=user_choice,
+            twist=twist,
+            continuation=continuation,
+            started_at=started_at
+        )
+        st.session_state.story_log.append(record)
+        st.session_state.context.add_turn(record.text.strip())
+        st.session_state.turn_error = ""
         st.session_state.suggested_actions = []
         st.session_state.is_loading = False
         st.session_state.last_choice = ""
@@ -249,7 +268,9 @@ st.markdown("<br><br>", unsafe_allow_html=True)
 
 with st.expander("📝 Story Log", expanded=False):
     st.write("### Story So Far")
-    st.text_area("", st.session_state.story, height=200)
+    # Built only when clicked, so the full story is not sent with every rerun
+    st.download_button("Download the story (Markdown)", lambda: st.session_state.story_log.text,
+                       file_name="story.md", mime="text/markdown")
     st.write("### Your Choices")
     for i, choice in enumerate(st.session_state.choices, 1):
         st.write(f"{i}. {choice}")
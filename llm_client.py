@@ -0,0 +1,716 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from response_cache import ResponseCache
+from story_context import estimate_tokens
+from tokenizer import token_counter
+from tracing import current_span
+
+# Connect and read deadlines in seconds. For streams the read deadline
+# applies between chunks, not to the whole generation.
+DEFAULT_TIMEOUT: Tuple[float, float] = (3.05, 60.0)
+
+# HTTP status codes that are worth retrying
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """Base class for all errors raised by the LLM client."""
+
+    retryable = False
+
+
+class LLMConnectionError(LLMError):
+    """The backend could not be reached."""
+
+    retryable = True
+
+
+class LLMTimeoutError(LLMError):
+    """The backend did not answer before the deadline."""
+
+    retryable = True
+
+
+class LLMHTTPError(LLMError):
+    """The backend answered with an error status."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"HTTP {status_code}: {message}")
+        self.status_code = status_code
+        self.retryable = status_code in RETRYABLE_STATUS
+
+
+class LLMResponseError(LLMError):
+    """The backend answered with a payload we could not understand."""
+
+
+class LLMCancelledError(LLMError):
+    """The caller cancelled the request before it finished."""
+
+
+class LLMOverloadedError(LLMError):
+    """Admission control shed the request: the backend is too busy for its priority."""
+
+
+@dataclass
+class LLMRequest:
+    prompt: str
+    system_prompt: Optional[str] = None
+    prompt_type: str = "default"
+    temperature: float = 0.7
+    max_tokens: int = 500
+    # JSON schema the reply must follow, for backends that can constrain their output
+    response_schema: Optional[Dict] = None
+    # Requests with the same key share a long prompt prefix (one game session's story);
+    # backends that cache prompt prefixes per slot keep them on one slot
+    cache_key: Optional[str] = None
+
+
+@dataclass
+class LLMResponse:
+    text: str
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cached: bool = False
+
+
+class LLMProvider(ABC):
+    """A backend that can complete or stream a single request."""
+
+    name = "provider"
+    model = ""
+
+    @abstractmethod
+    def complete(self, request: LLMRequest) -> LLMResponse:
+        ...
+
+    @abstractmethod
+    def stream(self, request: LLMRequest) -> Iterator[str]:
+        ...
+
+    async def acomplete(self, request: LLMRequest) -> LLMResponse:
+        """Async completion; by default the blocking call runs on a worker thread."""
+        return await asyncio.to_thread(self.complete, request)
+
+    async def astream(self, request: LLMRequest) -> AsyncIterator[str]:
+        """Async stream; by default the blocking stream is read on a worker thread."""
+        tokens = self.stream(request)
+        done = object()
+        try:
+            while True:
+                token = await asyncio.to_thread(next, tokens, done)
+                if token is done:
+                    return
+                yield token
+        finally:
+            tokens.close()
+
+    async def aclose(self):
+        """Release resources held for async calls."""
+
+
+def create_session(pool_size: int = 16) -> requests.Session:
+    """Create a requests Session with a keep-alive connection pool."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"Content-Type": "application/json"})
+    return session
+
+
+def create_async_client(timeout: Tuple[float, float] = DEFAULT_TIMEOUT, pool_size: int = 100) -> httpx.AsyncClient:
+    """Create an httpx AsyncClient with a keep-alive connection pool.
+
+    The client belongs to the event loop it is first used on.
+    """
+    connect, read = timeout
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(read, connect=connect),
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        headers={"Content-Type": "application/json"},
+    )
+
+
+class HTTPProvider(LLMProvider):
+    """Provider that talks JSON over a pooled HTTP session.
+
+    Subclasses describe the wire format through build_payload, request_params
+    and the parse_* hooks; transport, deadlines and error mapping live here.
+    Blocking calls go through a requests Session and async calls through an
+    httpx AsyncClient, both with the same deadlines.
+    """
+
+    def __init__(
+        self,
+        session: Optional[requests.Session] = None,
+        timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+        async_client: Optional[httpx.AsyncClient] = None,
+    ):
+        self.session = session or create_session()
+        self.timeout = timeout
+        self._async_client = async_client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = create_async_client(self.timeout)
+        return self._async_client
+
+    @abstractmethod
+    def endpoint(self, stream: bool) -> str:
+        ...
+
+    def request_params(self, stream: bool) -> Dict[str, str]:
+        return {}
+
+    @abstractmethod
+    def build_payload(self, request: LLMRequest, stream: bool) -> Dict:
+        ...
+
+    @abstractmethod
+    def parse_response(self, data: Dict) -> LLMResponse:
+        ...
+
+    @abstractmethod
+    def parse_stream_event(self, data: Dict) -> Optional[str]:
+        ...
+
+    def _post(self, request: LLMRequest, stream: bool) -> requests.Response:
+        try:
+            response = self.session.post(
+                self.endpoint(stream),
+                params=self.request_params(stream),
+                json=self.build_payload(request, stream),
+                timeout=self.timeout,
+                stream=stream,
+            )
+        except requests.Timeout as e:
+            raise LLMTimeoutError(f"{self.name} timed out: {e}") from e
+        except requests.ConnectionError as e:
+            raise LLMConnectionError(f"Could not reach {self.name}: {e}") from e
+        if response.status_code >= 400:
+            message = response.text[:200]
+            response.close()
+            raise LLMHTTPError(response.status_code, message)
+        return response
+
+    def complete(self, request: LLMRequest) -> LLMResponse:
+        response = self._post(request, stream=False)
+        try:
+            return self.parse_response(response.json())
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise LLMResponseError(f"Unexpected response from {self.name}: {e}") from e
+
+    def _parse_sse_line(self, line: str) -> Tuple[bool, Optional[str]]:
+        """Parse one server-sent event line into (end of stream, token)."""
+        # Each payload line looks like "data: {...}"
+        if not line or not line.startswith("data:"):
+            return False, None
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            return True, None
+        return False, self.parse_stream_event(json.loads(payload))
+
+    def stream(self, request: LLMRequest) -> Iterator[str]:
+        with self._post(request, stream=True) as response:
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    done, token = self._parse_sse_line(line)
+                    if done:
+                        break
+                    if token:
+                        yield token
+            except requests.Timeout as e:
+                raise LLMTimeoutError(f"{self.name} stream stalled: {e}") from e
+            except requests.ConnectionError as e:
+                raise LLMConnectionError(f"{self.name} stream dropped: {e}") from e
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                raise LLMResponseError(f"Unexpected stream event from {self.name}: {e}") from e
+
+    async def _apost(self, request: LLMRequest, stream: bool) -> httpx.Response:
+        client = self.async_client
+        http_request = client.build_request(
+            "POST",
+            self.endpoint(stream),
+            params=self.request_params(stream),
+            json=self.build_payload(request, stream),
+        )
+        try:
+            response = await client.send(http_request, stream=stream)
+        except httpx.TimeoutException as e:
+            raise LLMTimeoutError(f"{self.name} timed out: {e}") from e
+        except httpx.TransportError as e:
+            raise LLMConnectionError(f"Could not reach {self.name}: {e}") from e
+        if response.status_code >= 400:
+            await response.aread()
+            message = response.text[:200]
+            await response.aclose()
+            raise LLMHTTPError(response.status_code, message)
+        return response
+
+    async def acomplete(self, request: LLMRequest) -> LLMResponse:
+        response = await self._apost(request, stream=False)
+        try:
+            return self.parse_response(response.json())
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise LLMResponseError(f"Unexpected response from {self.name}: {e}") from e
+
+    async def astream(self, request: LLMRequest) -> AsyncIterator[str]:
+        response = await self._apost(request, stream=True)
+        try:
+            async for line in response.aiter_lines():
+                done, token = self._parse_sse_line(line)
+                if done:
+                    break
+                if token:
+                    yield token
+        except httpx.TimeoutException as e:
+            raise LLMTimeoutError(f"{self.name} stream stalled: {e}") from e
+        except httpx.TransportError as e:
+            raise LLMConnectionError(f"{self.name} stream dropped: {e}") from e
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise LLMResponseError(f"Unexpected stream event from {self.name}: {e}") from e
+        finally:
+            # Closing the response drops the connection, which stops generation
+            await response.aclose()
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+
+class LocalProvider(HTTPProvider):
+    """OpenAI-compatible chat completions server (LM Studio, llama.cpp, vLLM...).
+
+    With slots (the server's parallel slot count, llama-server -np), each
+    request with a cache_key is pinned to one slot and asks the server to
+    keep its prompt cached, so a session's next call only prefills the text
+    after the shared prefix. Servers other than llama.cpp ignore the hints.
+    """
+
+    name = "local"
+
+    def __init__(self, url: str, model: str = "local-model", slots: int = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.model = model
+        self.slots = slots
+
+    def endpoint(self, stream: bool) -> str:
+        return self.url
+
+    def build_payload(self, request: LLMRequest, stream: bool) -> Dict:
+        messages = []
+        if request.system_prompt:
+            messages.append({"role": "system", "content": request.system_prompt})
+        messages.append({"role": "user", "content": request.prompt})
+        data = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": request.temperature,
+            "max_tokens": request.max_tokens,
+        }
+        if request.response_schema is not None:
+            # OpenAI-style structured output; llama.cpp, vLLM and LM Studio turn it into a grammar
+            data["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": request.prompt_type, "strict": True, "schema": request.response_schema},
+            }
+        if self.slots and request.cache_key is not None:
+            data["cache_prompt"] = True
+            data["id_slot"] = zlib.crc32(request.cache_key.encode()) % self.slots
+        if stream:
+            data["stream"] = True
+        return data
+
+    def parse_response(self, data: Dict) -> LLMResponse:
+        usage = data.get("usage") or {}
+        return LLMResponse(
+            text=data["choices"][0]["message"]["content"],
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+        )
+
+    def parse_stream_event(self, data: Dict) -> Optional[str]:
+        if not data.get("choices"):
+            return None
+        return data["choices"][0].get("delta", {}).get("content")
+
+
+class GeminiProvider(HTTPProvider):
+    """Google Gemini generateContent API."""
+
+    name = "gemini"
+    base_url = "https://generativelanguage.googleapis.com/v1beta/models"
+
+    def __init__(self, api_key: Optional[str], model: str = "gemini-2.5-flash", **kwargs):
+        super().__init__(**kwargs)
+        self.api_key = api_key
+        self.model = model
+
+    def endpoint(self, stream: bool) -> str:
+        method = "streamGenerateContent" if stream else "generateContent"
+        return f"{self.base_url}/{self.model}:{method}"
+
+    def request_params(self, stream: bool) -> Dict[str, str]:
+        params = {"key": self.api_key}
+        if stream:
+            params["alt"] = "sse"
+        return params
+
+    def build_payload(self, request: LLMRequest, stream: bool) -> Dict:
+        payload = {
+            "contents": [{"role": "user", "parts": [{"text": request.prompt}]}],
+            "generationConfig": {
+                "temperature": request.temperature,
+                "maxOutputTokens": request.max_tokens,
+            },
+        }
+        if request.response_schema is not None:
+            payload["generationConfig"]["responseMimeType"] = "application/json"
+            payload["generationConfig"]["responseJsonSchema"] = request.response_schema
+        if self.model.startswith("gemini-2.5"):
+            # Thinking tokens count against maxOutputTokens; the short caps leave no room for them
+            payload["generationConfig"]["thinkingConfig"] = {"thinkingBudget": 0}
+        if request.system_prompt:
+            payload["systemInstruction"] = {"parts": [{"text": request.system_prompt}]}
+        return payload
+
+    def _candidate_text(self, data: Dict) -> str:
+        parts = data["candidates"][0].get("content", {}).get("parts", [])
+        return "".join(part.get("text", "") for part in parts)
+
+    def parse_response(self, data: Dict) -> LLMResponse:
+        usage = data.get("usageMetadata") or {}
+        return LLMResponse(
+            text=self._candidate_text(data),
+            prompt_tokens=usage.get("promptTokenCount"),
+            completion_tokens=usage.get("candidatesTokenCount"),
+        )
+
+    def parse_stream_event(self, data: Dict) -> Optional[str]:
+        if not data.get("candidates"):
+            return None
+        return self._candidate_text(data)
+
+
+def stream_words(text: str) -> Iterator[str]:
+    """Split a canned reply into word tokens, the way offline providers stream it."""
+    words = text.split(" ")
+    for i, word in enumerate(words):
+        yield word if i == len(words) - 1 else word + " "
+
+
+class MockProvider(LLMProvider):
+    """Offline provider for development and tests.
+
+    responder maps a request to the reply text; by default a short canned
+    passage (a JSON array for suggestion prompts, a JSON object for
+    structured turns) is returned.
+    """
+
+    name = "mock"
+    model = "mock-model"
+
+    def __init__(self, responder: Optional[Callable[[LLMRequest], str]] = None, latency: float = 0.0):
+        self.responder = responder or self._default_reply
+        self.latency = latency
+
+    @staticmethod
+    def _default_reply(request: LLMRequest) -> str:
+        if request.response_schema is not None:
+            return json.dumps({
+                "twist": "",
+                "continuation": "The morning mist parts, and the village stirs around you.",
+                "suggestions": ["Look around", "Talk to the villagers", "Head for the forest"],
+                "new_character": None,
+                "relationship_changes": [],
+            })
+        if "JSON array" in request.prompt:
+            return '["Look around", "Talk to the villagers", "Head for the forest"]'
+        if "character name" in request.prompt:
+            return "Elowen Marsh"
+        return "The morning mist parts, and the village stirs around you."
+
+    def complete(self, request: LLMRequest) -> LLMResponse:
+        if self.latency:
+            time.sleep(self.latency)
+        return LLMResponse(text=self.responder(request))
+
+    def stream(self, request: LLMRequest) -> Iterator[str]:
+        if self.latency:
+            time.sleep(self.latency)
+        yield from stream_words(self.responder(request))
+
+    async def acomplete(self, request: LLMRequest) -> LLMResponse:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return LLMResponse(text=self.responder(request))
+
+    async def astream(self, request: LLMRequest) -> AsyncIterator[str]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for word in stream_words(self.responder(request)):
+            yield word
+
+
+def create_provider(name: str, **kwargs) -> LLMProvider:
+    """Create a provider by name: "local", "gemini" or "mock"."""
+    providers = {
+        "local": LocalProvider,
+        "gemini": GeminiProvider,
+        "mock": MockProvider,
+    }
+    if name not in providers:
+        raise ValueError(f"Unknown LLM provider: {name}")
+    return providers[name](**kwargs)
+
+
+class LLMClient:
+    """Front door for all LLM calls: response cache, then retries with jittered exponential backoff."""
+
+    def __init__(
+        self,
+        provider: LLMProvider,
+        max_retries: int = 2,
+        backoff_base: float = 0.25,
+        backoff_max: float = 4.0,
+        cache: Optional[ResponseCache] = None,
+        recorder=None,
+    ):
+        self.provider = provider
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cache = cache
+        # A SessionRecorder that keeps every reply, cache hits included, for replays
+        self.recorder = recorder
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": sleep a random amount up to the exponential cap
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _cache_key(self, request: LLMRequest) -> Optional[str]:
+        """Cache key for the request, or None if its prompt type is not cacheable."""
+        if self.cache is None or not self.cache.accepts(request.prompt_type):
+            return None
+        return self.cache.make_key(
+            f"{self.provider.name}:{self.provider.model}",
+            request.system_prompt,
+            request.prompt,
+            request.temperature,
+            request.max_tokens,
+        )
+
+    # Calls made inside a tracing span record their cache hits, retries and token usage on it
+
+    @staticmethod
+    def _trace_cache_hit():
+        span = current_span()
+        if span is not None:
+            span.cached = True
+
+    @staticmethod
+    def _trace_retry():
+        span = current_span()
+        if span is not None:
+            span.retries += 1
+
+    @staticmethod
+    def _record_usage(request: LLMRequest, response: LLMResponse):
+        if response.prompt_tokens:
+            # Calibrate the prompt budgets' token estimate against the server's tokenizer
+            token_counter.observe(len((request.system_prompt or "") + request.prompt), response.prompt_tokens)
+        span = current_span()
+        if span is None:
+            return
+        # Prefer the server's token counts; fall back to an estimate
+        prompt_tokens = response.prompt_tokens
+        if prompt_tokens is None:
+            prompt_tokens = estimate_tokens((request.system_prompt or "") + request.prompt)
+        completion_tokens = response.completion_tokens
+        if completion_tokens is None:
+            completion_tokens = estimate_tokens(response.text)
+        span.prompt_tokens += prompt_tokens
+        span.completion_tokens += completion_tokens
+
+    def _record_reply(self, request: LLMRequest, text: str):
+        if self.recorder is not None:
+            self.recorder.record_response(request, text)
+
+    def _lookup(self, request: LLMRequest) -> Tuple[Optional[str], Optional[str]]:
+        """The request's cache key (None if it is not cacheable) and the cached reply, if any."""
+        key = self._cache_key(request)
+        if key is None:
+            return None, None
+        cached = self.cache.get(key)
+        if cached is not None:
+            self._trace_cache_hit()
+            self._record_reply(request, cached)
+        return key, cached
+
+    def cached_response(self, request: LLMRequest) -> Optional[LLMResponse]:
+        """The cached reply to a request, or None; lets a scheduler answer hits without queueing them."""
+        _, cached = self._lookup(request)
+        return LLMResponse(text=cached, cached=True) if cached is not None else None
+
+    def complete_request(self, request: LLMRequest, cancel: Optional[threading.Event] = None) -> LLMResponse:
+        """Complete a request, retrying transient failures.
+
+        With a cancel event the completion is streamed under the hood, so that
+        setting the event drops the connection and frees the model slot.
+        """
+        if cancel is not None:
+            return LLMResponse(text="".join(self.stream_request(request, cancel)))
+        key, cached = self._lookup(request)
+        if cached is not None:
+            return LLMResponse(text=cached, cached=True)
+        response = self._complete_with_retries(request)
+        self._record_usage(request, response)
+        self._record_reply(request, response.text)
+        if key is not None:
+            self.cache.put(key, request.prompt_type, response.text)
+        return response
+
+    def stream_request(self, request: LLMRequest, cancel: Optional[threading.Event] = None) -> Iterator[str]:
+        """Stream a request. Retries only happen before the first token arrives."""
+        key, cached = self._lookup(request)
+        if cached is not None:
+            yield cached
+            return
+        parts = []
+        for token in self._stream_with_retries(request, cancel):
+            parts.append(token)
+            yield token
+        self._record_usage(request, LLMResponse(text="".join(parts)))
+        self._record_reply(request, "".join(parts))
+        if key is not None:
+            self.cache.put(key, request.prompt_type, "".join(parts))
+
+    async def acomplete_request(self, request: LLMRequest, lookup: bool = True) -> LLMResponse:
+        """Async version of complete_request; cancelling the task cancels the HTTP request.
+
+        lookup=False skips reading the cache, for callers that already did (cached_response).
+        """
+        # Cache lookups are local SQLite reads, cheap enough to run on the event loop
+        key, cached = self._lookup(request) if lookup else (self._cache_key(request), None)
+        if cached is not None:
+            return LLMResponse(text=cached, cached=True)
+        response = await self._acomplete_with_retries(request)
+        self._record_usage(request, response)
+        self._record_reply(request, response.text)
+        if key is not None:
+            self.cache.put(key, request.prompt_type, response.text)
+        return response
+
+    async def astream_request(self, request: LLMRequest, lookup: bool = True) -> AsyncIterator[str]:
+        """Async version of stream_request. Retries only happen before the first token arrives.
+
+        lookup=False skips reading the cache, as in acomplete_request.
+        """
+        key, cached = self._lookup(request) if lookup else (self._cache_key(request), None)
+        if cached is not None:
+            yield cached
+            return
+        parts = []
+        async for token in self._astream_with_retries(request):
+            parts.append(token)
+            yield token
+        self._record_usage(request, LLMResponse(text="".join(parts)))
+        self._record_reply(request, "".join(parts))
+        if key is not None:
+            self.cache.put(key, request.prompt_type, "".join(parts))
+
+    def _complete_with_retries(self, request: LLMRequest) -> LLMResponse:
+        attempt = 0
+        while True:
+            try:
+                return self.provider.complete(request)
+            except LLMError as e:
+                if not e.retryable or attempt >= self.max_retries:
+                    raise
+                self._trace_retry()
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+
+    def _stream_with_retries(self, request: LLMRequest, cancel: Optional[threading.Event]) -> Iterator[str]:
+        attempt = 0
+        while True:
+            started = False
+            if cancel is not None and cancel.is_set():
+                raise LLMCancelledError("Request cancelled")
+            tokens = self.provider.stream(request)
+            try:
+                for token in tokens:
+                    if cancel is not None and cancel.is_set():
+                        raise LLMCancelledError("Request cancelled")
+                    started = True
+                    yield token
+                return
+            except LLMError as e:
+                if started or not e.retryable or attempt >= self.max_retries:
+                    raise
+                self._trace_retry()
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+            finally:
+                # Closing the stream drops the connection, which stops generation
+                tokens.close()
+
+    async def _acomplete_with_retries(self, request: LLMRequest) -> LLMResponse:
+        attempt = 0
+        while True:
+            try:
+                return await self.provider.acomplete(request)
+            except LLMError as e:
+                if not e.retryable or attempt >= self.max_retries:
+                    raise
+                self._trace_retry()
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+
+    async def _astream_with_retries(self, request: LLMRequest) -> AsyncIterator[str]:
+        attempt = 0
+        while True:
+            started = False
+            tokens = self.provider.astream(request)
+            try:
+                async for token in tokens:
+                    started = True
+                    yield token
+                return
+            except LLMError as e:
+                if started or not e.retryable or attempt >= self.max_retries:
+                    raise
+                self._trace_retry()
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+            finally:
+                await tokens.aclose()
+
+    async def aclose(self):
+        await self.provider.aclose()
+
+    def complete(self, prompt: str, system_prompt: str = None, prompt_type: str = "default", **kwargs) -> str:
+        """Return the completion text for a prompt."""
+        request = LLMRequest(prompt, system_prompt, prompt_type, **kwargs)
+        return self.complete_request(request).text
+
+    def stream(self, prompt: str, system_prompt: str = None, prompt_type: str = "default", **kwargs) -> Iterator[str]:
+        """Yield completion tokens for a prompt as they arrive."""
+        request = LLMRequest(prompt, system_prompt, prompt_type, **kwargs)
+        return self.stream_request(request)
@@ -0,0 +1,166 @@
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from story_log import StoryLog
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher: one pass over the text finds every pattern."""
+
+    def __init__(self, patterns: List[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Set[str]] = [set()]
+        for pattern in patterns:
+            self._add(pattern)
+        self._link()
+
+    def _add(self, pattern: str):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(set())
+            node = nxt
+        self._out[node].add(pattern)
+
+    def _link(self):
+        # Breadth-first so every node's failure target is linked before its children
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] |= self._out[self._fail[child]]
+
+    def find_all(self, text: str) -> Iterator[str]:
+        """Yield each pattern occurrence in the text."""
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                yield from out[node]
+
+
+class MentionIndex:
+    """Tracks which character names appear in the story, and in which turns.
+
+    Only turns appended since the last update are scanned, with a single
+    Aho-Corasick pass over each new turn for all names at once. Matching is
+    case-insensitive substring matching.
+    """
+
+    def __init__(self, story_log: StoryLog):
+        self.story_log = story_log
+        self.first_seen: Dict[str, int] = {}
+        self.last_seen: Dict[str, int] = {}
+        self._names: Dict[str, str] = {}  # Lowercased name -> name
+        self._matcher: Optional[AhoCorasick] = None
+        self._scanned = 0  # Number of story turns already scanned
+        self._backfill: List[str] = []  # Names not yet checked against the turns on disk
+
+    @classmethod
+    def restore(
+        cls,
+        story_log: StoryLog,
+        names: List[str],
+        first_seen: Dict[str, int],
+        last_seen: Dict[str, int],
+        scanned: int,
+    ) -> "MentionIndex":
+        """Rebuild a saved index; turns after `scanned` are picked up by the next update."""
+        index = cls(story_log)
+        index._names = {name.lower(): name for name in names}
+        index.first_seen = dict(first_seen)
+        index.last_seen = dict(last_seen)
+        index._scanned = scanned
+        return index
+
+    @property
+    def scanned(self) -> int:
+        return self._scanned
+
+    def add_name(self, name: str):
+        """Start tracking a name, checking the turns that were scanned before it existed.
+
+        Only turns in memory are checked here; if some are only on disk the
+        name waits for a backfill (pending_backfill and scan_on_disk).
+        """
+        key = name.lower()
+        if not key or key in self._names:
+            return
+        self._names[key] = name
+        self._matcher = None
+        # One-off backfill for this name only; later turns are covered by update()
+        on_disk = False
+        for index in range(self._scanned):
+            record = self.story_log.loaded(index)
+            if record is None:
+                on_disk = True
+            elif key in record.text.lower():
+                self._record(name, index)
+        if on_disk:
+            self._backfill.append(name)
+
+    def pending_backfill(self) -> List[str]:
+        """Names added since the last call that still have to be checked against the turns on disk."""
+        names, self._backfill = self._backfill, []
+        return names
+
+    def scan_on_disk(self, names: List[str], end: int) -> List[Tuple[str, int]]:
+        """(name, turn index) of every mention of the names before turn end, in one sequential pass.
+
+        Only reads the story log, so it may run off the thread that updates
+        the index; hand the result to record_all.
+        """
+        matcher = AhoCorasick([name.lower() for name in names])
+        by_key = {name.lower(): name for name in names}
+        found = []
+        for index, record in enumerate(self.story_log.iter_range(0, end)):
+            found.extend((by_key[key], index) for key in set(matcher.find_all(record.text.lower())))
+        return found
+
+    def record_all(self, mentions: List[Tuple[str, int]]):
+        for name, turn_index in mentions:
+            self._record(name, turn_index)
+
+    def _record(self, name: str, turn_index: int):
+        # Backfills may record turns out of order
+        if turn_index < self.first_seen.get(name, turn_index + 1):
+            self.first_seen[name] = turn_index
+        if turn_index > self.last_seen.get(name, -1):
+            self.last_seen[name] = turn_index
+
+    def update(self):
+        """Scan the turns appended since the last update."""
+        if self._scanned >= len(self.story_log):
+            return
+        if self._matcher is None:
+            self._matcher = AhoCorasick(list(self._names))
+        for index in range(self._scanned, len(self.story_log)):
+            for key in set(self._matcher.find_all(self.story_log[index].text.lower())):
+                self._record(self._names[key], index)
+        self._scanned = len(self.story_log)
+
+    def is_mentioned(self, name: str) -> bool:
+        self.update()
+        return name in self.first_seen
+
+    def seen_in(self, name: str) -> Optional[Tuple[int, int]]:
+        """(first, last) turn index in which the name appears, or None."""
+        self.update()
+        if name not in self.first_seen:
+            return None
+        return self.first_seen[name], self.last_seen[name]
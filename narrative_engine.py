@@ -0,0 +1,740 @@
+import asyncio
+import copy
+import logging
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
+
+from llm_client import LLMClient, LLMError, LLMRequest
+from mention_index import MentionIndex
+from procedural import TwistPolicy
+from prompt_builder import PromptBuilder
+from router import HedgedRouter
+from scheduler import PRIORITY_SPECULATIVE, BatchScheduler, scheduling_as
+from session_store import SavedSession, SessionStore
+from speculation import SpeculativeCache, story_state_hash
+from story_context import StoryContext
+from story_log import StoryLog, format_turn_header
+from story_memory import StoryMemory
+from tracing import Tracer
+from turn_pipeline import (
+    DEFAULT_SUGGESTIONS, STORY_BUDGET, STORY_SYSTEM_PROMPT, TurnPlan, TurnResult, TurnStreamDecoder, apply_turn, arun_turn, parse_suggestions,
+    plan_turn, suggestions_request
+)
+from world import Character, WorldState
+
+logger = logging.getLogger(__name__)
+
+OPENING = "You awaken in a quiet village at dawn..."
+
+SUMMARY_SYSTEM_PROMPT = """You are a story editor who keeps a concise running summary of a text adventure.
+    Preserve names, promises, items, locations and unresolved threads. Write in past tense."""
+
+
+def summary_request(previous_summary: str, new_events: str) -> LLMRequest:
+    """Build the request that folds new story events into the running summary."""
+    template = """Update the summary with the new events. Keep it under 200 words.
+
+SUMMARY SO FAR:
+{summary}
+
+NEW EVENTS:
+{events}
+
+Return only the updated summary."""
+    builder = PromptBuilder("summary", template, SUMMARY_SYSTEM_PROMPT)
+    builder.add("summary", previous_summary or "(nothing yet)", priority=2)
+    builder.add("events", new_events, priority=1, keep="head")
+    return builder.request()
+
+
+def starting_world() -> WorldState:
+    """The world a new game starts in."""
+    world = WorldState()
+
+    # Add some initial characters
+    world.add_character(
+        "Old Man Jenkins",
+        "An elderly villager with a long white beard and kind eyes.",
+        ["wise", "friendly", "knowledgeable"]
+    )
+    world.add_character(
+        "Captain Rourke",
+        "The grizzled captain of the village guard, always on the lookout for trouble.",
+        ["brave", "suspicious", "dutiful"]
+    )
+    world.add_character(
+        "Mysterious Stranger",
+        "A hooded figure who watches from the shadows.",
+        ["mysterious", "elusive", "dangerous"]
+    )
+
+    # Initialize character relationships
+    world.update_character_relationship("Old Man Jenkins", 2)  # Starts friendly
+    world.update_character_relationship("Captain Rourke", -1)  # Slightly unfriendly
+    world.update_character_relationship("Mysterious Stranger", -3)  # Unfriendly
+    return world
+
+
+@dataclass
+class TurnJob:
+    """Handle on a turn played in the background.
+
+    The engine updates it as the turn progresses; other threads may poll it
+    and cancel it. Cancelling aborts the model requests in flight, which
+    frees their scheduler slots, and leaves the session untouched.
+    """
+
+    session_id: str
+    action: str
+    loop: asyncio.AbstractEventLoop = field(repr=False)
+    phase: str = "queued"  # queued, generating, saving, done, failed or cancelled
+    steps: Dict[str, str] = field(default_factory=dict)  # LLM step -> started, finished or failed
+    error: str = ""
+    result: Optional[TurnResult] = None
+    started_at: float = field(default_factory=time.monotonic)
+    polled_at: float = field(default_factory=time.monotonic)
+    _parts: List[str] = field(default_factory=list, repr=False)
+    _task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.phase in ("done", "failed", "cancelled")
+
+    @property
+    def text(self) -> str:
+        """The turn's text streamed so far."""
+        return "".join(self._parts)
+
+    def poll(self) -> "TurnJob":
+        """Note that someone is still waiting for the turn, and return the job."""
+        self.polled_at = time.monotonic()
+        return self
+
+    def cancel(self):
+        """Cancel the turn unless it is already being saved; safe from any thread."""
+        self.loop.call_soon_threadsafe(self._cancel)
+
+    def _cancel(self):
+        if self.phase in ("queued", "generating") and self._task is not None:
+            self._task.cancel()
+
+    def _on_token(self, token: str):
+        self._parts.append(token)
+
+    def _on_progress(self, name: str, state: str):
+        if name == "turn":
+            self.phase = "generating"
+        elif name == "commit":
+            self.phase = "saving"
+        else:
+            self.steps[name] = state
+
+
+@dataclass
+class GameSession:
+    """The state of one player's game."""
+
+    session_id: str
+    story_log: StoryLog
+    world: WorldState
+    context: StoryContext
+    mentions: MentionIndex
+    memory: StoryMemory
+    choices: List[str] = field(default_factory=list)
+    arc_progress: int = 0
+    suggested_actions: List[str] = field(default_factory=list)
+    last_twist: str = ""
+    speculation: SpeculativeCache = field(default_factory=SpeculativeCache)
+    # Turns of one session are played one at a time
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+    # The latest turn started with start_turn
+    turn_job: Optional[TurnJob] = None
+    # World version the store has; the next journal line holds the changes since
+    saved_version: int = 0
+    # When the session was last opened, for evicting idle sessions
+    last_used: float = field(default_factory=time.monotonic)
+
+    @property
+    def busy(self) -> bool:
+        """Whether a turn or a summary of the session is still in flight."""
+        running = self.turn_job is not None and not self.turn_job.finished
+        return running or self.lock.locked() or self.context.folding
+
+    def mentioned_characters(self) -> List[Character]:
+        """Characters whose name appears somewhere in the story."""
+        return [char for char in self.world.characters.values() if self.mentions.is_mentioned(char.name)]
+
+    def state_hash(self) -> str:
+        """Hash of the state the next turn starts from."""
+        return story_state_hash(self.story_log, self.arc_progress, self.world)
+
+    def saved(self) -> SavedSession:
+        """The part of the session that is saved to disk."""
+        summary, folded_turns = self.context.state()
+        return SavedSession(
+            story_log=self.story_log,
+            world=self.world,
+            choices=self.choices,
+            arc_progress=self.arc_progress,
+            suggested_actions=self.suggested_actions,
+            summary=summary,
+            folded_turns=folded_turns,
+            mentions={
+                "first_seen": self.mentions.first_seen,
+                "last_seen": self.mentions.last_seen,
+                "scanned": self.mentions.scanned
+            }
+        )
+
+
+@dataclass(frozen=True)
+class SessionView:
+    """What the UI shows of a session, copied on the engine's loop so another thread can read it."""
+
+    session_id: str
+    turns: int
+    world_version: int
+    choice_count: int
+    recent_choices: Tuple[str, ...]
+    arc_progress: int
+    suggested_actions: Tuple[str, ...]
+    current_location: str
+    time_of_day: str
+    # The session's running turn, if any; TurnJob is safe to poll from other threads
+    turn_job: Optional[TurnJob]
+
+
+class NarrativeEngine:
+    """Headless game engine serving many sessions from one asyncio event loop.
+
+    All LLM calls are awaited on the loop, so a session waiting on the model
+    costs a suspended task rather than a blocked thread. Methods must be
+    called on the engine's loop; EngineThread gives synchronous callers
+    such as Streamlit a way in. Summaries are folded on a small shared
+    thread pool since they are off the turn's critical path.
+
+    With a scheduler, every LLM call (summaries included) goes through it,
+    so requests from all sessions are batched, queued fairly and, under
+    overload, shed by priority: speculation first, continuations never.
+
+    With structured_turns, each turn is one schema-constrained call that
+    also returns the next suggestions, instead of up to four calls that
+    each send the story again. The backend must support JSON schema output.
+
+    twist_policy decides which twists, interactions and new names are left
+    to the procedural generator instead of a model call; it does not apply
+    to structured turns, which write the event in the same call anyway.
+
+    Each turn's random decisions are drawn from a seed taken from rng. A
+    recorder (SessionRecorder) is told every committed turn's action and
+    seed; passing the seeds back to take_turn replays the same turns. While
+    recording, each prompt waits for the session's pending summary, so a
+    replay that does the same sends the same prompts.
+
+    With a store, sessions unused for idle_timeout seconds, and the least
+    recently used ones beyond max_sessions, are dropped from memory when
+    another session is loaded; every turn is saved, so they resume from
+    the store. Sessions with a turn or summary in flight are kept.
+    """
+
+    def __init__(
+        self,
+        client: LLMClient,
+        store: Optional[SessionStore] = None,
+        speculation_concurrency: int = 2,
+        summary_workers: int = 4,
+        rng=random,
+        scheduler: Optional[BatchScheduler] = None,
+        tracer: Optional[Tracer] = None,
+        structured_turns: bool = False,
+        twist_policy: Optional[TwistPolicy] = None,
+        recorder=None,
+        idle_timeout: Optional[float] = None,
+        max_sessions: Optional[int] = None,
+    ):
+        self.client = client
+        self.structured_turns = structured_turns
+        self.twist_policy = None if structured_turns else twist_policy
+        self.tracer = tracer or Tracer()
+        self.scheduler = scheduler
+        # Async LLM calls go through the scheduler when there is one
+        self.llm = scheduler if scheduler is not None else client
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.store = store
+        self.speculation_concurrency = speculation_concurrency
+        self.rng = rng
+        self.recorder = recorder
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        # Least recently used first: open_session moves a session to the end
+        self.sessions: Dict[str, GameSession] = {}
+        self._opening: Dict[str, asyncio.Future] = {}
+        self._summary_executor = ThreadPoolExecutor(max_workers=summary_workers, thread_name_prefix="story-summary")
+
+    def _summarize(self, previous_summary: str, new_events: str) -> str:
+        request = summary_request(previous_summary, new_events)
+        if self.scheduler is None:
+            with self.tracer.span("summary"):
+                return self.client.complete_request(request).text.strip()
+        # Runs on a summary thread; hand the call to the scheduler on the engine's loop
+        return asyncio.run_coroutine_threadsafe(self._asummarize(request), self._loop).result()
+
+    async def _asummarize(self, request: LLMRequest) -> str:
+        with self.tracer.span("summary"):
+            response = await self.scheduler.acomplete_request(request)
+        return response.text.strip()
+
+    def _plan(self, action: str, mentioned_chars: List[Character], seed: int) -> TurnPlan:
+        queued = self.scheduler.stats()["queued"] if self.scheduler is not None else 0
+        return plan_turn(action, mentioned_chars, random.Random(seed), self.twist_policy, queued)
+
+    def _pinned(self, session_id: str) -> Callable[[LLMRequest], Coroutine]:
+        """acomplete_request that keys the session's story prompts to its prompt cache."""
+        async def complete(request: LLMRequest):
+            # Prompts without the story (a new character's name) would only evict the cached prefix
+            if request.system_prompt == STORY_SYSTEM_PROMPT:
+                request.cache_key = session_id
+            return await self.llm.acomplete_request(request)
+        return complete
+
+    def _new_context(self) -> StoryContext:
+        return StoryContext(self._summarize, executor=self._summary_executor)
+
+    def _load_or_create(self, session_id: str) -> GameSession:
+        context = self._new_context()
+        speculation = SpeculativeCache(self.speculation_concurrency)
+        if self.store is not None and self.store.exists(session_id):
+            # Resume a saved game; only the most recent turns are read from disk
+            saved = self.store.load(session_id)
+            context.restore(
+                saved.summary,
+                saved.folded_turns,
+                [turn.text.strip() for turn in saved.story_log.since(saved.folded_turns)]
+            )
+            mentions = MentionIndex.restore(
+                saved.story_log,
+                list(saved.world.characters),
+                saved.mentions["first_seen"],
+                saved.mentions["last_seen"],
+                saved.mentions["scanned"]
+            )
+            memory = StoryMemory(saved.story_log)
+            session = GameSession(
+                session_id=session_id,
+                story_log=saved.story_log,
+                world=saved.world,
+                context=context,
+                mentions=mentions,
+                memory=memory,
+                choices=saved.choices,
+                arc_progress=saved.arc_progress,
+                suggested_actions=saved.suggested_actions,
+                speculation=speculation,
+            )
+        else:
+            # The story is an append-only log of turns; the opening passage is turn 0
+            story_log = StoryLog(OPENING)
+            context.add_turn(story_log[0].text)
+            world = starting_world()
+
+            # Index of character mentions, kept up to date as turns and characters are added
+            mentions = MentionIndex(story_log)
+            for name in world.characters:
+                mentions.add_name(name)
+            session = GameSession(
+                session_id=session_id,
+                story_log=story_log,
+                world=world,
+                context=context,
+                mentions=mentions,
+                memory=StoryMemory(story_log),
+                speculation=speculation,
+            )
+            if self.store is not None:
+                self.store.create(session_id, session.saved())
+
+        session.world.character_listeners.append(lambda char: session.mentions.add_name(char.name))
+        session.saved_version = session.world.version
+        # Index the whole story now, off the event loop; later turns are indexed one at a time
+        session.memory.update()
+        return session
+
+    async def open_session(self, session_id: Optional[str] = None) -> GameSession:
+        """Return a session, resuming it from the store or starting a new game."""
+        self._loop = asyncio.get_running_loop()
+        if session_id is None:
+            session_id = uuid.uuid4().hex
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            self.sessions[session_id] = session
+            session.last_used = time.monotonic()
+            return session
+        # Concurrent opens of the same session share a single load
+        opening = self._opening.get(session_id)
+        if opening is None:
+            opening = asyncio.ensure_future(asyncio.to_thread(self._load_or_create, session_id))
+            self._opening[session_id] = opening
+        try:
+            session = await asyncio.shield(opening)
+        finally:
+            if self._opening.get(session_id) is opening and opening.done():
+                del self._opening[session_id]
+        session = self.sessions.setdefault(session_id, session)
+        session.last_used = time.monotonic()
+        self._evict_idle(keep=session_id)
+        return session
+
+    def _evict_idle(self, keep: str):
+        # Without a store an evicted game would be lost
+        if self.store is None or (self.idle_timeout is None and self.max_sessions is None):
+            return
+        now = time.monotonic()
+        excess = len(self.sessions) - self.max_sessions if self.max_sessions is not None else 0
+        evict = []
+        for session in self.sessions.values():
+            expired = self.idle_timeout is not None and now - session.last_used > self.idle_timeout
+            # Later sessions were used more recently, so none of them is due either
+            if len(evict) >= excess and not expired:
+                break
+            if session.session_id != keep and not session.busy:
+                evict.append(session.session_id)
+        for session_id in evict:
+            logger.info("Evicting idle session %s", session_id)
+            self.end_session(session_id)
+
+    async def _settle(self, session: GameSession):
+        # While recording, let pending summaries land first: then the prompts depend only on the
+        # recorded turns, not on how fast the summaries were, and a replay sends the same ones
+        if self.recorder is not None:
+            await asyncio.to_thread(session.context.wait)
+
+    async def suggest_actions(self, session_id: str) -> List[str]:
+        """Suggested next actions, generating them if the session has none."""
+        session = await self.open_session(session_id)
+        if not session.suggested_actions:
+            await self._settle(session)
+            try:
+                with scheduling_as(session_id), self.tracer.span("suggestions", session_id=session_id):
+                    response = await self._pinned(session_id)(suggestions_request(session.context.build(STORY_BUDGET)))
+                session.suggested_actions = parse_suggestions(response.text)
+            except LLMError as e:
+                logger.warning("Error generating suggestions for session %s: %s", session_id, e)
+                # Default suggestions if generation fails; kept so every rerun does not ask the model again
+                session.suggested_actions = list(DEFAULT_SUGGESTIONS)
+        return list(session.suggested_actions)
+
+    async def character_view(self, session_id: str) -> List[Dict[str, Any]]:
+        """Each character with the (first, last) turn it was seen in, as a copy that is safe to read off the loop."""
+        session = await self.open_session(session_id)
+        return [
+            {
+                "name": char.name,
+                "description": char.description,
+                "relationship": char.relationship,
+                "relationship_points": char.relationship_points,
+                "traits": list(char.traits),
+                "seen_in": session.mentions.seen_in(char.name),
+            }
+            for char in session.world.characters.values()
+        ]
+
+    async def view(self, session_id: str, recent_choices: int = 20) -> SessionView:
+        """Open a session and return what the UI shows of it, with its last recent_choices choices."""
+        session = await self.open_session(session_id)
+        job = session.turn_job
+        return SessionView(
+            session_id=session_id,
+            turns=len(session.story_log),
+            world_version=session.world.version,
+            choice_count=len(session.choices),
+            recent_choices=tuple(session.choices[-recent_choices:]) if recent_choices > 0 else (),
+            arc_progress=session.arc_progress,
+            suggested_actions=tuple(session.suggested_actions),
+            current_location=session.world.current_location,
+            time_of_day=session.world.time_of_day,
+            turn_job=job if job is not None and not job.finished else None,
+        )
+
+    async def debug_view(self, session_id: str) -> Dict[str, Any]:
+        """Engine internals for the debug panel, copied on the loop.
+
+        Holds the world (WorldState.to_dict), the response cache, backend
+        and scheduler stats when there are any, and the spans of the
+        session's last turn.
+        """
+        session = await self.open_session(session_id)
+        router = self.client.provider if isinstance(self.client.provider, HedgedRouter) else None
+        return {
+            "world": copy.deepcopy(session.world.to_dict()),
+            "cache": self.client.cache.stats() if self.client.cache is not None else None,
+            "hedges": router.hedges if router is not None else None,
+            "backends": router.snapshot() if router is not None else None,
+            "scheduler": self.scheduler.stats() if self.scheduler is not None else None,
+            "last_turn": [
+                {
+                    "span": span.name,
+                    "ms": round(span.duration * 1000),
+                    "queue ms": round(span.queue_time * 1000),
+                    "prompt tok": span.prompt_tokens,
+                    "completion tok": span.completion_tokens,
+                    "cached": span.cached,
+                    "retries": span.retries,
+                    "error": span.error or ""
+                }
+                for span in self.tracer.last_trace(session_id)
+            ],
+        }
+
+    async def traces_jsonl(self, session_id: str) -> str:
+        """The session's recent spans as JSON lines."""
+        return self.tracer.to_jsonl(self.tracer.recent(session_id))
+
+    async def story_text(self, session_id: str, start: int = 0, end: Optional[int] = None) -> str:
+        """Text of turns start to end (exclusive, None for the whole story); turns on disk are read off the loop."""
+        session = await self.open_session(session_id)
+        story_log = session.story_log
+        end = len(story_log) if end is None else end
+        return await asyncio.to_thread(lambda: "".join(turn.text for turn in story_log.iter_range(start, end)))
+
+    async def queue_position(self, session_id: str) -> Optional[int]:
+        """How many model requests are queued ahead of the session's, or None if none of its requests is waiting."""
+        return self.scheduler.position(session_id) if self.scheduler is not None else None
+
+    async def speculate(self, session_id: str, actions: List[str]):
+        """Pre-generate the turn for each action while the player is reading."""
+        session = await self.open_session(session_id)
+        if session.lock.locked():
+            return
+        mentioned_chars = session.mentioned_characters()
+        arc_progress = session.arc_progress + 1
+
+        async def run(action: str) -> TurnResult:
+            await self._settle(session)
+            seed = self.rng.getrandbits(32)
+            plan = self._plan(action, mentioned_chars, seed)
+            # Lowest priority: shed first, and not even queued while anything else waits
+            with scheduling_as(session_id, PRIORITY_SPECULATIVE), self.tracer.span("speculative_turn", session_id=session_id, action=action):
+                # Not pinned to the session's slot: the speculated actions run side by side, one slot would serialize them
+                result = await arun_turn(
+                    plan, session.context, session.world, arc_progress, self.llm.acomplete_request,
+                    tracer=self.tracer, memory=session.memory, structured=self.structured_turns
+                )
+            result.seed = seed
+            return result
+        session.speculation.start(session.state_hash(), actions, run)
+
+    async def take_turn(
+        self,
+        session_id: str,
+        action: str,
+        on_token: Optional[Callable[[str], Any]] = None,
+        on_progress: Optional[Callable[[str, str], None]] = None,
+        seed: Optional[int] = None,
+    ) -> TurnResult:
+        """Play one turn of a session and commit it.
+
+        on_token receives the turn's text as it is generated: the action and
+        twist header first, then the continuation token by token.
+        on_progress is called with (name, "started" / "finished" / "failed")
+        for the turn itself once it has the session, for each LLM step and
+        for the commit.
+        seed replays a recorded turn: its decisions are drawn from that seed,
+        and a speculated result is not used.
+        Raises LLMError if the turn could not be generated, in which case
+        the session is left untouched.
+        """
+        progress = on_progress or (lambda name, state: None)
+        requested_at = time.time()
+        session = await self.open_session(session_id)
+        with scheduling_as(session_id), self.tracer.span("turn", session_id=session_id, action=action) as span:
+            async with session.lock:
+                progress("turn", "started")
+                await self._settle(session)
+                # A speculated action is a cache hit; the other speculations are cancelled
+                result = None
+                speculated = session.speculation.take(session.state_hash(), action) if seed is None else None
+                if speculated is not None:
+                    await asyncio.wait({speculated})
+                    if speculated.cancelled() or speculated.exception() is not None:
+                        logger.info("Speculative turn failed, generating it again")
+                    else:
+                        result = speculated.result()
+                        span.attributes["speculated"] = True
+                        if on_token is not None:
+                            on_token(result.update_text)
+
+                if result is None:
+                    # Draw every random decision up front so the turn steps can run concurrently
+                    if seed is None:
+                        seed = self.rng.getrandbits(32)
+                    plan = self._plan(action, session.mentioned_characters(), seed)
+                    span.attributes["event"] = plan.event
+
+                    async def stream_continuation(request: LLMRequest, results: Dict[str, Any]) -> str:
+                        if self.structured_turns:
+                            # The reply is JSON; show the continuation field as it is decoded
+                            decoder = TurnStreamDecoder(action, show_twist=plan.event != "none")
+
+                            def emit(token: str):
+                                text = decoder.feed(token)
+                                if text:
+                                    on_token(text)
+                        else:
+                            on_token(format_turn_header(action, results["twist"]["twist"]))
+                            emit = on_token
+                        parts = []
+                        request.cache_key = session_id
+                        async with aclosing(self.llm.astream_request(request)) as tokens:
+                            async for token in tokens:
+                                parts.append(token)
+                                emit(token)
+                        return "".join(parts)
+
+                    result = await arun_turn(
+                        plan,
+                        session.context,
+                        session.world,
+                        session.arc_progress + 1,
+                        self._pinned(session_id),
+                        stream_continuation if on_token is not None else None,
+                        tracer=self.tracer,
+                        memory=session.memory,
+                        structured=self.structured_turns,
+                        on_progress=on_progress
+                    )
+                    result.seed = seed
+
+                # Commit the turn
+                progress("commit", "started")
+                with self.tracer.span("commit"):
+                    apply_turn(session.world, result)
+                    session.choices.append(action)
+                    session.arc_progress += 1
+                    if result.twist:
+                        session.last_twist = result.twist
+                    record = result.to_record()
+                    session.story_log.append(record)
+                    session.context.add_turn(record.text.strip())
+                    session.suggested_actions = result.suggestions
+
+                    if self.store is not None:
+                        # Everything saved is copied here on the loop; the worker thread only writes it
+                        world_delta = session.world.delta(session.saved_version)
+                        snapshot = None
+                        if self.store.should_snapshot(len(session.story_log)):
+                            snapshot = self.store.encode_snapshot(session.saved())
+                        saved = await asyncio.to_thread(
+                            self._save_turn, session_id, record, world_delta, session.arc_progress,
+                            list(result.suggestions), snapshot
+                        )
+                        if saved:
+                            # Otherwise the next journal line carries this turn's world changes too
+                            session.saved_version = world_delta["version"]
+                    if self.recorder is not None:
+                        self.recorder.record_turn(session_id, len(session.story_log) - 1, action, result.seed, requested_at)
+                await self._backfill_mentions(session)
+        return result
+
+    @staticmethod
+    async def _backfill_mentions(session: GameSession):
+        # Characters added this turn are looked for in the turns on disk in one pass, off the loop
+        names = session.mentions.pending_backfill()
+        if names:
+            found = await asyncio.to_thread(session.mentions.scan_on_disk, names, session.mentions.scanned)
+            session.mentions.record_all(found)
+
+    async def start_turn(self, session_id: str, action: str, abandon_after: Optional[float] = None) -> TurnJob:
+        """Start playing a turn in the background and return its job.
+
+        While a turn of the session is still running, its job is returned
+        instead of starting another. With abandon_after, the turn is
+        cancelled once nobody has polled the job for that many seconds.
+        """
+        session = await self.open_session(session_id)
+        if session.turn_job is not None and not session.turn_job.finished:
+            return session.turn_job
+        job = TurnJob(session_id, action, asyncio.get_running_loop())
+        job._task = asyncio.ensure_future(self._run_job(job, abandon_after))
+        session.turn_job = job
+        return job
+
+    async def _run_job(self, job: TurnJob, abandon_after: Optional[float]):
+        watchdog = asyncio.ensure_future(self._watch_job(job, abandon_after)) if abandon_after else None
+        try:
+            job.result = await self.take_turn(job.session_id, job.action, job._on_token, job._on_progress)
+            job.phase = "done"
+        except asyncio.CancelledError:
+            job.phase = "cancelled"
+        except LLMError as e:
+            job.error = str(e)
+            job.phase = "failed"
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.phase = "failed"
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+
+    @staticmethod
+    async def _watch_job(job: TurnJob, abandon_after: float):
+        while True:
+            await asyncio.sleep(min(1.0, abandon_after / 2))
+            if time.monotonic() - job.polled_at > abandon_after:
+                logger.info("Cancelling abandoned turn of session %s", job.session_id)
+                job._cancel()
+                return
+
+    def _save_turn(self, session_id: str, record, world_delta: Dict[str, Any], arc_progress: int,
+                   suggestions: List[str], snapshot: Optional[str]) -> bool:
+        # Journal the turn and its world delta, and write the compacted snapshot when one is due
+        try:
+            self.store.append_turn(session_id, record, world_delta, arc_progress, suggestions)
+            if snapshot is not None:
+                self.store.write_snapshot(session_id, snapshot)
+        except Exception:
+            # A failed save must not lose the turn the player just saw
+            logger.exception("Error saving session %s", session_id)
+            return False
+        return True
+
+    def end_session(self, session_id: str):
+        """Drop a session from memory; a saved session can be opened again later."""
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.speculation.cancel_all()
+            if session.turn_job is not None:
+                session.turn_job._cancel()
+
+    async def close(self):
+        # Let in-flight summaries land before the client goes away
+        for session in self.sessions.values():
+            await asyncio.to_thread(session.context.wait)
+        for session_id in list(self.sessions):
+            self.end_session(session_id)
+        self._summary_executor.shutdown(wait=False)
+        await self.llm.aclose()
+
+
+class EngineThread:
+    """Runs a NarrativeEngine's event loop on a daemon thread for synchronous callers."""
+
+    def __init__(self, engine: NarrativeEngine):
+        self.engine = engine
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="narrative-engine", daemon=True)
+        self._thread.start()
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Schedule a coroutine on the engine's loop."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the engine's loop and wait for its result."""
+        return self.submit(coro).result(timeout)
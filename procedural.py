@@ -0,0 +1,261 @@
+import random
+import string
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Collection, Dict, List, Optional, Sequence, Tuple, Union
+
+from world import Character, RelationshipLevel
+
+# A template compiled to (is_slot, text) parts: literal text, or the name of a table to expand
+Compiled = Tuple[Tuple[bool, str], ...]
+
+
+def _compile(template: str) -> Compiled:
+    parts = []
+    for literal, slot, _, _ in string.Formatter().parse(template):
+        if literal:
+            parts.append((False, literal))
+        if slot is not None:
+            parts.append((True, slot))
+    return tuple(parts)
+
+
+def _compile_tables(tables: Dict[str, List[str]]) -> Dict[str, List[Compiled]]:
+    return {name: [_compile(option) for option in options] for name, options in tables.items()}
+
+
+# Interaction lines by interaction type; {manner} always comes right before punctuation
+INTERACTIONS = _compile_tables({
+    "challenge": [
+        "{name} steps into your path{manner}, daring you to prove you belong here.",
+        "{name} blocks the way{manner}. \"{challenge_line}\"",
+    ],
+    "threat": [
+        "{name} leans close{manner}, warning that {threat_outcome} if you keep meddling.",
+        "{name}'s hand rests on a hidden blade{manner}. \"Leave, or {threat_outcome}.\"",
+    ],
+    "warning": [
+        "{name} catches your sleeve{manner}, warning you about {danger}.",
+        "{name} lowers their voice{manner}. \"Beware {danger}.\"",
+    ],
+    "observe": [
+        "{name} watches you from across {place}{manner}, saying nothing.",
+        "You notice {name} studying your every move{manner}.",
+    ],
+    "question": [
+        "{name} looks you over{manner}, asking what brings you {place_phrase}.",
+        "{name} leans in{manner}, asking whether you have heard about {rumor}.",
+    ],
+    "comment": [
+        "{name} shrugs{manner}, remarking that {rumor} is all anyone talks about lately.",
+        "{name} nods at you{manner}. \"Strange {time_of_day}, isn't it?\"",
+    ],
+    "help": [
+        "{name} presses {gift} into your hands{manner}. \"You'll need this more than I do.\"",
+        "{name} beckons you closer{manner}, pointing out a hidden path {place_phrase}.",
+    ],
+    "advice": [
+        "{name} taps your shoulder{manner}, telling you to trust {advice_target} and not much else.",
+        "{name} pauses{manner}, then advises you to look for {rumor} before nightfall.",
+    ],
+    "gift": [
+        "{name} offers you {gift}{manner}, refusing any payment.",
+        "With a smile, {name} gives you {gift}.",
+    ],
+})
+
+# Plain twists, independent of any character
+TWISTS = _compile_tables({
+    "twist": [
+        "Just then, {sound} echoes {place_phrase}.",
+        "As you {action_gerund}, {discovery}.",
+        "Without warning, {event}.",
+        "Somewhere {place_phrase}, {sound} breaks the {time_of_day} quiet.",
+        "You realize {discovery}.",
+    ],
+    "action_gerund": ["move on", "take a step forward", "catch your breath", "look back"],
+    "discovery": [
+        "you spot {object} half-buried at your feet",
+        "you notice fresh tracks that were not there a moment ago",
+        "{object} you passed earlier is now gone",
+    ],
+    "event": [
+        "the ground trembles beneath you",
+        "a cold wind snuffs out every light {place_phrase}",
+        "a cloaked rider thunders past and vanishes",
+        "{sound} is followed by complete silence",
+    ],
+    "challenge_line": ["Show me what you're made of.", "Nobody passes without answering to me.", "Turn back, stranger."],
+    "threat_outcome": ["you will regret it", "you won't see the next dawn", "the whole village will hear of it"],
+    "danger": ["wolves on the old road", "a stranger asking about you", "the thing that walks at night"],
+    "rumor": ["the missing merchant", "lights in the abandoned tower", "a map to the caverns"],
+    "gift": ["a worn silver coin", "a loaf of warm bread", "a small brass key", "a vial of bitter tonic"],
+    "advice_target": ["your own eyes", "the old stories", "the river's current"],
+    "place_phrase": ["in {place}", "near {place}", "beyond {place}"],
+})
+
+# Details by location, used by both tables above
+LOCATIONS = {
+    "Village Square": _compile_tables({
+        "place": ["the village square", "the old well", "the market stalls"],
+        "sound": ["the chapel bell", "a shout from the tavern", "the clatter of a dropped crate"],
+        "object": ["a torn merchant's ledger", "a muddy wooden token"],
+    }),
+    "Dark Forest": _compile_tables({
+        "place": ["the dark forest", "the twisted oaks", "a moss-covered clearing"],
+        "sound": ["a wolf's howl", "the snap of a branch", "distant drums"],
+        "object": ["a rusted hunting knife", "a ring of pale mushrooms"],
+    }),
+    "Mystic Caverns": _compile_tables({
+        "place": ["the mystic caverns", "a glowing crystal vein", "the underground stream"],
+        "sound": ["dripping water", "a low rumble from the depths", "faint chanting"],
+        "object": ["a glowing shard of crystal", "an ancient carved rune"],
+    }),
+    "Abandoned Tower": _compile_tables({
+        "place": ["the abandoned tower", "the crumbling stairwell", "the tower's broken gate"],
+        "sound": ["the creak of old timbers", "a loud crash from the room above", "the beat of wings"],
+        "object": ["a shattered spyglass", "a page torn from a spellbook"],
+    }),
+}
+DEFAULT_LOCATION = "Village Square"
+
+# How a character acts, by trait; the first trait with an entry wins
+MANNERS = _compile_tables({
+    "wise": [", choosing each word with care", ", with a knowing look"],
+    "friendly": [", smiling warmly", ", in a cheerful voice"],
+    "knowledgeable": [", as if reciting an old lesson"],
+    "brave": [", chin held high"],
+    "suspicious": [", narrowing their eyes", ", glancing over their shoulder"],
+    "dutiful": [", in a clipped, official tone"],
+    "mysterious": [", half-hidden in shadow", ", voice barely above a whisper"],
+    "elusive": [", already half-turned to leave"],
+    "dangerous": [", with a cold smile"],
+    "playful": [", with a mischievous grin"],
+    "serious": [", without a hint of humor"],
+    "eccentric": [", humming an odd tune"],
+})
+
+# Openers that colour an interaction by relationship level
+TONES: Dict[RelationshipLevel, List[Compiled]] = {
+    RelationshipLevel.HOSTILE: [_compile("Without a trace of warmth, "), _compile("")],
+    RelationshipLevel.UNFRIENDLY: [_compile("Coldly, "), _compile("")],
+    RelationshipLevel.NEUTRAL: [_compile("")],
+    RelationshipLevel.FRIENDLY: [_compile("")],
+    RelationshipLevel.TRUSTED: [_compile("Like an old friend, "), _compile("")],
+    RelationshipLevel.ALLY: [_compile("Loyal as ever, "), _compile("")],
+}
+
+Table = Union[str, List[Compiled]]
+
+_TWIST = _compile("{twist}")
+_NO_MANNER = [_compile("")]
+
+
+def _expand(parts: Compiled, tables: Sequence[Dict[str, Table]], rng: random.Random) -> str:
+    out = []
+    for is_slot, text in parts:
+        if not is_slot:
+            out.append(text)
+            continue
+        for table in tables:
+            options = table.get(text)
+            if options is not None:
+                break
+        else:
+            raise KeyError(f"No table for slot {{{text}}}")
+        out.append(options if isinstance(options, str) else _expand(rng.choice(options), tables, rng))
+    return "".join(out)
+
+
+def _sentence(text: str) -> str:
+    return text[:1].upper() + text[1:]
+
+
+class TwistGenerator:
+    """Builds twists and character interactions from template tables, without a model call."""
+
+    def __init__(self, rng: Optional[random.Random] = None):
+        self.rng = rng or random.Random()
+
+    def _tables(self, location: str, time_of_day: str, extra: Dict[str, Table]) -> List[Dict[str, Table]]:
+        return [extra, {"time_of_day": time_of_day}, LOCATIONS.get(location, LOCATIONS[DEFAULT_LOCATION]), TWISTS]
+
+    def twist(self, location: str = DEFAULT_LOCATION, time_of_day: str = "morning") -> str:
+        return _sentence(_expand(_TWIST, self._tables(location, time_of_day, {}), self.rng))
+
+    def interaction(self, char: Character, interaction_type: str, location: str = DEFAULT_LOCATION,
+                    time_of_day: str = "morning") -> str:
+        manner = next((MANNERS[trait] for trait in char.traits if trait in MANNERS), _NO_MANNER)
+        tables = self._tables(location, time_of_day, {"name": char.name, "manner": manner})
+        line = _expand(self.rng.choice(INTERACTIONS[interaction_type]), tables, self.rng)
+        tone = _expand(self.rng.choice(TONES[char.relationship]), tables, self.rng)
+        if tone and not line.startswith(char.name):
+            line = line[:1].lower() + line[1:]
+        return _sentence(tone + line)
+
+
+# Names the Markov model learns from
+SEED_NAMES = [
+    "Elowen", "Aldric", "Maelis", "Theron", "Isolde", "Corwin", "Rhiannon", "Garrick", "Seraphine", "Bram",
+    "Liora", "Kaelen", "Brynja", "Darian", "Ysolde", "Fenwick", "Morwen", "Tamsin", "Orrin", "Celestine",
+    "Halvard", "Nerys", "Osric", "Wrenna", "Alaric", "Sabine", "Torvald", "Eirlys", "Lucan", "Maren",
+    "Caspian", "Idris", "Anwen", "Percival", "Rowena", "Edric", "Ilsa", "Gideon", "Mirela", "Thessaly",
+]
+SURNAMES = ["Marsh", "Thorne", "Ashdown", "Blackwood", "Vale", "Hollow", "Crane", "Fairweather", "Greaves", "Wick"]
+
+
+class NameGenerator:
+    """Character-level Markov chain over fantasy names."""
+
+    def __init__(self, names: Sequence[str] = SEED_NAMES, order: int = 2, rng: Optional[random.Random] = None):
+        self.order = order
+        self.rng = rng or random.Random()
+        self._next: Dict[str, List[str]] = defaultdict(list)
+        for name in names:
+            padded = "^" * order + name.lower() + "$"
+            for i in range(len(padded) - order):
+                self._next[padded[i:i + order]].append(padded[i + order])
+
+    def _first_name(self, rng: random.Random, min_length: int = 4, max_length: int = 9) -> str:
+        while True:
+            state, letters = "^" * self.order, []
+            while len(letters) <= max_length:
+                letter = rng.choice(self._next[state])
+                if letter == "$":
+                    break
+                letters.append(letter)
+                state = state[1:] + letter
+            if min_length <= len(letters) <= max_length:
+                return "".join(letters).capitalize()
+
+    def name(self, taken: Collection[str] = (), rng: Optional[random.Random] = None) -> str:
+        """A new name, usually with a surname, that is not in taken."""
+        rng = rng or self.rng
+        for _ in range(50):
+            name = self._first_name(rng)
+            if rng.random() < 0.6:
+                name += " " + rng.choice(SURNAMES)
+            if name not in taken:
+                return name
+        return f"{name} the Younger"
+
+
+@dataclass
+class TwistPolicy:
+    """Decides when a turn's twist, interaction or name costs a model call.
+
+    mode is "llm" (always), "procedural" (never) or "mixed": a share of
+    events go to the model, but none while more than busy_queue requests
+    are already waiting for it.
+    """
+
+    mode: str = "mixed"
+    llm_share: float = 0.3
+    busy_queue: int = 2
+
+    def use_llm(self, rng, queued: int = 0) -> bool:
+        if self.mode == "llm":
+            return True
+        if self.mode == "procedural" or queued > self.busy_queue:
+            return False
+        return rng.random() < self.llm_share
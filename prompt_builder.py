@@ -0,0 +1,97 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from llm_client import LLMRequest
+from tokenizer import TokenCounter, token_counter
+
+# Tokens the model can attend to; prompt plus completion must fit
+CONTEXT_WINDOW = 4096
+
+# Sections squeezed below this many tokens are dropped rather than kept as a stub
+MIN_SECTION_TOKENS = 8
+
+
+@dataclass(frozen=True)
+class PromptLimits:
+    input_tokens: int  # System prompt plus prompt
+    max_tokens: int  # Completion cap
+
+
+# Short calls get short caps: decode time grows with every generated token.
+# The turn prompts carry the whole shared story prefix, so their input limits
+# leave room for it untruncated; suggestions also carry the finished turn.
+PROMPT_LIMITS: Dict[str, PromptLimits] = {
+    "continuation": PromptLimits(input_tokens=2600, max_tokens=450),
+    "twist": PromptLimits(input_tokens=1900, max_tokens=80),
+    "interaction": PromptLimits(input_tokens=1900, max_tokens=80),
+    "suggestions": PromptLimits(input_tokens=2400, max_tokens=60),
+    "character_name": PromptLimits(input_tokens=100, max_tokens=12),
+    "summary": PromptLimits(input_tokens=2400, max_tokens=320),
+    # Continuation, twist and suggestions in one JSON reply
+    "turn": PromptLimits(input_tokens=2600, max_tokens=700),
+}
+DEFAULT_LIMITS = PromptLimits(input_tokens=2000, max_tokens=500)
+
+
+def limits_for(prompt_type: str) -> PromptLimits:
+    return PROMPT_LIMITS.get(prompt_type, DEFAULT_LIMITS)
+
+
+@dataclass
+class Section:
+    name: str
+    text: str
+    priority: int = 0  # Higher priority sections get their tokens first
+    keep: str = "tail"  # Which end survives truncation: "head" or "tail"
+    required: bool = False  # Never truncated, even past the budget
+
+
+class PromptBuilder:
+    """Fills a prompt template with sections fitted to the prompt type's token budget.
+
+    The template's fixed text and the required sections are always kept;
+    the remaining budget goes to the other sections in priority order, and
+    a section that does not fit is truncated (or dropped if only a stub
+    would be left).
+    """
+
+    def __init__(self, prompt_type: str, template: str, system_prompt: Optional[str] = None,
+                 counter: TokenCounter = token_counter):
+        self.prompt_type = prompt_type
+        self.template = template
+        self.system_prompt = system_prompt
+        self.counter = counter
+        self.limits = limits_for(prompt_type)
+        self.sections: List[Section] = []
+
+    def add(self, name: str, text: str, priority: int = 0, keep: str = "tail", required: bool = False) -> "PromptBuilder":
+        self.sections.append(Section(name, text, priority, keep, required))
+        return self
+
+    @property
+    def budget(self) -> int:
+        """Tokens available to the prompt itself."""
+        input_tokens = min(self.limits.input_tokens, CONTEXT_WINDOW - self.limits.max_tokens)
+        return input_tokens - self.counter.count(self.system_prompt or "")
+
+    def build(self) -> str:
+        fitted = {section.name: "" for section in self.sections}
+        remaining = self.budget - self.counter.count(self.template.format(**fitted))
+        for section in sorted(self.sections, key=lambda s: (not s.required, -s.priority)):
+            cost = self.counter.count(section.text)
+            if section.required or cost <= remaining:
+                fitted[section.name] = section.text
+                remaining -= cost
+            elif remaining >= MIN_SECTION_TOKENS:
+                fitted[section.name] = self.counter.truncate(section.text, remaining, section.keep)
+                remaining -= self.counter.count(fitted[section.name])
+        return self.template.format(**fitted)
+
+    def request(self, temperature: float = 0.7) -> LLMRequest:
+        return LLMRequest(
+            self.build(),
+            self.system_prompt,
+            self.prompt_type,
+            temperature=temperature,
+            max_tokens=self.limits.max_tokens,
+        )
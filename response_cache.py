@@ -0,0 +1,117 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+# Prompt types whose responses may be reused. Twists, interactions and
+# character names are left out on purpose: they are meant to vary.
+DEFAULT_CACHEABLE_TYPES = {"suggestions"}
+
+
+class ResponseCache:
+    """Persistent, content-addressed cache of LLM responses.
+
+    Entries live in a SQLite file keyed by a hash of everything that
+    determines a completion. The least recently used entries are evicted
+    once the cache grows past max_entries or max_bytes.
+    """
+
+    def __init__(
+        self,
+        path: str = "llm_cache.sqlite3",
+        max_entries: int = 5000,
+        max_bytes: int = 50 * 1024 * 1024,
+        cacheable_types: Optional[Iterable[str]] = None,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cacheable_types = set(DEFAULT_CACHEABLE_TYPES if cacheable_types is None else cacheable_types)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                prompt_type TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._entries, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+
+    @staticmethod
+    def make_key(model: str, system_prompt: Optional[str], prompt: str, temperature: float, max_tokens: int) -> str:
+        """Hash the inputs that determine a completion."""
+        material = json.dumps([model, system_prompt or "", prompt, temperature, max_tokens])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def accepts(self, prompt_type: str) -> bool:
+        return prompt_type in self.cacheable_types
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, prompt_type: str, response: str):
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, prompt_type, response, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, prompt_type, response, size, now, now),
+            )
+            if old is None:
+                self._entries += 1
+            else:
+                self._bytes -= old[0]
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        # Drop least recently used entries in batches until we are within bounds
+        while self._entries > self.max_entries or self._bytes > self.max_bytes:
+            batch = max(1, self._entries - self.max_entries, self._entries // 20)
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_used LIMIT ?", (batch,)
+            ).fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key, _ in rows])
+            self._entries -= len(rows)
+            self._bytes -= sum(size for _, size in rows)
+            self.evictions += len(rows)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": self._entries,
+            "bytes": self._bytes,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._entries = 0
+            self._bytes = 0
@@ -0,0 +1,330 @@
+import asyncio
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from llm_client import LLMError, LLMProvider, LLMRequest, LLMResponse
+from tracing import current_span
+
+# Weight of the newest sample in the latency and error rate averages
+EWMA_ALPHA = 0.2
+
+# A backend failing more than this share of recent calls is skipped...
+UNHEALTHY_ERROR_RATE = 0.5
+
+# ...until this many seconds after its last failure, when it gets another chance
+RETRY_UNHEALTHY_AFTER = 30.0
+
+# Latency samples kept per backend, prompt type and call kind for the p95 hedging deadline
+LATENCY_WINDOW = 100
+
+# Samples needed before the measured p95 replaces default_deadline
+MIN_DEADLINE_SAMPLES = 10
+
+# What latencies are kept apart by: (prompt type, streamed). A stream is timed to its
+# first token and a completion to its end, so the two are not comparable.
+LatencyKey = Tuple[str, bool]
+
+
+@dataclass
+class BackendStats:
+    """Latency and health of one backend, as seen by the router."""
+
+    latency: Dict[LatencyKey, float] = field(default_factory=dict)  # EWMA seconds
+    samples: Dict[LatencyKey, Deque[float]] = field(default_factory=lambda: defaultdict(lambda: deque(maxlen=LATENCY_WINDOW)))
+    error_rate: float = 0.0
+    last_failure: float = 0.0
+    calls: int = 0
+    errors: int = 0
+    wins: int = 0  # Hedged races won
+
+    def record_success(self, key: LatencyKey, seconds: float):
+        self.calls += 1
+        previous = self.latency.get(key)
+        self.latency[key] = seconds if previous is None else previous + EWMA_ALPHA * (seconds - previous)
+        self.samples[key].append(seconds)
+        self.error_rate -= EWMA_ALPHA * self.error_rate
+
+    def record_failure(self):
+        self.calls += 1
+        self.errors += 1
+        self.error_rate += EWMA_ALPHA * (1.0 - self.error_rate)
+        self.last_failure = time.monotonic()
+
+    @property
+    def healthy(self) -> bool:
+        return (self.error_rate <= UNHEALTHY_ERROR_RATE
+                or time.monotonic() - self.last_failure > RETRY_UNHEALTHY_AFTER)
+
+    def p95(self, key: LatencyKey) -> Optional[float]:
+        samples = self.samples.get(key)
+        if not samples or len(samples) < MIN_DEADLINE_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+class HedgedRouter(LLMProvider):
+    """Provider that spreads calls over several backends.
+
+    Each call goes to the fastest healthy backend for its prompt type,
+    judged by a moving average of its latency. Streams are timed to their
+    first token and kept apart from completions. Backends without
+    measurements keep their configured order. If the call has not answered
+    by that backend's p95 latency, the same request is also sent to the
+    next backend. The first answer wins and the other request is cancelled,
+    so one slow backend (a saturated local GPU) does not stretch the tail
+    latency. A backend that errors is failed over
+    immediately.
+
+    Blocking calls hedge on threads and cannot abort the losing HTTP
+    request; blocking streams fail over but do not hedge.
+    """
+
+    name = "router"
+
+    def __init__(self, backends: Sequence[LLMProvider], default_deadline: float = 5.0):
+        if not backends:
+            raise ValueError("HedgedRouter needs at least one backend")
+        self.backends = list(backends)
+        self.default_deadline = default_deadline
+        self.model = "+".join(f"{backend.name}:{backend.model}" for backend in self.backends)
+        self.stats: Dict[int, BackendStats] = {index: BackendStats() for index in range(len(self.backends))}
+        self.hedges = 0
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def backend_name(self, index: int) -> str:
+        backend = self.backends[index]
+        return f"{backend.name}:{backend.model}"
+
+    def ranked(self, key: LatencyKey) -> List[int]:
+        """Backend indexes, best first."""
+        with self._lock:
+            def rank(index: int):
+                stats = self.stats[index]
+                return (not stats.healthy, stats.latency.get(key, float("inf")), index)
+            return sorted(range(len(self.backends)), key=rank)
+
+    def _deadline(self, index: int, key: LatencyKey) -> float:
+        with self._lock:
+            p95 = self.stats[index].p95(key)
+        return p95 if p95 is not None else self.default_deadline
+
+    def _record(self, index: int, key: LatencyKey, seconds: Optional[float]):
+        """Record a call's latency, or a failure when seconds is None."""
+        with self._lock:
+            if seconds is None:
+                self.stats[index].record_failure()
+            else:
+                self.stats[index].record_success(key, seconds)
+
+    def _note_winner(self, index: int, hedged: bool):
+        with self._lock:
+            if hedged:
+                self.hedges += 1
+                self.stats[index].wins += 1
+        span = current_span()
+        if span is not None:
+            span.attributes["backend"] = self.backend_name(index)
+            if hedged:
+                span.attributes["hedged"] = True
+
+    # Async calls
+
+    async def _timed_complete(self, index: int, request: LLMRequest) -> LLMResponse:
+        started = time.monotonic()
+        try:
+            response = await self.backends[index].acomplete(request)
+        except LLMError:
+            self._record(index, (request.prompt_type, False), None)
+            raise
+        self._record(index, (request.prompt_type, False), time.monotonic() - started)
+        return response
+
+    async def acomplete(self, request: LLMRequest) -> LLMResponse:
+        order = self.ranked((request.prompt_type, False))
+        running: Dict[asyncio.Task, int] = {}
+        error: Optional[LLMError] = None
+
+        def launch():
+            index = order.pop(0)
+            running[asyncio.ensure_future(self._timed_complete(index, request))] = index
+
+        launch()
+        deadline = self._deadline(running[next(iter(running))], (request.prompt_type, False))
+        hedged = False
+        try:
+            while running:
+                # Hedge once the first backend is past its deadline; fail over at once on errors
+                timeout = deadline if order and not hedged and not error else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    launch()
+                    continue
+                for task in done:
+                    index = running.pop(task)
+                    if task.exception() is None:
+                        self._note_winner(index, hedged)
+                        return task.result()
+                    if not isinstance(task.exception(), LLMError):
+                        raise task.exception()
+                    error = error or task.exception()
+                    if order and not running:
+                        launch()
+            raise error
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def astream(self, request: LLMRequest) -> AsyncIterator[str]:
+        key = (request.prompt_type, True)
+        order = self.ranked(key)
+        streams: Dict[asyncio.Task, tuple] = {}  # First-token task -> (backend index, stream, started)
+        error: Optional[LLMError] = None
+
+        def launch():
+            index = order.pop(0)
+            tokens = self.backends[index].astream(request)
+            streams[asyncio.ensure_future(tokens.__anext__())] = (index, tokens, time.monotonic())
+
+        async def close(task: asyncio.Task, tokens):
+            task.cancel()
+            await asyncio.wait({task})
+            await tokens.aclose()
+
+        launch()
+        deadline = self._deadline(streams[next(iter(streams))][0], key)
+        hedged = False
+        winner = None
+        try:
+            while streams and winner is None:
+                # The race is to the first token; after that the winner streams alone
+                timeout = deadline if order and not hedged and not error else None
+                done, _ = await asyncio.wait(streams, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    launch()
+                    continue
+                for task in done:
+                    index, tokens, started = streams.pop(task)
+                    exception = task.exception()
+                    if exception is None or isinstance(exception, StopAsyncIteration):
+                        # An empty reply is still a reply
+                        self._record(index, key, time.monotonic() - started)
+                        winner = (index, tokens, task.result() if exception is None else None)
+                        break
+                    if not isinstance(exception, LLMError):
+                        raise exception
+                    self._record(index, key, None)
+                    error = error or exception
+                    if order and not streams:
+                        launch()
+        finally:
+            # The losers' requests are cancelled before the winner streams on
+            for task, (_, tokens, _) in list(streams.items()):
+                await close(task, tokens)
+        if winner is None:
+            raise error
+        index, tokens, first = winner
+        self._note_winner(index, hedged)
+        if first is None:
+            return
+        try:
+            yield first
+            async for token in tokens:
+                yield token
+        finally:
+            await tokens.aclose()
+
+    async def aclose(self):
+        for backend in self.backends:
+            await backend.aclose()
+
+    # Blocking calls
+
+    def _timed_complete_sync(self, index: int, request: LLMRequest) -> LLMResponse:
+        started = time.monotonic()
+        try:
+            response = self.backends[index].complete(request)
+        except LLMError:
+            self._record(index, (request.prompt_type, False), None)
+            raise
+        self._record(index, (request.prompt_type, False), time.monotonic() - started)
+        return response
+
+    def complete(self, request: LLMRequest) -> LLMResponse:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="router-hedge")
+        order = self.ranked((request.prompt_type, False))
+        running = {}
+        error: Optional[LLMError] = None
+
+        def launch():
+            index = order.pop(0)
+            running[self._pool.submit(self._timed_complete_sync, index, request)] = index
+
+        launch()
+        deadline = self._deadline(running[next(iter(running))], (request.prompt_type, False))
+        hedged = False
+        while running:
+            timeout = deadline if order and not hedged and not error else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                launch()
+                continue
+            for future in done:
+                index = running.pop(future)
+                if future.exception() is None:
+                    # A losing request still runs to the end on its thread; its result is dropped
+                    self._note_winner(index, hedged)
+                    return future.result()
+                if not isinstance(future.exception(), LLMError):
+                    raise future.exception()
+                error = error or future.exception()
+                if order and not running:
+                    launch()
+        raise error
+
+    def stream(self, request: LLMRequest) -> Iterator[str]:
+        error: Optional[LLMError] = None
+        key = (request.prompt_type, True)
+        for index in self.ranked(key):
+            started = time.monotonic()
+            tokens = self.backends[index].stream(request)
+            try:
+                first = next(tokens, None)
+            except LLMError as e:
+                self._record(index, key, None)
+                error = error or e
+                continue
+            self._record(index, key, time.monotonic() - started)
+            self._note_winner(index, hedged=False)
+            if first is not None:
+                yield first
+                yield from tokens
+            return
+        raise error
+
+    def snapshot(self) -> List[Dict]:
+        """Per-backend latency and health, for display."""
+        with self._lock:
+            return [
+                {
+                    "backend": self.backend_name(index),
+                    "healthy": stats.healthy,
+                    "error rate": round(stats.error_rate, 2),
+                    "calls": stats.calls,
+                    "hedges won": stats.wins,
+                    **{
+                        f"{prompt_type} {'first token' if streamed else 'reply'} ms": round(seconds * 1000)
+                        for (prompt_type, streamed), seconds in sorted(stats.latency.items())
+                    },
+                }
+                for index, stats in self.stats.items()
+            ]
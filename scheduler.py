@@ -0,0 +1,344 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from llm_client import LLMClient, LLMOverloadedError, LLMRequest, LLMResponse
+from tracing import current_span
+
+# Session the current task is working for; requests are queued fairly per session
+current_session: ContextVar[str] = ContextVar("current_session", default="")
+
+# Priority forced on the current task's requests (speculative work), instead of the one of their prompt type
+current_priority: ContextVar[Optional[int]] = ContextVar("current_priority", default=None)
+
+# Prompt types that generate long outputs and hold a model slot for a long time
+DEFAULT_LONG_TYPES = {"continuation", "summary"}
+
+# Priority classes, most urgent first
+PRIORITY_INTERACTIVE = 0  # The player is waiting and nothing can stand in for the reply
+PRIORITY_ENRICHMENT = 1  # The turn waits for it, but the procedural generator can stand in
+PRIORITY_DEFERRABLE = 2  # Has a default (suggestions) or can be retried later (summaries)
+PRIORITY_SPECULATIVE = 3  # Work nobody has asked for yet
+PRIORITY_NAMES = ["interactive", "enrichment", "deferrable", "speculative"]
+
+PROMPT_PRIORITIES = {
+    "continuation": PRIORITY_INTERACTIVE,
+    "turn": PRIORITY_INTERACTIVE,
+    "twist": PRIORITY_ENRICHMENT,
+    "interaction": PRIORITY_ENRICHMENT,
+    "character_name": PRIORITY_ENRICHMENT,
+    "suggestions": PRIORITY_DEFERRABLE,
+    "summary": PRIORITY_DEFERRABLE,
+}
+
+# Longest wait in the queue before a request is shed; waiting longer than the
+# procedural stand-in or the player takes is wasted work. None waits forever.
+DEFAULT_MAX_WAIT: Dict[int, Optional[float]] = {
+    PRIORITY_INTERACTIVE: None,
+    PRIORITY_ENRICHMENT: 3.0,
+    PRIORITY_DEFERRABLE: 20.0,
+    PRIORITY_SPECULATIVE: 5.0,
+}
+
+
+@contextmanager
+def scheduling_as(session_id: str, priority: Optional[int] = None) -> Iterator[None]:
+    """Attribute the LLM requests made inside the block to a session, optionally at a fixed priority."""
+    token = current_session.set(session_id)
+    priority_token = current_priority.set(priority) if priority is not None else None
+    try:
+        yield
+    finally:
+        if priority_token is not None:
+            current_priority.reset(priority_token)
+        current_session.reset(token)
+
+
+@dataclass
+class _Ticket:
+    session_id: str
+    long: bool
+    priority: int
+    granted: asyncio.Future
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class _FairQueue:
+    """Round-robin over sessions, first-in first-out within a session."""
+
+    def __init__(self):
+        self._sessions: "OrderedDict[str, Deque[_Ticket]]" = OrderedDict()
+        self._count = 0
+
+    def push(self, ticket: _Ticket):
+        self._sessions.setdefault(ticket.session_id, deque()).append(ticket)
+        self._count += 1
+
+    def pop(self) -> Optional[_Ticket]:
+        while self._sessions:
+            session_id, tickets = next(iter(self._sessions.items()))
+            ticket = tickets.popleft()
+            self._count -= 1
+            if tickets:
+                self._sessions.move_to_end(session_id)
+            else:
+                del self._sessions[session_id]
+            if not ticket.granted.done():  # Skip requests whose caller gave up
+                return ticket
+        return None
+
+    def remove(self, ticket: _Ticket):
+        tickets = self._sessions.get(ticket.session_id)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            self._count -= 1
+            if not tickets:
+                del self._sessions[ticket.session_id]
+
+    def tickets(self) -> Iterator[_Ticket]:
+        for tickets in self._sessions.values():
+            yield from tickets
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class TokenBucket:
+    """Allows rate requests per second on average, in bursts of up to burst."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def ready(self) -> bool:
+        self._refill()
+        return self._tokens >= 1
+
+    def take(self):
+        self._tokens -= 1
+
+    def wait_time(self) -> float:
+        """Seconds until the next token."""
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+
+class BatchScheduler:
+    """Admission control for one backend: queues LLM requests from all sessions and dispatches them.
+
+    Requests arriving within window seconds of each other are released
+    together, so the model server sees them at once and can batch them
+    across its parallel slots. At most max_concurrency requests are in
+    flight, and with a rate at most that many are started per second on
+    average (a token bucket holding up to burst requests).
+
+    Queued requests are served by priority class (PROMPT_PRIORITIES, or the
+    one set with scheduling_as), then short before long, and long ones may
+    hold at most long_slots slots so a few continuations cannot starve the
+    short calls. Within each class sessions take turns.
+
+    Under overload the least urgent work is shed first, with
+    LLMOverloadedError: a request whose class already has queue_limits
+    requests waiting is refused, one that waited longer than its class's
+    max_wait gives up, and speculative requests are only admitted while
+    nothing else is waiting. Interactive requests are never shed.
+
+    Replies in the client's response cache are returned before queueing.
+    Offers the same async calls as LLMClient; all of them must be made on
+    the same event loop.
+    """
+
+    def __init__(
+        self,
+        client: LLMClient,
+        max_concurrency: int = 4,
+        window: float = 0.005,
+        long_types: Optional[Iterable[str]] = None,
+        long_slots: Optional[int] = None,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        queue_limits: Optional[Dict[int, Optional[int]]] = None,
+        max_wait: Optional[Dict[int, Optional[float]]] = None,
+    ):
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.window = window
+        self.long_types = set(DEFAULT_LONG_TYPES if long_types is None else long_types)
+        self.long_slots = long_slots if long_slots is not None else max(1, max_concurrency - 1)
+        self.bucket = TokenBucket(rate, burst or max_concurrency) if rate else None
+        self.queue_limits = queue_limits if queue_limits is not None else {
+            PRIORITY_INTERACTIVE: None,
+            PRIORITY_ENRICHMENT: 4 * max_concurrency,
+            PRIORITY_DEFERRABLE: 4 * max_concurrency,
+            PRIORITY_SPECULATIVE: max_concurrency,
+        }
+        self.max_wait = dict(DEFAULT_MAX_WAIT if max_wait is None else max_wait)
+        # Short and long queue of each priority class
+        self._queues: List[Tuple[_FairQueue, _FairQueue]] = [(_FairQueue(), _FairQueue()) for _ in PRIORITY_NAMES]
+        self._in_flight = 0
+        self._long_in_flight = 0
+        self._dispatch_pending = False
+        self.dispatched = 0
+        self.total_wait = 0.0
+        self.shed = [0] * len(PRIORITY_NAMES)
+
+    def priority_of(self, request: LLMRequest) -> int:
+        priority = current_priority.get()
+        if priority is not None:
+            return priority
+        return PROMPT_PRIORITIES.get(request.prompt_type, PRIORITY_INTERACTIVE)
+
+    def _queued(self, priority: int) -> int:
+        short, long = self._queues[priority]
+        return len(short) + len(long)
+
+    def _schedule_dispatch(self, delay: Optional[float] = None):
+        if not self._dispatch_pending:
+            self._dispatch_pending = True
+            asyncio.get_running_loop().call_later(self.window if delay is None else delay, self._dispatch)
+
+    def _next_ticket(self) -> Optional[_Ticket]:
+        for short, long in self._queues:
+            ticket = short.pop()
+            if ticket is None and self._long_in_flight < self.long_slots:
+                ticket = long.pop()
+            if ticket is not None:
+                return ticket
+        return None
+
+    def _dispatch(self):
+        self._dispatch_pending = False
+        while self._in_flight < self.max_concurrency:
+            if self.bucket is not None and not self.bucket.ready():
+                if any(self._queued(priority) for priority in range(len(self._queues))):
+                    self._schedule_dispatch(self.bucket.wait_time())
+                return
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            if self.bucket is not None:
+                self.bucket.take()
+            self._in_flight += 1
+            if ticket.long:
+                self._long_in_flight += 1
+            self.dispatched += 1
+            self.total_wait += time.monotonic() - ticket.queued_at
+            ticket.granted.set_result(None)
+
+    def _release(self, ticket: _Ticket):
+        self._in_flight -= 1
+        if ticket.long:
+            self._long_in_flight -= 1
+        # A slot just freed up; refill it without waiting for the next window
+        self._dispatch()
+
+    def _admit(self, priority: int):
+        """Raise LLMOverloadedError if a new request of this priority should be shed."""
+        limit = self.queue_limits.get(priority)
+        if limit is not None and self._queued(priority) >= limit:
+            self.shed[priority] += 1
+            raise LLMOverloadedError(f"Too many {PRIORITY_NAMES[priority]} requests waiting")
+        if priority == PRIORITY_SPECULATIVE and any(self._queued(p) for p in range(PRIORITY_SPECULATIVE)):
+            self.shed[priority] += 1
+            raise LLMOverloadedError("Not speculating while other requests are waiting")
+
+    async def _acquire(self, request: LLMRequest) -> _Ticket:
+        priority = self.priority_of(request)
+        self._admit(priority)
+        ticket = _Ticket(
+            session_id=current_session.get(),
+            long=request.prompt_type in self.long_types,
+            priority=priority,
+            granted=asyncio.get_running_loop().create_future(),
+        )
+        queue = self._queues[priority][1 if ticket.long else 0]
+        queue.push(ticket)
+        self._schedule_dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.granted), self.max_wait.get(priority))
+        except asyncio.TimeoutError:
+            # Unless the slot was granted just as the wait ran out
+            if not ticket.granted.done():
+                ticket.granted.cancel()
+                queue.remove(ticket)
+                self.shed[priority] += 1
+                raise LLMOverloadedError(f"Waited too long for a model slot ({PRIORITY_NAMES[priority]} request)") from None
+        except asyncio.CancelledError:
+            # The slot may have been granted just before we were cancelled
+            if ticket.granted.done() and not ticket.granted.cancelled():
+                self._release(ticket)
+            else:
+                ticket.granted.cancel()
+                queue.remove(ticket)
+            raise
+        span = current_span()
+        if span is not None:
+            span.queue_time += time.monotonic() - ticket.queued_at
+        return ticket
+
+    def position(self, session_id: str) -> Optional[int]:
+        """Requests queued ahead of the session's most urgent waiting request, or None if it has none waiting."""
+        mine = None
+        for queues in self._queues:
+            for queue in queues:
+                for ticket in queue.tickets():
+                    if ticket.session_id == session_id and (
+                            mine is None or (ticket.priority, ticket.queued_at) < (mine.priority, mine.queued_at)):
+                        mine = ticket
+        if mine is None:
+            return None
+        return sum(
+            1
+            for queues in self._queues
+            for queue in queues
+            for ticket in queue.tickets()
+            if (ticket.priority, ticket.queued_at) < (mine.priority, mine.queued_at)
+        )
+
+    async def acomplete_request(self, request: LLMRequest) -> LLMResponse:
+        # A cached reply takes no model slot and does not count toward the queue limits
+        cached = self.client.cached_response(request)
+        if cached is not None:
+            return cached
+        ticket = await self._acquire(request)
+        try:
+            return await self.client.acomplete_request(request, lookup=False)
+        finally:
+            self._release(ticket)
+
+    async def astream_request(self, request: LLMRequest) -> AsyncIterator[str]:
+        cached = self.client.cached_response(request)
+        if cached is not None:
+            yield cached.text
+            return
+        ticket = await self._acquire(request)
+        try:
+            async for token in self.client.astream_request(request, lookup=False):
+                yield token
+        finally:
+            self._release(ticket)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def stats(self) -> Dict[str, float]:
+        stats = {
+            "queued": sum(self._queued(priority) for priority in range(len(self._queues))),
+            "in_flight": self._in_flight,
+            "dispatched": self.dispatched,
+            "mean_wait_ms": 1000 * self.total_wait / self.dispatched if self.dispatched else 0.0,
+        }
+        for priority, name in enumerate(PRIORITY_NAMES):
+            stats[f"shed_{name}"] = self.shed[priority]
+        return stats
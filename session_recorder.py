@@ -0,0 +1,157 @@
+import json
+import threading
+import time
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from llm_client import LLMError, LLMProvider, LLMRequest, LLMResponse, stream_words
+from response_cache import ResponseCache
+
+
+def response_key(request: LLMRequest) -> str:
+    """Key of a recorded response: the inputs that determine it, whichever backend answered."""
+    return ResponseCache.make_key("", request.system_prompt, request.prompt, request.temperature, request.max_tokens)
+
+
+class SessionRecorder:
+    """Appends the turns played, and optionally the model's replies, to a JSONL trace.
+
+    Each turn line has the session, the turn number, the action, the seed
+    its random decisions were drawn from and the think time since the
+    session's previous turn. With responses, every distinct model reply is
+    written once as well, so a replay can run without a model. Thread-safe.
+    """
+
+    def __init__(self, path: str, responses: bool = False):
+        self.path = path
+        self.responses = responses
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        self._last_turn: Dict[str, float] = {}
+        self._keys = set()
+
+    def _write(self, line: Dict):
+        self._file.write(json.dumps(line) + "\n")
+        self._file.flush()
+
+    def record_turn(self, session_id: str, turn: int, action: str, seed: int, started_at: float):
+        with self._lock:
+            previous = self._last_turn.get(session_id)
+            self._last_turn[session_id] = time.time()
+            self._write({
+                "kind": "turn",
+                "session": session_id,
+                "turn": turn,
+                "action": action,
+                "seed": seed,
+                "think": round(started_at - previous, 3) if previous is not None else None,
+            })
+
+    def record_response(self, request: LLMRequest, text: str):
+        if not self.responses:
+            return
+        key = response_key(request)
+        with self._lock:
+            if key in self._keys:
+                return
+            self._keys.add(key)
+            self._write({"kind": "response", "key": key, "type": request.prompt_type, "text": text})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+@dataclass
+class RecordedTurn:
+    turn: int
+    action: str
+    seed: int
+    think: Optional[float] = None
+
+
+@dataclass
+class Recording:
+    """A trace read back: each session's turns in order, and the recorded replies by key."""
+
+    sessions: Dict[str, List[RecordedTurn]] = field(default_factory=dict)
+    responses: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: str) -> "Recording":
+        recording = cls()
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if data["kind"] == "turn":
+                    recording.sessions.setdefault(data["session"], []).append(
+                        RecordedTurn(data["turn"], data["action"], data["seed"], data.get("think"))
+                    )
+                elif data["kind"] == "response":
+                    recording.responses[data["key"]] = data["text"]
+        for turns in recording.sessions.values():
+            turns.sort(key=lambda turn: turn.turn)
+        return recording
+
+
+class LLMReplayMissError(LLMError):
+    """A replay without a fallback met a request that was not recorded."""
+
+
+class ReplayProvider(LLMProvider):
+    """Answers with recorded replies; other requests go to the fallback provider, if any.
+
+    Replies are streamed word by word like MockProvider's. Without a
+    fallback, a request that was not recorded raises LLMReplayMissError.
+    """
+
+    name = "replay"
+
+    def __init__(self, responses: Dict[str, str], fallback: Optional[LLMProvider] = None):
+        self.responses = responses
+        self.fallback = fallback
+        self.model = fallback.model if fallback is not None else ""
+        self.hits = 0
+        self.misses = 0
+
+    def _recorded(self, request: LLMRequest) -> Optional[str]:
+        text = self.responses.get(response_key(request))
+        if text is not None:
+            self.hits += 1
+            return text
+        self.misses += 1
+        if self.fallback is None:
+            raise LLMReplayMissError(f"No recorded response for this {request.prompt_type} request")
+        return None
+
+    def complete(self, request: LLMRequest) -> LLMResponse:
+        text = self._recorded(request)
+        return LLMResponse(text=text) if text is not None else self.fallback.complete(request)
+
+    def stream(self, request: LLMRequest) -> Iterator[str]:
+        text = self._recorded(request)
+        if text is not None:
+            yield from stream_words(text)
+        else:
+            yield from self.fallback.stream(request)
+
+    async def acomplete(self, request: LLMRequest) -> LLMResponse:
+        text = self._recorded(request)
+        return LLMResponse(text=text) if text is not None else await self.fallback.acomplete(request)
+
+    async def astream(self, request: LLMRequest) -> AsyncIterator[str]:
+        text = self._recorded(request)
+        if text is not None:
+            for word in stream_words(text):
+                yield word
+        else:
+            async with aclosing(self.fallback.astream(request)) as tokens:
+                async for token in tokens:
+                    yield token
+
+    async def aclose(self):
+        if self.fallback is not None:
+            await self.fallback.aclose()
@@ -0,0 +1,217 @@
+import json
+import os
+import re
+import struct
+import threading
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Tuple
+
+from story_log import StoryLog, TurnRecord
+from world import WorldState
+
+# One index entry per journal line: its byte offset and the length of the turn's story text
+_INDEX_ENTRY = struct.Struct("<QI")
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+@dataclass
+class SavedSession:
+    """Everything needed to resume a game."""
+
+    story_log: StoryLog
+    world: WorldState
+    choices: List[str]
+    arc_progress: int
+    suggested_actions: List[str]
+    summary: str = ""
+    folded_turns: int = 0
+    mentions: Dict[str, Any] = field(default_factory=dict)
+
+
+class SessionStore:
+    """Saves sessions as an append-only journal of turns plus periodic snapshots.
+
+    Each session is a directory holding:
+
+    - journal.jsonl: one line per turn with its record and the world's delta (WorldState.delta)
+    - journal.idx: a fixed-size (offset, text length) entry per journal line
+    - snapshot.json: the compacted state as of some turn, replaced atomically
+
+    Saving a turn appends one line, so it costs O(turn) however long the
+    story is. Loading reads the snapshot, replays the journal lines written
+    after it and reads only the most recent turns; older turns are read
+    from the journal when something asks for them. A journal line or index
+    entry left half-written by a crash is cut off when the session is loaded.
+    """
+
+    def __init__(self, root: str = "sessions", snapshot_every: int = 20, tail_turns: int = 12):
+        self.root = root
+        self.snapshot_every = snapshot_every
+        self.tail_turns = tail_turns
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def valid_id(session_id: str) -> bool:
+        return bool(_SESSION_ID.match(session_id))
+
+    def _path(self, session_id: str, name: str) -> str:
+        if not self.valid_id(session_id):
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        return os.path.join(self.root, session_id, name)
+
+    def exists(self, session_id: str) -> bool:
+        return os.path.exists(self._path(session_id, "snapshot.json"))
+
+    def create(self, session_id: str, session: SavedSession):
+        """Start a new saved session from its initial state."""
+        os.makedirs(os.path.dirname(self._path(session_id, "snapshot.json")), exist_ok=True)
+        for index in range(len(session.story_log)):
+            self._append(session_id, {"record": asdict(session.story_log[index])}, session.story_log[index])
+        self.save_snapshot(session_id, session)
+
+    def append_turn(
+        self,
+        session_id: str,
+        record: TurnRecord,
+        world_delta: Dict[str, Any],
+        arc_progress: int,
+        suggested_actions: List[str],
+    ) -> int:
+        """Journal a committed turn with the world changes since the previous one; return the number of turns saved."""
+        entry = {
+            "record": asdict(record),
+            "world": world_delta,
+            "arc_progress": arc_progress,
+            "suggested_actions": suggested_actions,
+        }
+        return self._append(session_id, entry, record)
+
+    def _append(self, session_id: str, entry: Dict, record: TurnRecord) -> int:
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        with self._lock:
+            with open(self._path(session_id, "journal.jsonl"), "ab") as journal:
+                offset = journal.tell()
+                journal.write(line)
+                # The line must be on disk before an index entry points at it
+                journal.flush()
+                os.fsync(journal.fileno())
+            with open(self._path(session_id, "journal.idx"), "ab") as index:
+                index.write(_INDEX_ENTRY.pack(offset, len(record.text)))
+                return index.tell() // _INDEX_ENTRY.size
+
+    def should_snapshot(self, turn_count: int) -> bool:
+        return turn_count % self.snapshot_every == 0
+
+    def save_snapshot(self, session_id: str, session: SavedSession):
+        """Write the compacted state, replacing the previous snapshot atomically."""
+        self.write_snapshot(session_id, self.encode_snapshot(session))
+
+    @staticmethod
+    def encode_snapshot(session: SavedSession) -> str:
+        """The compacted state as JSON text, which keeps no reference to the live session."""
+        snapshot = {
+            "turn_count": len(session.story_log),
+            "world": session.world.to_snapshot(),
+            "choices": session.choices,
+            "arc_progress": session.arc_progress,
+            "suggested_actions": session.suggested_actions,
+            "summary": session.summary,
+            "folded_turns": session.folded_turns,
+            "mentions": session.mentions,
+        }
+        return json.dumps(snapshot)
+
+    def write_snapshot(self, session_id: str, snapshot: str):
+        """Replace the snapshot with one made by encode_snapshot, atomically."""
+        path = self._path(session_id, "snapshot.json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _read_index(self, session_id: str) -> List[Tuple[int, int]]:
+        with open(self._path(session_id, "journal.idx"), "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % _INDEX_ENTRY.size  # Ignore a torn final entry
+        return [entry for entry in _INDEX_ENTRY.iter_unpack(data[:usable])]
+
+    def _truncate_torn(self, session_id: str, entries: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Cut whatever a crash left after the last complete journal line, so the next append starts clean.
+
+        Returns the index entries that are left.
+        """
+        index_path = self._path(session_id, "journal.idx")
+        journal_path = self._path(session_id, "journal.jsonl")
+        with self._lock:
+            with open(journal_path, "r+b") as f:
+                end = 0
+                # Drop index entries whose journal line was not written in full
+                while entries:
+                    f.seek(entries[-1][0])
+                    line = f.readline()
+                    if line.endswith(b"\n"):
+                        end = f.tell()
+                        break
+                    entries = entries[:-1]
+                if end != os.path.getsize(journal_path):
+                    f.truncate(end)
+            if os.path.getsize(index_path) != len(entries) * _INDEX_ENTRY.size:
+                with open(index_path, "r+b") as f:
+                    f.truncate(len(entries) * _INDEX_ENTRY.size)
+        return entries
+
+    def read_turns(self, session_id: str, offset: int, count: int) -> Iterator[TurnRecord]:
+        """Read count consecutive turns, the first journaled at a byte offset, in one pass."""
+        with open(self._path(session_id, "journal.jsonl"), "rb") as f:
+            f.seek(offset)
+            for _ in range(count):
+                yield TurnRecord(**json.loads(f.readline())["record"])
+
+    def load(self, session_id: str) -> SavedSession:
+        """Resume a session: snapshot, then the journal tail."""
+        with open(self._path(session_id, "snapshot.json"), encoding="utf-8") as f:
+            snapshot = json.load(f)
+        entries = self._read_index(session_id)
+        entries = self._truncate_torn(session_id, entries)
+        turn_count = len(entries)
+        snapshot_turns = snapshot["turn_count"]
+
+        world = WorldState.from_snapshot(snapshot["world"])
+        choices = list(snapshot["choices"])
+        arc_progress = snapshot["arc_progress"]
+        suggested_actions = snapshot["suggested_actions"]
+
+        # Read from the earliest turn we need: for replay, display or the unsummarized context
+        start = max(0, min(snapshot_turns, turn_count - self.tail_turns, snapshot["folded_turns"]))
+        recent: Dict[int, TurnRecord] = {}
+        if start < turn_count:
+            with open(self._path(session_id, "journal.jsonl"), "rb") as f:
+                for index in range(start, turn_count):
+                    # Each line is read at its indexed offset, never past the last indexed one
+                    f.seek(entries[index][0])
+                    entry = json.loads(f.readline())
+                    record = TurnRecord(**entry["record"])
+                    recent[index] = record
+                    if index < snapshot_turns:
+                        continue
+                    # Replay turns journaled after the snapshot
+                    world.apply_delta(entry["world"])
+                    choices.append(record.action)
+                    arc_progress = entry["arc_progress"]
+                    suggested_actions = entry["suggested_actions"]
+
+        loader = lambda start, end: self.read_turns(session_id, entries[start][0], end - start)
+        story_log = StoryLog.restore([length for _, length in entries], recent, loader)
+        return SavedSession(
+            story_log=story_log,
+            world=world,
+            choices=choices,
+            arc_progress=arc_progress,
+            suggested_actions=suggested_actions,
+            summary=snapshot["summary"],
+            folded_turns=snapshot["folded_turns"],
+            mentions=snapshot["mentions"],
+        )
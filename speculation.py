@@ -0,0 +1,75 @@
+import asyncio
+import hashlib
+import json
+import re
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from story_log import StoryLog
+from turn_pipeline import TurnResult
+from world import WorldState
+
+
+def normalize_action(action: str) -> str:
+    """Normalize an action so that trivially different spellings share a cache entry."""
+    return re.sub(r"\s+", " ", action).strip().rstrip(".!?").lower()
+
+
+def story_state_hash(story_log: StoryLog, arc_progress: int, world: WorldState) -> str:
+    """Hash everything a turn's prompts depend on.
+
+    The story is append-only, so its length plus its last turn identify it
+    without hashing the whole text on every rerun.
+    """
+    digest = hashlib.sha1()
+    digest.update(f"{arc_progress}|{len(story_log)}|{story_log.char_length}|".encode())
+    digest.update(story_log[-1].text.encode())
+    digest.update(json.dumps(world.to_dict(), sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class SpeculativeCache:
+    """Per-session cache of turns generated ahead of time for the displayed actions.
+
+    run(action) is a coroutine producing the TurnResult for an action
+    without touching the world state. Speculations are tasks on the running
+    event loop; cancelling one cancels its in-flight LLM calls, which frees
+    the model slot. start, take and cancel_all must be called on that loop.
+    """
+
+    def __init__(self, max_concurrency: int = 2):
+        self.max_concurrency = max_concurrency
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._entries: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def _run_limited(self, run: Callable[[str], Awaitable[TurnResult]], action: str) -> TurnResult:
+        async with self._slots:
+            return await run(action)
+
+    def start(self, state_hash: str, actions: Iterable[str], run: Callable[[str], Awaitable[TurnResult]]):
+        """Start speculating on each action that is not already cached for this state."""
+        # Anything speculated for an older state can never be used
+        for key in [key for key in self._entries if key[0] != state_hash]:
+            self._entries.pop(key).cancel()
+        for action in actions:
+            key = (state_hash, normalize_action(action))
+            if key in self._entries:
+                continue
+            self._entries[key] = asyncio.ensure_future(self._run_limited(run, action))
+
+    def take(self, state_hash: str, action: str) -> Optional[asyncio.Task]:
+        """Claim the speculation for an action and cancel all the others."""
+        hit = self._entries.pop((state_hash, normalize_action(action)), None)
+        self.cancel_all()
+        if hit is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return hit
+
+    def cancel_all(self):
+        """Cancel every outstanding speculation."""
+        for task in self._entries.values():
+            task.cancel()
+        self._entries.clear()
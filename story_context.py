@@ -0,0 +1,177 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from tokenizer import token_counter
+
+logger = logging.getLogger(__name__)
+
+# Approximate token budget for the story context of each prompt type. The
+# turn prompts all use "story", so they share one prompt prefix.
+DEFAULT_BUDGETS: Dict[str, int] = {
+    "story": 1500,
+    "continuation": 1500,
+    "twist": 600,
+    "interaction": 600,
+    "suggestions": 400,
+}
+
+# Share of a budget the running summary may take before it is truncated
+SUMMARY_SHARE = 0.4
+
+# When the verbatim turns overflow a budget, the oldest are dropped until they
+# fill only this share of it; later turns then append to an unchanged prefix
+# instead of shifting it by one turn each time
+REFILL_SHARE = 0.6
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count of the text: tokenizer when available, else the calibrated estimate."""
+    return token_counter.count(text)
+
+
+def _truncate_tail(text: str, max_tokens: int) -> str:
+    """Keep the end of the text so that it fits in max_tokens."""
+    return token_counter.truncate(text, max_tokens, keep="tail")
+
+
+class StoryContext:
+    """Bounded story context: the last few turns verbatim plus a running summary.
+
+    Older turns are folded into the summary, a batch at a time, by the
+    summarize callable on a background thread, so building a prompt never
+    waits on summarization. Turns that have left the window but are not
+    folded yet are still sent verbatim (budget permitting) until the new
+    summary lands. Contexts may share an executor; each still runs at most
+    one fold at a time.
+
+    A built context only changes at its start when the summary does or when
+    old turns have to be dropped, so successive prompts share a prefix the
+    model server can keep cached.
+    """
+
+    def __init__(
+        self,
+        summarize: Callable[[str, str], str],
+        window_turns: int = 6,
+        fold_batch: int = 3,
+        budgets: Optional[Dict[str, int]] = None,
+        default_budget: int = 1000,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ):
+        self.summarize = summarize
+        self.window_turns = window_turns
+        self.fold_batch = fold_batch
+        self.budgets = dict(DEFAULT_BUDGETS)
+        if budgets:
+            self.budgets.update(budgets)
+        self.default_budget = default_budget
+
+        self.turns: List[str] = []  # Turns not yet folded into the summary
+        self.summary = ""
+        self.folded_turns = 0  # Number of turns already folded into the summary
+        self._starts: Dict[str, int] = {}  # Prompt type -> first turn sent verbatim, counted from the story start
+        self._lock = threading.Lock()
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="story-summary")
+        self._pending: Optional[Future] = None
+
+    def add_turn(self, text: str):
+        """Append a turn and schedule folding of turns that left the window."""
+        with self._lock:
+            self.turns.append(text)
+        self._schedule_fold()
+
+    def _schedule_fold(self):
+        with self._lock:
+            if self._pending is not None and not self._pending.done():
+                return
+            count = len(self.turns) - self.window_turns
+            if count <= 0:
+                return
+            # Fold at least fold_batch turns at once: the summary opens every prompt,
+            # so it should change every few turns rather than every turn
+            count = min(len(self.turns), max(count, self.fold_batch))
+            events = "\n\n".join(self.turns[:count])
+            self._pending = self._executor.submit(self._fold, self.summary, events, count)
+
+    def _fold(self, previous_summary: str, events: str, count: int):
+        try:
+            summary = self.summarize(previous_summary, events)
+        except Exception:
+            # The turns stay unfolded; the next add_turn tries again
+            logger.exception("Error summarizing story")
+            with self._lock:
+                self._pending = None
+            return
+        with self._lock:
+            self.summary = summary
+            # Turns may have been appended meanwhile, but only at the end
+            del self.turns[:count]
+            self.folded_turns += count
+            self._pending = None
+        # More turns may have left the window while we were summarizing
+        self._schedule_fold()
+
+    def state(self) -> Tuple[str, int]:
+        """The summary and how many turns it covers, for saving."""
+        with self._lock:
+            return self.summary, self.folded_turns
+
+    def restore(self, summary: str, folded_turns: int, turns: List[str]):
+        """Restore a saved context: the summary and the turns it does not cover yet."""
+        with self._lock:
+            self.summary = summary
+            self.folded_turns = folded_turns
+            self.turns = list(turns)
+        self._schedule_fold()
+
+    @property
+    def folding(self) -> bool:
+        """Whether a summarization is in flight."""
+        with self._lock:
+            return self._pending is not None
+
+    def wait(self, timeout: Optional[float] = None):
+        """Block until any in-flight summarization has finished."""
+        while True:
+            with self._lock:
+                pending = self._pending
+            if pending is None:
+                return
+            pending.result(timeout=timeout)
+
+    def build(self, prompt_type: str) -> str:
+        """Return the story context for a prompt, fitted to that prompt type's budget."""
+        budget = self.budgets.get(prompt_type, self.default_budget)
+        with self._lock:
+            summary = self.summary
+            recent = list(self.turns)
+            folded_turns = self.folded_turns
+            start = self._starts.get(prompt_type, 0)
+
+        summary_text = ""
+        if summary:
+            summary_text = _truncate_tail(summary, int(budget * SUMMARY_SHARE))
+        remaining = budget - estimate_tokens(summary_text)
+
+        costs = [estimate_tokens(turn) for turn in recent]
+        first = min(max(0, start - folded_turns), len(recent))
+        if sum(costs[first:]) > remaining:
+            # Walk backwards from the newest turn until the refill share is used up
+            first, used = len(recent), 0
+            while first > 0 and used + costs[first - 1] <= remaining * REFILL_SHARE:
+                first -= 1
+                used += costs[first]
+            if first == len(recent) and recent and costs[-1] <= remaining:
+                first -= 1  # The newest turn is kept whole whenever it fits at all
+            with self._lock:
+                self._starts[prompt_type] = folded_turns + first
+        kept = recent[first:]
+        if not kept and recent:
+            kept = [_truncate_tail(recent[-1], remaining)]
+
+        recent_text = "\n\n".join(kept)
+        if summary_text:
+            return f"Earlier in the story: {summary_text}\n\n{recent_text}"
+        return recent_text
@@ -0,0 +1,149 @@
+import time
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Callable, Dict, Iterator, List, Optional
+
+
+def format_turn_header(action: str, twist: str) -> str:
+    """Format the player's action and any twist that precede the continuation."""
+    update_text = f"\n\n> **{action}**"
+    if twist:
+        update_text += f"\n\n*{twist}*\n"
+    return update_text + "\n"
+
+
+@dataclass
+class TurnRecord:
+    """One entry of the story: the player's action, any twist and the continuation.
+
+    The opening passage is a record with an empty action.
+    """
+
+    action: str
+    continuation: str
+    twist: str = ""
+    started_at: float = field(default_factory=time.time)
+    finished_at: float = field(default_factory=time.time)
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+    @cached_property
+    def text(self) -> str:
+        """The text this turn adds to the story."""
+        if not self.action:
+            return self.continuation
+        return format_turn_header(self.action, self.twist) + self.continuation
+
+
+class StoryLog:
+    """Append-only list of turns with cached offsets.
+
+    Appending is O(1). The full text is only materialized when asked for,
+    and extended incrementally from the last materialization, so readers
+    that need "the last K turns" never pay for the whole story.
+
+    A restored log may hold only its most recent turns in memory; older
+    turns are fetched through the loader the first time they are read. The
+    loader reads a range of turns in one sequential pass.
+    """
+
+    def __init__(self, opening: Optional[str] = None):
+        self.turns: List[Optional[TurnRecord]] = []
+        self._offsets: List[int] = []  # Character offset where each turn starts
+        self._length = 0
+        self._text = ""
+        self._text_turns = 0  # Number of turns included in self._text
+        self._loader: Optional[Callable[[int, int], Iterator[TurnRecord]]] = None
+        if opening is not None:
+            self.append(TurnRecord(action="", continuation=opening))
+
+    @classmethod
+    def restore(
+        cls,
+        text_lengths: List[int],
+        recent: Dict[int, TurnRecord],
+        loader: Callable[[int, int], Iterator[TurnRecord]],
+    ) -> "StoryLog":
+        """Rebuild a log from the text length of every turn plus the turns already loaded.
+
+        loader(start, end) yields the turns start to end (exclusive) from disk.
+        """
+        log = cls()
+        log._loader = loader
+        for index, length in enumerate(text_lengths):
+            log.turns.append(recent.get(index))
+            log._offsets.append(log._length)
+            log._length += length
+        return log
+
+    def append(self, record: TurnRecord) -> int:
+        """Append a turn and return its index."""
+        self.turns.append(record)
+        self._offsets.append(self._length)
+        self._length += len(record.text)
+        return len(self.turns) - 1
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def __getitem__(self, index: int) -> TurnRecord:
+        if index < 0:
+            index += len(self.turns)
+        record = self.turns[index]
+        if record is None:
+            record = next(iter(self._loader(index, index + 1)))
+            self.turns[index] = record
+        return record
+
+    def loaded(self, index: int) -> Optional[TurnRecord]:
+        """The turn if it is in memory, None if it is only on disk."""
+        return self.turns[index]
+
+    def iter_range(self, start: int, end: int) -> Iterator[TurnRecord]:
+        """Turns start to end (exclusive) in order, without keeping the ones read from disk.
+
+        Each run of turns only on disk is read in one pass. Only reads the
+        log, so it may run off the thread that appends to it.
+        """
+        index, end = max(0, start), min(end, len(self.turns))
+        while index < end:
+            record = self.turns[index]
+            if record is not None:
+                yield record
+                index += 1
+                continue
+            stop = index + 1
+            while stop < end and self.turns[stop] is None:
+                stop += 1
+            yield from self._loader(index, stop)
+            index = stop
+
+    @property
+    def char_length(self) -> int:
+        """Length of the full story text, without materializing it."""
+        return self._length
+
+    def offset(self, index: int) -> int:
+        """Character offset at which a turn starts in the full text."""
+        return self._offsets[index]
+
+    def since(self, index: int) -> List[TurnRecord]:
+        return [self[i] for i in range(max(0, index), len(self.turns))]
+
+    def last(self, k: int) -> List[TurnRecord]:
+        return self.since(len(self.turns) - k) if k > 0 else []
+
+    def text_since(self, index: int) -> str:
+        return "".join(turn.text for turn in self.iter_range(index, len(self.turns)))
+
+    def text_range(self, start: int, end: int) -> str:
+        """Text of turns start to end (exclusive); only those turns are loaded."""
+        return "".join(self[i].text for i in range(max(0, start), min(end, len(self.turns))))
+
+    @property
+    def text(self) -> str:
+        """The full story text."""
+        if self._text_turns < len(self.turns):
+            self._text += self.text_since(self._text_turns)
+            self._text_turns = len(self.turns)
+        return self._text
@@ -0,0 +1,142 @@
+import re
+import threading
+import zlib
+from collections import Counter
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from story_log import StoryLog
+
+# Number of hashed feature buckets; collisions only blur rare-word matches slightly
+FEATURE_BITS = 18
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he her
+here hers herself him himself his how i if in into is it its itself just me more most my myself no nor not
+now of off on once only or other our ours ourselves out over own same she should so some such than that the
+their theirs them themselves then there these they this those through to too under until up very was we
+were what when where which while who whom why will with would you your yours yourself yourselves
+""".split())
+
+
+# Longest passage of a turn that recall can return; kept with the index so recall never reads the story log
+SNIPPET_CHARS = 400
+
+
+def _snippet(text: str, max_chars: int) -> str:
+    """The text cut to at most max_chars at a word boundary."""
+    text = text.strip()
+    if len(text) > max_chars:
+        text = text[:max_chars].rsplit(" ", 1)[0] + "..."
+    return text
+
+
+def _features(text: str) -> Counter:
+    """Hashed term counts of a text: lowercased words minus stopwords."""
+    counts: Counter = Counter()
+    for word in _WORD.findall(text.lower()):
+        if len(word) > 1 and word not in STOPWORDS:
+            # crc32 rather than hash(): stable across processes
+            counts[zlib.crc32(word.encode()) & ((1 << FEATURE_BITS) - 1)] += 1
+    return counts
+
+
+class StoryMemory:
+    """TF-IDF retrieval over the turns of a story.
+
+    Each turn is stored as its hashed term weights (1 + log tf, normalized
+    to unit length) in flat NumPy arrays; document frequencies are kept per
+    feature, so appending a turn is O(turn) and the IDF weights are applied
+    to the query at search time. A query scores every indexed turn with one
+    gather and one bincount over the stored weights.
+
+    Like MentionIndex, only turns appended since the last update are indexed.
+    The start of each turn is kept with its weights for recall, so a search
+    never reads turns back from the story log (or from disk).
+    """
+
+    def __init__(self, story_log: StoryLog, capacity: int = 4096):
+        self.story_log = story_log
+        self._doc = np.zeros(capacity, dtype=np.int32)  # Turn index of each stored weight
+        self._feature = np.zeros(capacity, dtype=np.int32)
+        self._weight = np.zeros(capacity, dtype=np.float32)
+        self._size = 0  # Stored weights in use
+        self._df = np.zeros(1 << FEATURE_BITS, dtype=np.int32)
+        self._indexed = 0  # Number of story turns already indexed
+        self._snippets: List[str] = []  # Start of each indexed turn, for recall
+        self._lock = threading.Lock()
+
+    @property
+    def indexed(self) -> int:
+        return self._indexed
+
+    def _add(self, turn_index: int, text: str):
+        counts = _features(text)
+        if not counts:
+            return
+        features = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+        weights = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        weights /= np.linalg.norm(weights)
+        end = self._size + len(features)
+        if end > len(self._doc):
+            capacity = max(end, 2 * len(self._doc))
+            self._doc = np.resize(self._doc, capacity)
+            self._feature = np.resize(self._feature, capacity)
+            self._weight = np.resize(self._weight, capacity)
+        self._doc[self._size:end] = turn_index
+        self._feature[self._size:end] = features
+        self._weight[self._size:end] = weights
+        self._size = end
+        self._df[features] += 1
+
+    def update(self):
+        """Index the turns appended since the last update."""
+        with self._lock:
+            # Turns only on disk are read in one sequential pass, and not kept in memory
+            end = len(self.story_log)
+            for index, record in enumerate(self.story_log.iter_range(self._indexed, end), self._indexed):
+                self._add(index, record.text)
+                self._snippets.append(_snippet(record.text, SNIPPET_CHARS))
+            self._indexed = end
+
+    def search(self, query: str, k: int = 3, before: Optional[int] = None) -> List[Tuple[int, float]]:
+        """The k turns most similar to the query as (turn index, score), best first.
+
+        Only turns before `before` are considered, e.g. to skip the turns a
+        prompt already carries verbatim.
+        """
+        self.update()
+        counts = _features(query)
+        with self._lock:
+            n = self._indexed if before is None else min(before, self._indexed)
+            if not counts or n <= 0:
+                return []
+            features = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            tf = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+            idf = np.log((self._indexed + 1) / (self._df[features] + 1))
+            query_weights = np.zeros(1 << FEATURE_BITS, dtype=np.float32)
+            query_weights[features] = tf * idf
+            # Turns are stored in order, so the turns before n are a prefix of the arrays
+            end = int(np.searchsorted(self._doc[:self._size], n))
+            scores = np.bincount(
+                self._doc[:end],
+                weights=self._weight[:end] * query_weights[self._feature[:end]],
+                minlength=n,
+            )
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(index), float(scores[index])) for index in top if scores[index] > 0]
+
+    def recall(self, query: str, k: int = 3, before: Optional[int] = None, max_chars: int = SNIPPET_CHARS) -> str:
+        """The most relevant earlier turns as a prompt passage, oldest first; at most SNIPPET_CHARS of each."""
+        hits = sorted(index for index, _ in self.search(query, k, before))
+        passages = []
+        for index in hits:
+            text = self._snippets[index]
+            passages.append(f"[Turn {index}] {text if max_chars >= SNIPPET_CHARS else _snippet(text, max_chars)}")
+        return "\n\n".join(passages)
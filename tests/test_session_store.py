@@ -0,0 +1,66 @@
+import os
+
+from session_store import SavedSession, SessionStore
+from story_log import StoryLog, TurnRecord
+from world import WorldState
+
+
+def new_store(tmp_path, turns: int) -> SessionStore:
+    store = SessionStore(str(tmp_path))
+    session = SavedSession(StoryLog("Opening."), WorldState(), [], 0, [])
+    store.create("s1", session)
+    for i in range(turns):
+        store.append_turn("s1", TurnRecord(action=f"act {i}", continuation=f"Turn {i}."), {}, i, [])
+    return store
+
+
+def journal_path(store: SessionStore) -> str:
+    return store._path("s1", "journal.jsonl")
+
+
+def test_load_drops_partial_line_after_last_indexed_turn(tmp_path):
+    store = new_store(tmp_path, 2)
+    end = os.path.getsize(journal_path(store))
+    # A crash while writing the next line: half of it reached the journal, none of the index
+    with open(journal_path(store), "ab") as f:
+        f.write(b'{"record": {"action": "act 2", "contin')
+
+    saved = store.load("s1")
+    assert len(saved.story_log) == 3
+    assert saved.story_log[-1].continuation == "Turn 1."
+    assert saved.choices == ["act 0", "act 1"]
+    assert os.path.getsize(journal_path(store)) == end
+
+    assert store.append_turn("s1", TurnRecord(action="act 2", continuation="Turn 2."), {}, 2, []) == 4
+    assert store._read_index("s1")[-1][0] == end
+    saved = store.load("s1")
+    assert [turn.continuation for turn in saved.story_log.iter_range(0, 4)] == ["Opening.", "Turn 0.", "Turn 1.", "Turn 2."]
+
+
+def test_load_drops_indexed_turn_cut_mid_record(tmp_path):
+    store = new_store(tmp_path, 2)
+    last_offset = store._read_index("s1")[-1][0]
+    # The last indexed line lost its tail
+    with open(journal_path(store), "r+b") as f:
+        f.truncate(last_offset + 10)
+
+    saved = store.load("s1")
+    assert len(saved.story_log) == 2
+    assert saved.story_log[-1].continuation == "Turn 0."
+    assert saved.choices == ["act 0"]
+    assert len(store._read_index("s1")) == 2
+    assert os.path.getsize(journal_path(store)) == last_offset
+
+    assert store.append_turn("s1", TurnRecord(action="act 1", continuation="Turn 1 again."), {}, 1, []) == 3
+    assert store._read_index("s1")[-1][0] == last_offset
+    assert store.load("s1").story_log[-1].continuation == "Turn 1 again."
+
+
+def test_load_ignores_torn_index_entry(tmp_path):
+    store = new_store(tmp_path, 1)
+    with open(store._path("s1", "journal.idx"), "ab") as f:
+        f.write(b"\x01\x02\x03")
+
+    assert len(store.load("s1").story_log) == 2
+    assert store.append_turn("s1", TurnRecord(action="act 1", continuation="Turn 1."), {}, 1, []) == 3
+    assert store.load("s1").story_log[-1].continuation == "Turn 1."
@@ -0,0 +1,94 @@
+import json
+
+from world import RelationshipLevel, WorldState
+
+
+def starting_world() -> WorldState:
+    world = WorldState()
+    world.add_character("Ada", "A smith.", ["stubborn"])
+    world.add_character("Bram", "A ferryman.", ["quiet"])
+    world.add_character("Cora", "A healer.", ["kind"])
+    return world
+
+
+def state(world: WorldState):
+    return {
+        name: (char.description, char.traits, char.relationship_points, char.relationship, char.last_interaction)
+        for name, char in world.characters.items()
+    }, world.current_location, world.time_of_day
+
+
+def test_delta_round_trip():
+    world = starting_world()
+    copy = WorldState.from_snapshot(world.to_snapshot())
+    since = world.version
+
+    world.update_relationships(["Ada", "Bram"], 4)
+    world.update_character_relationship("Ada", 3)
+    world.characters["Bram"].last_interaction = "Ferried you across the river."
+    world.add_character("Dunn", "A stranger.", ["wary"])
+    world.update_character_relationship("Dunn", -8)
+    world.characters["Dunn"].last_interaction = "Glared at you."
+    world.current_location = "Dark Forest"
+
+    # Journal lines go through JSON
+    delta = json.loads(json.dumps(world.delta(since)))
+    assert delta["points"] == {"Ada": 7, "Bram": 4}
+    assert delta["last_interaction"] == {"Bram": "Ferried you across the river."}
+    assert [char["name"] for char in delta["added"]] == ["Dunn"]
+    assert delta["current_location"] == "Dark Forest"
+    assert "time_of_day" not in delta
+    assert "Cora" not in delta.get("points", {})
+
+    copy.apply_delta(delta)
+    assert state(copy) == state(world)
+    assert copy.characters["Ada"].relationship == RelationshipLevel.TRUSTED
+    assert copy.characters["Dunn"].relationship == RelationshipLevel.HOSTILE
+
+
+def test_delta_version_stamp():
+    world = starting_world()
+    since = world.version
+    world.update_character_relationship("Ada", 2)
+
+    delta = world.delta(since)
+    assert delta["version"] == world.version
+    # Asking from the stamp returns nothing but the stamp
+    assert world.delta(delta["version"]) == {"version": world.version}
+
+    world.characters["Cora"].last_interaction = "Bandaged your arm."
+    assert world.delta(delta["version"]) == {
+        "version": world.version,
+        "last_interaction": {"Cora": "Bandaged your arm."},
+    }
+
+
+def test_applied_delta_is_stamped_on_the_copy():
+    world = starting_world()
+    copy = WorldState.from_snapshot(world.to_snapshot())
+    since, copy_since = world.version, copy.version
+    world.update_character_relationship("Cora", 5)
+    world.add_character("Dunn", "A stranger.")
+
+    copy.apply_delta(world.delta(since))
+    assert copy.version > copy_since
+    # The copy can pass the same changes on to its own consumers
+    chained = copy.delta(copy_since)
+    assert chained["points"] == {"Cora": 5}
+    assert [char["name"] for char in chained["added"]] == ["Dunn"]
+    assert copy.delta(copy.version) == {"version": copy.version}
+
+
+def test_apply_delta_ignores_unknown_and_existing_characters():
+    world = starting_world()
+    copy = WorldState.from_snapshot(world.to_snapshot())
+    copy.apply_delta({
+        "version": 99,
+        "points": {"Nobody": 3, "Ada": 1},
+        "last_interaction": {"Nobody": "Waved."},
+        "added": [{"name": "Ada", "description": "Someone else.", "traits": [],
+                   "relationship_points": -5, "last_interaction": ""}],
+    })
+    assert set(copy.characters) == {"Ada", "Bram", "Cora"}
+    assert copy.characters["Ada"].description == "A smith."
+    assert copy.characters["Ada"].relationship_points == 1
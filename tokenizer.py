@@ -0,0 +1,72 @@
+import logging
+import math
+import os
+import threading
+
+try:
+    import tiktoken
+except ImportError:  # Optional: fall back to the calibrated estimate
+    tiktoken = None
+
+# Encoding used when tiktoken is installed; it only approximates local models' tokenizers
+TOKENIZER_ENCODING = os.environ.get("LIVING_PAGES_TOKENIZER", "cl100k_base")
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCounter:
+    """Counts tokens with tiktoken when available, else with a calibrated estimate.
+
+    The estimate divides the length by a characters-per-token ratio that
+    starts at 4 (typical for English prose) and is nudged towards the
+    server's own prompt token counts as they come in.
+    """
+
+    def __init__(self, encoding: str = TOKENIZER_ENCODING, chars_per_token: float = 4.0, smoothing: float = 0.1):
+        self.chars_per_token = chars_per_token
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.get_encoding(encoding)
+            except Exception as e:  # The encoding may need a download we cannot do
+                logger.warning("Tokenizer %s unavailable, estimating token counts: %s", encoding, e)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def observe(self, chars: int, tokens: int):
+        """Calibrate the estimate with a server-reported token count for a text of this length."""
+        if self._encoding is not None or chars < 200 or tokens <= 0:
+            return
+        with self._lock:
+            ratio = chars / tokens
+            self.chars_per_token += self.smoothing * (ratio - self.chars_per_token)
+
+    def truncate(self, text: str, max_tokens: int, keep: str = "tail") -> str:
+        """Cut text to at most max_tokens, keeping its start ("head") or its end ("tail")."""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        if self._encoding is not None:
+            ids = self._encoding.encode(text, disallowed_special=())
+            ids = ids[-max_tokens:] if keep == "tail" else ids[:max_tokens]
+            text = self._encoding.decode(ids)
+        else:
+            max_chars = int(max_tokens * self.chars_per_token)
+            text = text[len(text) - max_chars:] if keep == "tail" else text[:max_chars]
+        return "..." + text[3:] if keep == "tail" else text[:-3] + "..."
+
+
+# Shared by everything that budgets prompts
+token_counter = TokenCounter()
+
+
+def count_tokens(text: str) -> int:
+    return token_counter.count(text)
@@ -0,0 +1,187 @@
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds (seconds) of the span duration histogram buckets
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional["Span"]:
+    """The innermost open span of the current thread or task, if any."""
+    return _current_span.get()
+
+
+@dataclass
+class Span:
+    """A timed unit of work: a turn, one of its steps or an LLM call.
+
+    LLM calls made inside a span annotate it with queue time, token counts,
+    cache hits and retries.
+    """
+
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    session_id: str = ""
+    start: float = field(default_factory=time.time)
+    duration: float = 0.0
+    queue_time: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached: bool = False
+    retries: int = 0
+    error: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+class Tracer:
+    """Collects finished spans in a bounded buffer and keeps running metrics per span name."""
+
+    def __init__(self, max_spans: int = 5000):
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = defaultdict(int)
+        self._duration_sum: Dict[str, float] = defaultdict(float)
+        self._buckets: Dict[str, List[int]] = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+        self._queue_sum: Dict[str, float] = defaultdict(float)
+        self._tokens: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._cache_hits: Dict[str, int] = defaultdict(int)
+        self._retries: Dict[str, int] = defaultdict(int)
+        self._errors: Dict[str, int] = defaultdict(int)
+
+    @contextmanager
+    def span(self, name: str, session_id: Optional[str] = None, **attributes) -> Iterator[Span]:
+        """Time the block as a span nested under the current one."""
+        parent = _current_span.get()
+        span = Span(
+            name=name,
+            trace_id=parent.trace_id if parent else uuid.uuid4().hex[:16],
+            span_id=uuid.uuid4().hex[:16],
+            parent_id=parent.span_id if parent else None,
+            session_id=session_id if session_id is not None else (parent.session_id if parent else ""),
+            attributes=attributes,
+        )
+        started = time.perf_counter()
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.duration = time.perf_counter() - started
+            self._finish(span)
+
+    def _finish(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+            name = span.name
+            self._counts[name] += 1
+            self._duration_sum[name] += span.duration
+            buckets = self._buckets[name]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span.duration <= bound:
+                    buckets[i] += 1
+            self._queue_sum[name] += span.queue_time
+            self._tokens[(name, "prompt")] += span.prompt_tokens
+            self._tokens[(name, "completion")] += span.completion_tokens
+            self._cache_hits[name] += span.cached
+            self._retries[name] += span.retries
+            self._errors[name] += span.error is not None
+
+    def recent(self, session_id: Optional[str] = None, limit: int = 200) -> List[Span]:
+        """The most recent finished spans, oldest first, optionally for one session."""
+        with self._lock:
+            spans = list(self.spans)
+        if session_id is not None:
+            spans = [span for span in spans if span.session_id == session_id]
+        return spans[-limit:]
+
+    def last_trace(self, session_id: str, root: str = "turn") -> List[Span]:
+        """The spans of the session's most recent trace with the given root span name."""
+        spans = self.recent(session_id, limit=len(self.spans))
+        for span in reversed(spans):
+            if span.name == root and span.parent_id is None:
+                return sorted((s for s in spans if s.trace_id == span.trace_id), key=lambda s: s.start)
+        return []
+
+    def to_jsonl(self, spans: Optional[List[Span]] = None) -> str:
+        """Spans as JSON Lines, one span per line."""
+        if spans is None:
+            spans = self.recent(limit=len(self.spans))
+        return "".join(json.dumps(asdict(span)) + "\n" for span in spans)
+
+    def prometheus_text(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                "# HELP living_pages_span_duration_seconds Wall time of spans by name.",
+                "# TYPE living_pages_span_duration_seconds histogram",
+            ]
+            for name in sorted(self._counts):
+                label = _label(name)
+                for bound, count in zip(DURATION_BUCKETS, self._buckets[name]):
+                    lines.append(f'living_pages_span_duration_seconds_bucket{{span="{label}",le="{bound}"}} {count}')
+                lines.append(f'living_pages_span_duration_seconds_bucket{{span="{label}",le="+Inf"}} {self._counts[name]}')
+                lines.append(f'living_pages_span_duration_seconds_sum{{span="{label}"}} {self._duration_sum[name]:.6f}')
+                lines.append(f'living_pages_span_duration_seconds_count{{span="{label}"}} {self._counts[name]}')
+            counters = [
+                ("living_pages_span_queue_seconds_total", "Time spent waiting for a model slot.", self._queue_sum),
+                ("living_pages_cache_hits_total", "LLM responses served from the cache.", self._cache_hits),
+                ("living_pages_retries_total", "LLM call retries.", self._retries),
+                ("living_pages_span_errors_total", "Spans that ended with an error.", self._errors),
+            ]
+            for metric, help_text, values in counters:
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+                for name in sorted(values):
+                    lines.append(f'{metric}{{span="{_label(name)}"}} {values[name]}')
+            lines += [
+                "# HELP living_pages_tokens_total Prompt and completion tokens.",
+                "# TYPE living_pages_tokens_total counter",
+            ]
+            for (name, kind), count in sorted(self._tokens.items()):
+                lines.append(f'living_pages_tokens_total{{span="{_label(name)}",kind="{kind}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def serve_metrics(tracer: Tracer, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve /metrics (Prometheus text) and /traces.jsonl from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = tracer.prometheus_text(), "text/plain; version=0.0.4"
+            elif self.path == "/traces.jsonl":
+                body, content_type = tracer.to_jsonl(), "application/x-ndjson"
+            else:
+                self.send_error(404)
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,716 @@
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from llm_client import LLMError, LLMRequest, LLMResponse, LLMResponseError
+from procedural import NameGenerator, TwistGenerator, TwistPolicy
+from prompt_builder import PromptBuilder
+from story_context import StoryContext, estimate_tokens
+from story_log import TurnRecord, format_turn_header
+from story_memory import StoryMemory
+from tracing import Tracer
+from world import Character, RelationshipLevel, WorldState
+
+logger = logging.getLogger(__name__)
+
+# Fallback when the model does not return usable suggestions
+DEFAULT_SUGGESTIONS = ["Look around", "Search the area", "Continue forward"]
+
+# Every prompt of a turn starts with this system prompt and then STORY_PREFIX,
+# byte for byte, so the model server can reuse the story's KV cache from one
+# call to the next; everything that varies goes after the story.
+STORY_SYSTEM_PROMPT = """You are a master storyteller running a text adventure game.
+You write twists, character interactions and story continuations, and suggest what the player could do next.
+Follow the task at the end of each message exactly."""
+
+STORY_PREFIX = "STORY SO FAR:\n{story}\n\n"
+
+# Story context budget shared by all turn prompts; see StoryContext.build
+STORY_BUDGET = "story"
+
+# Trained once; each turn brings its own seeded rng
+NAME_GENERATOR = NameGenerator()
+
+NEW_CHARACTER_TRAITS = ["mysterious", "friendly", "suspicious", "wise", "playful", "serious", "eccentric"]
+
+
+@dataclass
+class Step:
+    """One node of a turn graph.
+
+    build returns the LLM request for the step (or None for pure steps) and
+    finish turns the completion text into the step's result. Both receive
+    the results of the steps completed so far, keyed by step name.
+    """
+
+    name: str
+    build: Callable[[Dict[str, Any]], Optional[LLMRequest]]
+    finish: Callable[[Dict[str, Any], Optional[str]], Any]
+    deps: Tuple[str, ...] = ()
+    stream: bool = False
+    optional: bool = False  # An LLM failure yields None instead of failing the turn
+    fallback: Optional[Callable[[Dict[str, Any]], Any]] = None  # ...or this stand-in's result
+
+
+class Pipeline:
+    """Runs a graph of steps, starting each step as soon as its dependencies are done.
+
+    Independent steps run concurrently as tasks on the event loop, so the
+    wall-clock time of a turn is its critical path rather than the sum of
+    its calls.
+    """
+
+    def __init__(
+        self,
+        steps: Iterable[Step],
+        tracer: Optional[Tracer] = None,
+        on_progress: Optional[Callable[[str, str], None]] = None,
+    ):
+        self.steps: Dict[str, Step] = {}
+        self.tracer = tracer  # Each step runs in its own span when set
+        # Called with (step name, "started" / "finished" / "failed") around each LLM call
+        self.on_progress = on_progress
+        # (prompt tokens, completion tokens) of each LLM step of the last run
+        self.usage: Dict[str, Tuple[int, int]] = {}
+        for step in steps:
+            if step.name in self.steps:
+                raise ValueError(f"Duplicate step: {step.name}")
+            self.steps[step.name] = step
+        self._check_graph()
+
+    def _check_graph(self):
+        done = set()
+        remaining = dict(self.steps)
+        while remaining:
+            ready = [name for name, step in remaining.items() if all(d in done for d in step.deps)]
+            if not ready:
+                missing = {d for step in remaining.values() for d in step.deps if d not in self.steps}
+                if missing:
+                    raise ValueError(f"Unknown step dependencies: {sorted(missing)}")
+                raise ValueError(f"Dependency cycle between steps: {sorted(remaining)}")
+            for name in ready:
+                done.add(name)
+                del remaining[name]
+
+    def _record_usage(self, step: Step, request: LLMRequest, response: Any) -> Optional[str]:
+        """Note the token usage of a step's LLM call and return the completion text."""
+        # Prefer the server's token counts; fall back to an estimate
+        if isinstance(response, LLMResponse):
+            text = response.text
+            prompt_tokens, completion_tokens = response.prompt_tokens, response.completion_tokens
+        else:
+            text, prompt_tokens, completion_tokens = response, None, None
+        self.usage[step.name] = (
+            prompt_tokens if prompt_tokens is not None else estimate_tokens((request.system_prompt or "") + request.prompt),
+            completion_tokens if completion_tokens is not None else estimate_tokens(text or ""),
+        )
+        return text
+
+    def _progress(self, step: Step, state: str):
+        if self.on_progress is not None:
+            self.on_progress(step.name, state)
+
+    def _span(self, step: Step):
+        return self.tracer.span(step.name) if self.tracer is not None else nullcontext()
+
+    async def _arun_step(self, step: Step, results: Dict[str, Any], call: Callable[[LLMRequest], Awaitable[Any]]) -> Any:
+        with self._span(step):
+            request = step.build(results)
+            if request is None:
+                return step.finish(results, None)
+            self._progress(step, "started")
+            try:
+                response = await call(request)
+            except LLMError as e:
+                self._progress(step, "failed")
+                if not step.optional:
+                    raise
+                logger.warning("Error in turn step %r: %s", step.name, e)
+                return step.fallback(results) if step.fallback is not None else None
+            self._progress(step, "finished")
+            return step.finish(results, self._record_usage(step, request, response))
+
+    async def arun(
+        self,
+        complete: Callable[[LLMRequest], Awaitable[Any]],
+        stream: Optional[Callable[[LLMRequest, Dict[str, Any]], Awaitable[str]]] = None,
+    ) -> Dict[str, Any]:
+        """Run every step, each as a task on the running event loop, and return their results keyed by step name.
+
+        complete is awaited for each LLM call and returns an LLMResponse (or
+        just the text); streaming steps go through stream instead when it is
+        given.
+        """
+        results: Dict[str, Any] = {}
+        self.usage = {}
+        pending = dict(self.steps)
+        running: Dict[asyncio.Task, str] = {}
+
+        try:
+            while pending or running:
+                for step in [step for step in pending.values() if all(d in results for d in step.deps)]:
+                    del pending[step.name]
+                    snapshot = dict(results)
+                    call = complete
+                    if step.stream and stream is not None:
+                        call = lambda request, snapshot=snapshot: stream(request, snapshot)
+                    running[asyncio.ensure_future(self._arun_step(step, snapshot, call))] = step.name
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    results[running.pop(task)] = task.result()
+        except BaseException:
+            for task in running:
+                task.cancel()
+            raise
+        return results
+
+
+@dataclass
+class TurnPlan:
+    """All random decisions of a turn, drawn up front so steps can run in any order."""
+
+    action: str
+    event: str = "none"  # "none", "interaction" or "twist"
+    character: Optional[str] = None
+    interaction_type: str = ""
+    discover_character: bool = False
+    new_character_traits: List[str] = field(default_factory=list)
+    procedural: bool = False  # Event and name come from the template tables, not the model
+    seed: int = 0  # Seeds the procedural generators (also the stand-ins for a failed call), so a plan always yields the same text
+
+
+@dataclass
+class TurnResult:
+    action: str
+    twist: str = ""
+    relationship_changes: Dict[str, int] = field(default_factory=dict)
+    interacted_with: Optional[str] = None
+    new_character: Optional[Dict[str, Any]] = None
+    continuation: str = ""
+    suggestions: List[str] = field(default_factory=list)
+    started_at: float = field(default_factory=time.time)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    seed: int = 0  # The turn's plan was drawn from random.Random(seed); replays pass it back
+
+    @property
+    def update_text(self) -> str:
+        """The text appended to the story for this turn."""
+        return format_turn_header(self.action, self.twist) + self.continuation
+
+    def to_record(self) -> TurnRecord:
+        """The story log entry for this turn."""
+        return TurnRecord(
+            action=self.action,
+            twist=self.twist,
+            continuation=self.continuation,
+            started_at=self.started_at,
+            finished_at=time.time(),
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens,
+        )
+
+
+def get_arc_hint(arc_progress: int) -> str:
+    """Get narrative arc hint based on progress."""
+    if arc_progress < 3:
+        return "The world feels calm, but something bigger is stirring."
+    elif arc_progress < 6:
+        return "You sense unseen forces nudging you toward a hidden truth."
+    else:
+        return "The climax draws near, every choice feels heavy with consequence."
+
+
+def suggestions_request(story_context: str) -> LLMRequest:
+    """Build the request for 3-4 suggested next actions."""
+    template = STORY_PREFIX + """TASK: Suggest 3-4 possible actions the player could take next. Keep each short (2-5 words) and action-oriented.
+Return ONLY a JSON array of strings, nothing else.
+Example response: ["Look around the room", "Talk to the stranger", "Open the chest", "Leave the area"]"""
+    return PromptBuilder("suggestions", template, STORY_SYSTEM_PROMPT).add("story", story_context).request()
+
+
+def parse_suggestions(response: str) -> List[str]:
+    """Extract the JSON array of actions from a model response."""
+    try:
+        start = response.find('[')
+        end = response.rfind(']') + 1
+        if start != -1 and end > start:
+            suggestions = json.loads(response[start:end])
+            if isinstance(suggestions, list) and suggestions:
+                return [str(s) for s in suggestions]
+    except ValueError as e:
+        logger.warning("Error parsing suggestions: %s", e)
+    return list(DEFAULT_SUGGESTIONS)
+
+
+def interaction_type_for(relationship: RelationshipLevel, rng=random) -> str:
+    """Pick an interaction type that fits the character's relationship with the player."""
+    if relationship in [RelationshipLevel.HOSTILE, RelationshipLevel.UNFRIENDLY]:
+        return rng.choice(["challenge", "threat", "warning"])
+    elif relationship == RelationshipLevel.NEUTRAL:
+        return rng.choice(["observe", "question", "comment"])
+    else:
+        return rng.choice(["help", "advice", "gift"])
+
+
+def plan_turn(action: str, mentioned_chars: List[Character], rng=random,
+              policy: Optional[TwistPolicy] = None, queued: int = 0) -> TurnPlan:
+    """Roll the dice for a turn: twist, character interaction or nothing.
+
+    Without a policy every event is written by the model; queued is the
+    number of LLM requests already waiting, for the policy to weigh.
+    """
+    plan = TurnPlan(action=action)
+    if rng.random() < 0.4:  # 40% chance of a narrative event
+        if rng.random() < 0.6:  # 60% chance of a character interaction
+            if mentioned_chars:
+                char = rng.choice(mentioned_chars)
+                plan.event = "interaction"
+                plan.character = char.name
+                plan.interaction_type = interaction_type_for(char.relationship, rng)
+        else:  # 40% chance of a regular twist
+            plan.event = "twist"
+            # Small chance to discover a new character
+            if rng.random() < 0.2:
+                plan.discover_character = True
+                plan.new_character_traits = rng.sample(NEW_CHARACTER_TRAITS, k=rng.randint(2, 4))
+        if plan.event != "none":
+            plan.seed = rng.getrandbits(32)
+            plan.procedural = policy is not None and not policy.use_llm(rng, queued)
+    return plan
+
+
+def interaction_request(char: Character, interaction_type: str, story_context: str) -> LLMRequest:
+    template = STORY_PREFIX + '{character}\nExample: "Old Man Jenkins warns you about the dangers of the forest at night."'
+    character = f"""CHARACTER:
+{char.name} ({', '.join(char.traits)}), relationship with the player: {char.relationship.name}
+
+TASK: Write a short, engaging interaction (1-2 sentences) where {char.name} {interaction_type}s the player."""
+    builder = PromptBuilder("interaction", template, STORY_SYSTEM_PROMPT)
+    return builder.add("character", character, required=True).add("story", story_context).request()
+
+
+def twist_request(action: str, story_context: str) -> LLMRequest:
+    template = STORY_PREFIX + """PLAYER'S ACTION:
+{action}
+
+TASK: Write a short, surprising narrative twist (1-2 sentences). Keep it engaging and relevant.
+Example: 'As you reach for the door, you hear a loud crash from the room above.'"""
+    builder = PromptBuilder("twist", template, STORY_SYSTEM_PROMPT)
+    return builder.add("action", action, required=True).add("story", story_context).request()
+
+
+def character_name_request() -> LLMRequest:
+    return PromptBuilder(
+        "character_name",
+        "Generate a fantasy character name (just the name, no quotes or punctuation)",
+        "You are a creative writer who invents interesting character names.",
+    ).request()
+
+
+def continuation_request(action: str, twist: str, arc_hint: str, story_context: str, memory: str = "") -> LLMRequest:
+    template = STORY_PREFIX + """{memory}PLAYER'S ACTION:
+{action}
+
+{twist}{arc_hint}TASK: Continue the story in 2-4 paragraphs that acknowledge the player's action, weave in any twist naturally, advance the story coherently and leave room for future developments. Maintain player agency: don't describe the player's actions for them - just describe what happens as a result."""
+    # When the budget is tight recalled events go first, then the oldest story text, then the arc hint
+    builder = PromptBuilder("continuation", template, STORY_SYSTEM_PROMPT)
+    builder.add("action", action, required=True)
+    builder.add("twist", f'NARRATIVE TWIST (if any):\n{twist}\n\n' if twist else '', priority=3, keep="head")
+    builder.add("arc_hint", f'NARRATIVE ARC HINT:\n{arc_hint}\n\n', priority=2, keep="head")
+    builder.add("story", story_context, priority=1)
+    builder.add("memory", f'RELEVANT EARLIER EVENTS:\n{memory}\n\n' if memory else '', keep="head")
+    return builder.request()
+
+
+# Reply format of a structured turn. Field order matters: the twist is complete
+# before the continuation starts, so the turn header can be streamed first.
+TURN_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "twist": {"type": "string"},
+        "continuation": {"type": "string"},
+        "suggestions": {"type": "array", "items": {"type": "string"}, "minItems": 3, "maxItems": 4},
+        "new_character": {
+            "anyOf": [
+                {"type": "null"},
+                {
+                    "type": "object",
+                    "properties": {"name": {"type": "string"}, "description": {"type": "string"}},
+                    "required": ["name", "description"],
+                    "additionalProperties": False,
+                },
+            ]
+        },
+        "relationship_changes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"name": {"type": "string"}, "change": {"type": "integer", "enum": [-1, 1]}},
+                "required": ["name", "change"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["twist", "continuation", "suggestions", "new_character", "relationship_changes"],
+    "additionalProperties": False,
+}
+
+# Relationship change implied by each kind of interaction
+INTERACTION_CHANGES = {"help": 1, "advice": 1, "gift": 1, "threat": -1, "challenge": -1}
+
+
+def structured_turn_request(
+    plan: TurnPlan,
+    world: WorldState,
+    arc_hint: str,
+    story_context: str,
+    memory: str = "",
+) -> LLMRequest:
+    """Build the single request that generates a whole turn as one JSON object."""
+    template = STORY_PREFIX + """{memory}PLAYER'S ACTION:
+{action}
+
+{event}{arc_hint}TASK: Continue the story, then suggest what the player could do next. Reply with a JSON object with these fields:
+- "twist": {twist}
+- "continuation": the story continued in 2-4 paragraphs. Acknowledge the player's action and weave in the twist. Don't describe the player's actions for them - just describe what happens as a result.
+- "suggestions": 3-4 short (2-5 words), action-oriented things the player could do next.
+- "new_character": {new_character}
+- "relationship_changes": characters whose feelings towards the player changed this turn, as {{"name": ..., "change": 1 or -1}}; usually empty."""
+    event = ""
+    twist = "an empty string."
+    if plan.event == "interaction":
+        char = world.get_character(plan.character)
+        event = f"""CHARACTER:
+{char.name} ({', '.join(char.traits)}), relationship with the player: {char.relationship.name}
+
+"""
+        twist = f"a short interaction (1-2 sentences) where {char.name} {plan.interaction_type}s the player."
+    elif plan.event == "twist":
+        twist = "a short, surprising narrative twist (1-2 sentences) relevant to the action."
+    new_character = "null."
+    if plan.discover_character:
+        new_character = (f"a new {', '.join(plan.new_character_traits)} character the player glimpses in this turn, "
+                         '{"name": a fantasy name, "description": one sentence}.')
+
+    builder = PromptBuilder("turn", template, STORY_SYSTEM_PROMPT)
+    builder.add("action", plan.action, required=True)
+    builder.add("event", event, required=True)
+    builder.add("twist", twist, required=True)
+    builder.add("new_character", new_character, required=True)
+    builder.add("arc_hint", f'NARRATIVE ARC HINT:\n{arc_hint}\n\n', priority=2, keep="head")
+    builder.add("story", story_context, priority=1)
+    builder.add("memory", f'RELEVANT EARLIER EVENTS:\n{memory}\n\n' if memory else '', keep="head")
+    request = builder.request()
+    request.response_schema = TURN_SCHEMA
+    return request
+
+
+def parse_turn_response(text: str, plan: TurnPlan, world: WorldState) -> Dict[str, Any]:
+    """Validate a structured turn reply and turn it into the turn's outcome.
+
+    Raises LLMResponseError if there is no usable continuation. Other
+    invalid fields are replaced by safe values, with a warning.
+    """
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise LLMResponseError(f"Structured turn is not valid JSON: {e}") from e
+    if not isinstance(data, dict) or not isinstance(data.get("continuation"), str) or not data["continuation"].strip():
+        raise LLMResponseError("Structured turn has no continuation")
+
+    twist = data.get("twist")
+    if not isinstance(twist, str):
+        logger.warning("Ignoring invalid twist in structured turn: %r", twist)
+        twist = ""
+    twist = twist.strip() if plan.event != "none" else ""
+
+    suggestions = data.get("suggestions")
+    if isinstance(suggestions, list) and suggestions and all(isinstance(s, str) and s.strip() for s in suggestions):
+        suggestions = [s.strip() for s in suggestions[:4]]
+    else:
+        logger.warning("Invalid suggestions in structured turn, using defaults: %r", suggestions)
+        suggestions = list(DEFAULT_SUGGESTIONS)
+
+    new_character = None
+    proposed = data.get("new_character")
+    if plan.discover_character and isinstance(proposed, dict):
+        name = str(proposed.get("name") or "").strip().strip('"\'')
+        if name and name not in world.characters:
+            new_character = {
+                "name": name,
+                "description": str(proposed.get("description") or "").strip()
+                or f"A {plan.new_character_traits[0]} figure you've just encountered.",
+                "traits": plan.new_character_traits,
+            }
+
+    relationship_changes: Dict[str, int] = {}
+    changes = data.get("relationship_changes")
+    for change in changes if isinstance(changes, list) else []:
+        if not isinstance(change, dict) or change.get("name") not in world.characters:
+            continue
+        if isinstance(change.get("change"), int) and change["change"]:
+            relationship_changes[change["name"]] = max(-1, min(1, change["change"]))
+    interacted_with = None
+    if plan.event == "interaction" and twist:
+        interacted_with = plan.character
+        if plan.interaction_type in INTERACTION_CHANGES:
+            relationship_changes[plan.character] = INTERACTION_CHANGES[plan.interaction_type]
+
+    return {
+        "twist": twist,
+        "relationship_changes": relationship_changes,
+        "interacted_with": interacted_with,
+        "new_character": new_character,
+        "continuation": data["continuation"],
+        "suggestions": suggestions,
+    }
+
+
+class TurnStreamDecoder:
+    """Turns the streamed JSON of a structured turn into story text as it arrives.
+
+    feed() returns the text to show for each chunk: nothing until the
+    continuation starts, then the turn header followed by the continuation
+    as it is decoded.
+    """
+
+    _CONTINUATION = re.compile(r'"continuation"\s*:\s*"')
+    _TWIST = re.compile(r'"twist"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+    def __init__(self, action: str, show_twist: bool = True):
+        self.action = action
+        self.show_twist = show_twist
+        self.buffer = ""
+        self._pos: Optional[int] = None  # Next undecoded character of the continuation
+        self._done = False
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        if self._done:
+            return ""
+        text = ""
+        if self._pos is None:
+            match = self._CONTINUATION.search(self.buffer)
+            if match is None:
+                return ""
+            self._pos = match.end()
+            twist = self._TWIST.search(self.buffer, 0, match.start())
+            text = format_turn_header(self.action, json.loads(twist.group(1)).strip() if twist and self.show_twist else "")
+        return text + self._decode()
+
+    def _decode(self) -> str:
+        buffer, i, parts = self.buffer, self._pos, []
+        while i < len(buffer):
+            ch = buffer[i]
+            if ch == '"':
+                self._done = True
+                break
+            if ch != "\\":
+                parts.append(ch)
+                i += 1
+                continue
+            # An escape; wait for the rest of it if it is split across chunks
+            length = 6 if buffer[i + 1:i + 2] == "u" else 2
+            if length == 6 and "\\ud800" <= buffer[i:i + 6].lower() <= "\\udbff":
+                length = 12  # High surrogate: decode it together with its pair
+            if i + length > len(buffer):
+                break
+            parts.append(json.loads(f'"{buffer[i:i + length]}"'))
+            i += length
+        self._pos = i
+        return "".join(parts)
+
+
+def build_turn_pipeline(
+    plan: TurnPlan,
+    context: StoryContext,
+    world: WorldState,
+    arc_progress: int,
+    tracer: Optional[Tracer] = None,
+    memory: Optional[StoryMemory] = None,
+    structured: bool = False,
+) -> Pipeline:
+    """Describe one turn as a graph of steps.
+
+    The event (twist or interaction) and the new-character name only need
+    the pre-turn story, so they run concurrently; the continuation waits
+    for both, and the next suggestions wait for the continuation.
+
+    A procedural plan fills the event and name from the template tables
+    instead, leaving the continuation and suggestions as the only calls.
+
+    A structured turn is a single schema-constrained call that returns all
+    of these at once, so the story is sent to the model once per turn.
+    """
+
+    # Built once, so every prompt of the turn starts with the same story even if a summary lands mid-turn
+    story = context.build(STORY_BUDGET)
+
+    def recall(twist: str) -> str:
+        if memory is None:
+            return ""
+        # Earlier turns about this action, twist or character; the unfolded turns are already in the context
+        query = " ".join(filter(None, [plan.action, twist, plan.character]))
+        return memory.recall(query, before=context.state()[1])
+
+    if structured:
+        def build_turn(results):
+            return structured_turn_request(
+                plan, world, get_arc_hint(arc_progress), story, recall("")
+            )
+
+        def finish_outcome(results, text):
+            outcome = results["turn"]
+            return {field: outcome[field] for field in ("twist", "relationship_changes", "interacted_with", "new_character")}
+
+        return Pipeline([
+            Step("turn", build_turn, lambda results, text: parse_turn_response(text, plan, world), stream=True),
+            # The other steps only unpack the reply, so the result has the same shape as a multi-call turn
+            Step("twist", lambda results: None, finish_outcome, deps=("turn",)),
+            Step("continuation", lambda results: None, lambda results, text: results["turn"]["continuation"],
+                 deps=("turn",)),
+            Step("suggestions", lambda results: None, lambda results, text: results["turn"]["suggestions"],
+                 deps=("turn",)),
+        ], tracer)
+
+    def build_event(results):
+        if plan.procedural:
+            return None
+        if plan.event == "interaction":
+            char = world.get_character(plan.character)
+            return interaction_request(char, plan.interaction_type, story)
+        if plan.event == "twist":
+            return twist_request(plan.action, story)
+        return None
+
+    def procedural_event(results):
+        # Seeded by the plan, so a speculated turn and its replay tell the same event
+        generator = TwistGenerator(random.Random(plan.seed))
+        if plan.event == "interaction":
+            char = world.get_character(plan.character)
+            return generator.interaction(char, plan.interaction_type, world.current_location, world.time_of_day)
+        return generator.twist(world.current_location, world.time_of_day)
+
+    def finish_event(results, text):
+        return procedural_event(results) if plan.procedural else (text or "").strip()
+
+    def build_name(results):
+        return None if plan.procedural else character_name_request()
+
+    def procedural_name(results):
+        return NAME_GENERATOR.name(taken=world.characters, rng=random.Random(plan.seed + 1))
+
+    def finish_name(results, text):
+        return procedural_name(results) if plan.procedural else (text or "").strip().strip('"\'')
+
+    def finish_twist(results, text):
+        twist = results.get("event") or ""
+        outcome = {"twist": twist, "relationship_changes": {}, "interacted_with": None, "new_character": None}
+        if not twist:
+            return outcome
+        if plan.event == "interaction":
+            # Update relationship based on interaction
+            if plan.interaction_type in INTERACTION_CHANGES:
+                outcome["relationship_changes"][plan.character] = INTERACTION_CHANGES[plan.interaction_type]
+            outcome["interacted_with"] = plan.character
+        new_char_name = results.get("character_name")
+        if new_char_name and new_char_name not in world.characters:
+            outcome["new_character"] = {
+                "name": new_char_name,
+                "description": f"A {plan.new_character_traits[0]} figure you've just encountered.",
+                "traits": plan.new_character_traits,
+            }
+            outcome["twist"] = twist + f"\n\nYou notice {new_char_name} watching you from a distance..."
+        return outcome
+
+    def build_continuation(results):
+        return continuation_request(
+            plan.action,
+            results["twist"]["twist"],
+            get_arc_hint(arc_progress),
+            story,
+            recall(results["twist"]["twist"]),
+        )
+
+    def build_suggestions(results):
+        update_text = format_turn_header(plan.action, results["twist"]["twist"]) + results["continuation"]
+        # The finished turn extends the story, as it will in the next turn's prompts
+        return suggestions_request(story + "\n\n" + update_text.strip())
+
+    # A failed or shed event or name call is told by the procedural generator instead
+    steps = [Step("event", build_event, finish_event, optional=True, fallback=procedural_event)]
+    twist_deps: Tuple[str, ...] = ("event",)
+    if plan.discover_character:
+        steps.append(Step("character_name", build_name, finish_name, optional=True, fallback=procedural_name))
+        twist_deps = ("event", "character_name")
+    steps += [
+        Step("twist", lambda results: None, finish_twist, deps=twist_deps),
+        Step("continuation", build_continuation, lambda results, text: text or "", deps=("twist",), stream=True),
+        Step("suggestions", build_suggestions, lambda results, text: parse_suggestions(text or ""),
+             deps=("continuation",), optional=True),
+    ]
+    return Pipeline(steps, tracer)
+
+
+async def arun_turn(
+    plan: TurnPlan,
+    context: StoryContext,
+    world: WorldState,
+    arc_progress: int,
+    complete: Callable[[LLMRequest], Awaitable[Any]],
+    stream: Optional[Callable[[LLMRequest, Dict[str, Any]], Awaitable[str]]] = None,
+    tracer: Optional[Tracer] = None,
+    memory: Optional[StoryMemory] = None,
+    structured: bool = False,
+    on_progress: Optional[Callable[[str, str], None]] = None,
+) -> TurnResult:
+    """Run one turn and return its outcome without touching the world state.
+
+    Raises LLMError if the continuation cannot be generated.
+    """
+    started_at = time.time()
+    pipeline = build_turn_pipeline(plan, context, world, arc_progress, tracer, memory, structured)
+    pipeline.on_progress = on_progress
+    results = await pipeline.arun(complete, stream)
+    return _turn_result(plan, pipeline, results, started_at)
+
+
+def _turn_result(plan: TurnPlan, pipeline: Pipeline, results: Dict[str, Any], started_at: float) -> TurnResult:
+    outcome = results["twist"]
+    return TurnResult(
+        action=plan.action,
+        twist=outcome["twist"],
+        relationship_changes=outcome["relationship_changes"],
+        interacted_with=outcome["interacted_with"],
+        new_character=outcome["new_character"],
+        continuation=results["continuation"],
+        suggestions=results["suggestions"] or list(DEFAULT_SUGGESTIONS),
+        started_at=started_at,
+        prompt_tokens=sum(usage[0] for usage in pipeline.usage.values()),
+        completion_tokens=sum(usage[1] for usage in pipeline.usage.values()),
+    )
+
+
+def apply_turn(world: WorldState, result: TurnResult):
+    """Apply the world changes of a finished turn."""
+    for name, change in result.relationship_changes.items():
+        world.update_character_relationship(name, change)
+    if result.interacted_with:
+        char = world.get_character(result.interacted_with)
+        if char:
+            # Update last interaction time
+            char.last_interaction = "Just now"
+    if result.new_character:
+        world.add_character(
+            result.new_character["name"],
+            result.new_character["description"],
+            result.new_character["traits"],
+        )
@@ -0,0 +1,312 @@
+from typing import Any, Callable, Iterable, List, Dict, Optional
+from enum import Enum
+
+import numpy as np
+
+class RelationshipLevel(Enum):
+    HOSTILE = -2
+    UNFRIENDLY = -1
+    NEUTRAL = 0
+    FRIENDLY = 1
+    TRUSTED = 2
+    ALLY = 3
+
+MIN_POINTS = -10
+MAX_POINTS = 10
+
+# Highest relationship points of each level, lowest level first
+_LEVEL_CEILINGS = [
+    (-7, RelationshipLevel.HOSTILE),
+    (-3, RelationshipLevel.UNFRIENDLY),
+    (2, RelationshipLevel.NEUTRAL),
+    (6, RelationshipLevel.FRIENDLY),
+    (9, RelationshipLevel.TRUSTED),
+    (MAX_POINTS, RelationshipLevel.ALLY),
+]
+
+# Level value for every point total, indexed by points - MIN_POINTS
+LEVEL_TABLE = np.array([
+    next(level.value for ceiling, level in _LEVEL_CEILINGS if points <= ceiling)
+    for points in range(MIN_POINTS, MAX_POINTS + 1)
+], dtype=np.int8)
+
+_LEVELS_BY_VALUE = {level.value: level for level in RelationshipLevel}
+
+
+def level_for_points(points: int) -> RelationshipLevel:
+    return _LEVELS_BY_VALUE[int(LEVEL_TABLE[points - MIN_POINTS])]
+
+
+class Character:
+    """A character record; relationship state lives in the owning WorldState's arrays."""
+
+    __slots__ = ("name", "description", "traits", "_last_interaction", "_world", "_id")
+
+    def __init__(self, world: "WorldState", char_id: int, name: str, description: str,
+                 traits: List[str] = None, last_interaction: str = ""):
+        self.name = name
+        self.description = description
+        self.traits = traits or []
+        self._last_interaction = last_interaction
+        self._world = world
+        self._id = char_id
+
+    @property
+    def relationship_points(self) -> int:
+        return int(self._world._points[self._id])
+
+    @property
+    def relationship(self) -> RelationshipLevel:
+        return _LEVELS_BY_VALUE[int(self._world._levels[self._id])]
+
+    @property
+    def last_interaction(self) -> str:
+        return self._last_interaction
+
+    @last_interaction.setter
+    def last_interaction(self, value: str):
+        self._last_interaction = value
+        self._world._changed()
+        self._world._interaction_at[self._id] = self._world._char_at[self._id] = self._world.version
+
+    def update_relationship(self, change: int):
+        """Update relationship level based on points"""
+        self._world._update_ids(np.array([self._id]), change)
+
+    def __repr__(self) -> str:
+        return f"Character({self.name!r}, {self.relationship.name}, {self.relationship_points})"
+
+class WorldState:
+    """Characters, places and time of the story world.
+
+    Relationship points and levels are kept in NumPy arrays indexed by
+    character id, so updating a whole group of characters is one
+    vectorized operation and levels come from LEVEL_TABLE.
+
+    Every change bumps version and stamps the changed field with it, so
+    delta(since) lists just what changed after a given version and
+    apply_delta replays it on another copy. Each consumer (the session
+    journal, a view's cache) keeps its own version to ask from. Quests
+    and the list of locations are not tracked; they are in snapshots only.
+    """
+
+    def __init__(self, capacity: int = 16):
+        self._dict_cache: Optional[Dict] = None
+        self._dict_version = 0
+        self.version = 0  # Bumped on every change, so views can tell when to rebuild
+        self.characters: Dict[str, Character] = {}
+        self._by_id: List[Character] = []
+        self._points = np.zeros(capacity, dtype=np.int8)
+        self._levels = np.full(capacity, RelationshipLevel.NEUTRAL.value, dtype=np.int8)
+        # Version of each character's last change, in any field and by field
+        self._char_at = np.zeros(capacity, dtype=np.int64)
+        self._added_at = np.zeros(capacity, dtype=np.int64)
+        self._points_at = np.zeros(capacity, dtype=np.int64)
+        self._interaction_at = np.zeros(capacity, dtype=np.int64)
+        self._field_at: Dict[str, int] = {}
+        self.locations = ["Village Square", "Dark Forest", "Mystic Caverns", "Abandoned Tower"]
+        self.current_location = "Village Square"
+        self.time_of_day = "morning"
+        self.quests = {}
+        # Called with each newly registered character
+        self.character_listeners: List[Callable[[Character], None]] = []
+
+    def _changed(self):
+        self.version += 1
+
+    def _set_field(self, name: str, value: str):
+        setattr(self, "_" + name, value)
+        self._changed()
+        self._field_at[name] = self.version
+
+    @property
+    def current_location(self) -> str:
+        return self._current_location
+
+    @current_location.setter
+    def current_location(self, value: str):
+        self._set_field("current_location", value)
+
+    @property
+    def time_of_day(self) -> str:
+        return self._time_of_day
+
+    @time_of_day.setter
+    def time_of_day(self, value: str):
+        self._set_field("time_of_day", value)
+
+    def _new_id(self) -> int:
+        char_id = len(self.characters)
+        if char_id == len(self._points):
+            capacity = 2 * len(self._points)
+            for name in ("_points", "_levels", "_char_at", "_added_at", "_points_at", "_interaction_at"):
+                setattr(self, name, np.resize(getattr(self, name), capacity))
+        self._points[char_id] = 0
+        self._levels[char_id] = RelationshipLevel.NEUTRAL.value
+        self._points_at[char_id] = self._interaction_at[char_id] = 0
+        return char_id
+
+    def _register(self, char: Character):
+        self.characters[char.name] = char
+        self._by_id.append(char)
+        self._added_at[char._id] = self._char_at[char._id] = self.version
+
+    def add_character(self, name: str, description: str, traits: List[str] = None):
+        if name not in self.characters:
+            char_id = self._new_id()
+            self._changed()
+            self._register(Character(self, char_id, name, description, traits))
+            for listener in self.character_listeners:
+                listener(self.characters[name])
+
+    def get_character(self, name: str) -> Optional[Character]:
+        return self.characters.get(name)
+
+    def _update_ids(self, ids: np.ndarray, change: int):
+        points = np.clip(self._points[ids].astype(np.int16) + change, MIN_POINTS, MAX_POINTS)
+        self._points[ids] = points
+        self._levels[ids] = LEVEL_TABLE[points - MIN_POINTS]
+        self._changed()
+        self._points_at[ids] = self._char_at[ids] = self.version
+
+    def update_character_relationship(self, name: str, change: int):
+        if name in self.characters:
+            self.characters[name].update_relationship(change)
+
+    def update_relationships(self, names: Iterable[str], change: int):
+        """Apply the same relationship change to many characters at once; unknown names are ignored."""
+        ids = np.fromiter((self.characters[name]._id for name in names if name in self.characters), dtype=np.intp)
+        if len(ids):
+            self._update_ids(ids, change)
+
+    def characters_with_trait(self, trait: str) -> List[str]:
+        return [name for name, char in self.characters.items() if trait in char.traits]
+
+    def _dict_entry(self, char: Character) -> Dict:
+        return {
+            "relationship": char.relationship.name,
+            "relationship_points": char.relationship_points,
+            "last_interaction": char.last_interaction,
+            "traits": char.traits
+        }
+
+    def to_dict(self):
+        # The debug panel renders this on every rerun; after the first build only changed entries are redone
+        if self._dict_cache is None:
+            self._dict_cache = {
+                "characters": {name: self._dict_entry(char) for name, char in self.characters.items()},
+                "current_location": self.current_location,
+                "time_of_day": self.time_of_day
+            }
+        elif self._dict_version != self.version:
+            characters = self._dict_cache["characters"]
+            for char_id in self._changed_since(self._dict_version):
+                char = self._by_id[char_id]
+                characters[char.name] = self._dict_entry(char)
+            self._dict_cache["current_location"] = self.current_location
+            self._dict_cache["time_of_day"] = self.time_of_day
+        self._dict_version = self.version
+        return self._dict_cache
+
+    def _changed_since(self, since: int) -> List[int]:
+        """Ids of the characters with any field changed after version since."""
+        return np.flatnonzero(self._char_at[:len(self._by_id)] > since).tolist()
+
+    def delta(self, since: int) -> Dict[str, Any]:
+        """What changed after version since, as a JSON-serializable dict for apply_delta.
+
+        Only the keys of fields that changed are present, besides "version",
+        the version the delta brings a copy up to.
+        """
+        delta: Dict[str, Any] = {"version": self.version}
+        for char_id in self._changed_since(since):
+            char = self._by_id[char_id]
+            if self._added_at[char_id] > since:
+                # Carries the character's current points and interaction as well
+                delta.setdefault("added", []).append({
+                    "name": char.name,
+                    "description": char.description,
+                    "traits": list(char.traits),
+                    "relationship_points": char.relationship_points,
+                    "last_interaction": char.last_interaction,
+                })
+                continue
+            if self._points_at[char_id] > since:
+                delta.setdefault("points", {})[char.name] = char.relationship_points
+            if self._interaction_at[char_id] > since:
+                delta.setdefault("last_interaction", {})[char.name] = char.last_interaction
+        for name, version in self._field_at.items():
+            if version > since:
+                delta[name] = getattr(self, name)
+        return delta
+
+    def apply_delta(self, delta: Dict[str, Any]):
+        """Apply a delta made by another world's delta(); changes to unknown characters are ignored."""
+        self._changed()
+        for data in delta.get("added", ()):
+            if data["name"] in self.characters:
+                continue
+            char = Character(self, self._new_id(), data["name"], data["description"], list(data["traits"]),
+                             data["last_interaction"])
+            self._register(char)
+            self._points[char._id] = data["relationship_points"]
+            self._levels[char._id] = LEVEL_TABLE[data["relationship_points"] - MIN_POINTS]
+            for listener in self.character_listeners:
+                listener(char)
+        points = delta.get("points")
+        if points:
+            known = [name for name in points if name in self.characters]
+            ids = np.fromiter((self.characters[name]._id for name in known), dtype=np.intp, count=len(known))
+            values = np.fromiter((points[name] for name in known), dtype=np.int16, count=len(known))
+            self._points[ids] = values
+            self._levels[ids] = LEVEL_TABLE[values - MIN_POINTS]
+            self._points_at[ids] = self._char_at[ids] = self.version
+        for name, value in delta.get("last_interaction", {}).items():
+            char = self.characters.get(name)
+            if char is not None:
+                char._last_interaction = value
+                self._interaction_at[char._id] = self._char_at[char._id] = self.version
+        for name in ("current_location", "time_of_day"):
+            if name in delta:
+                setattr(self, "_" + name, delta[name])
+                self._field_at[name] = self.version
+
+    def to_snapshot(self) -> Dict:
+        """Full JSON-serializable state, for saving a session."""
+        return {
+            "characters": [{
+                "name": char.name,
+                "description": char.description,
+                "relationship": char.relationship.name,
+                "relationship_points": char.relationship_points,
+                "last_interaction": char.last_interaction,
+                "traits": char.traits
+            } for char in self.characters.values()],
+            "locations": self.locations,
+            "current_location": self.current_location,
+            "time_of_day": self.time_of_day,
+            "quests": self.quests
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: Dict) -> "WorldState":
+        """Rebuild a world saved with to_snapshot."""
+        world = cls(capacity=max(16, len(data["characters"])))
+        world._changed()
+        for char in data["characters"]:
+            char_id = world._new_id()
+            world._register(Character(
+                world,
+                char_id,
+                char["name"],
+                char["description"],
+                list(char["traits"]),
+                char["last_interaction"]
+            ))
+            world._points[char_id] = char["relationship_points"]
+            world._levels[char_id] = RelationshipLevel[char["relationship"]].value
+        world.locations = list(data["locations"])
+        world.current_location = data["current_location"]
+        world.time_of_day = data["time_of_day"]
+        world.quests = dict(data["quests"])
+        return world